@@ -0,0 +1,542 @@
+import argparse
+import collections
+import conectivity
+import gc
+import logging
+import logs
+import messages
+import os
+import profiles
+import reference
+import simulator
+import socket
+import spool
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _createRegistration(cardReaderNumber):
+    """ Create a manual registration message as sent by the bridge
+    @param cardReaderNumber: Swiped card number
+    @return A manual registration message
+    """
+
+    return messages.MessageManualRegistration(
+                cardReaderNumber,
+                set([messages.MessageManualRegistration.Floor(1,
+                                                messages.MessageManualRegistration.Floor.DoorOpening.Types.FRONT),
+                     messages.MessageManualRegistration.Floor(210,
+                                                messages.MessageManualRegistration.Floor.DoorOpening.Types.BOTH)]),
+                messages.MessageManualRegistration.Attribution.Types.GENERAL,
+                0)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def benchmarkRegistrationEncoding(count, profilesCount, floorsCount):
+    """ Measure manual registration encodes per second, floor by floor against cached access profiles
+    @param count: Number of messages to encode
+    @param profilesCount: Number of distinct access profiles to cycle through
+    @param floorsCount: Number of accessible floors in each access profile
+    @return A tuple of per floor encodes per second and access profile encodes per second
+    """
+
+    Floor = messages.MessageManualRegistration.Floor
+    profiles = [set(Floor(1 + (profile * 7 + i * 13) % 255, 1 + (profile + i) % 3) for i in range(floorsCount))
+                for profile in range(profilesCount)]
+    attribution = messages.MessageManualRegistration.Attribution.Types.GENERAL
+
+    for i, profile in enumerate(profiles):
+        if reference.encodeRegistrationPerFloor(i % 256, profile, attribution, 0) != \
+                           messages.MessageManualRegistration(i % 256, profile, attribution, 0).getAsBytes():
+            raise AssertionError("Access profile encoding differs from per floor encoding for %s" % (profile, ))
+
+    start = time.perf_counter()
+
+    for i in range(count):
+        reference.encodeRegistrationPerFloor(i % 256, profiles[i % profilesCount], attribution, i % 256)
+
+    perFloorDuration = time.perf_counter() - start
+    start = time.perf_counter()
+
+    for i in range(count):
+        messages.MessageManualRegistration(i % 256, profiles[i % profilesCount], attribution, i % 256)
+
+    profileDuration = time.perf_counter() - start
+
+    return count / perFloorDuration, count / profileDuration
+
+#-----------------------------------------------------------------------------------------------------------------------
+def benchmarkProfileCache(logger, count, cardsCount, floorsCount):
+    """ Measure swipes per second turned into manual registrations, building the floors set of each swipe against 
+        looking the card's access profile up in the cache
+    @param logger: Logger
+    @param count: Number of swipes
+    @param cardsCount: Number of distinct cards
+    @param floorsCount: Number of accessible floors of each card
+    @return A tuple of per swipe floors set swipes per second, cached swipes per second and the cache hit rate
+    """
+
+    Floor = messages.MessageManualRegistration.Floor
+    attribution = messages.MessageManualRegistration.Attribution.Types.GENERAL
+    cardsCount = min(cardsCount, 256)
+
+    # Rows of accessible floors per card, as looked up in the ACS database
+    rows = [[(1 + (card * 7 + i * 13) % 255, 1 + (card + i) % 3) for i in range(floorsCount)] 
+            for card in range(cardsCount)]
+    start = time.perf_counter()
+
+    for i in range(count):
+        card = i % cardsCount
+        messages.MessageManualRegistration(card, set(Floor(number, doorOpening) for number, doorOpening in rows[card]),
+                                           attribution, 0)
+
+    perSwipeDuration = time.perf_counter() - start
+    cache = profiles.AccessProfileCache(logger, cardsCount)
+    cache.warmLoad((card, set(Floor(number, doorOpening) for number, doorOpening in rows[card])) 
+                   for card in range(cardsCount))
+    start = time.perf_counter()
+
+    for i in range(count):
+        cache.createRegistration(i % cardsCount, attribution)
+
+    cachedDuration = time.perf_counter() - start
+
+    return count / perSwipeDuration, count / cachedDuration, cache.hitRate
+
+#=======================================================================================================================
+class _EagerRegistrationResponse(object):
+    """ A registration response as the former MessageRegistrationResponse held it, eagerly decoded into an instance dict
+    """
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, bytes_):
+        """ C'tor
+        @param bytes_: A bytes-like object representing the response
+        """
+
+        self.__bytes = bytes_
+        self.__sequenceNumber = bytes_[5]
+        self.__assignedCarNumber = int(str(bytes_[6:9], "ascii"))
+        self.__assignedBankNumber = int(str(bytes_[9:], "ascii"))
+
+#=======================================================================================================================
+class _BuiltHealthCheck(object):
+    """ A health check as the former MessageHealthCheck built it, a new bytearray per instance
+    """
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self):
+        """ C'tor
+        """
+
+        self.__bytes = bytearray([messages.MessageInterface._HEADER_LENGTH_HEALTH_CHECK,
+                                  messages.MessageInterface._HEADER_VERSION,
+                                  0x00, 0x00,
+                                  messages.MessageInterface._COMMAND_HEALTH_CHECK,
+                                  0x00, 0x00, 0x00])
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _measureAllocations(create, count):
+    """ Measure the memory held by created objects
+    @param create: A callable which creates an object out of an index
+    @param count: Number of objects to create
+    @return A tuple of bytes and allocations per object
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = [create(i) for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    statistics = after.compare_to(before, "filename")
+
+    # The list holding the objects is not accounted to them
+    size = sum(statistic.size_diff for statistic in statistics) - sys.getsizeof(objects)
+    allocationsCount = sum(statistic.count_diff for statistic in statistics) - 1
+
+    return size / count, allocationsCount / count
+
+#-----------------------------------------------------------------------------------------------------------------------
+def benchmarkMessageAllocations(count):
+    """ Measure per message memory of the former dict based messages against the slotted ones
+    @param count: Number of messages to create of each kind
+    @return A dict of message kind to a tuple of bytes and allocations per message
+    """
+
+    receiveBuffer = memoryview(b"".join(bytes([0x06, 0x41, 0x00, 0x00, 0x90, i % 256]) + b"0123"
+                                        for i in range(count)))
+    frames = [receiveBuffer[i * 10 : (i + 1) * 10] for i in range(count)]
+
+    return collections.OrderedDict([
+        ("Eager registration response", _measureAllocations(lambda i: _EagerRegistrationResponse(frames[i]), count)),
+        ("Registration response", _measureAllocations(lambda i: messages.MessageRegistrationResponse(frames[i]),
+                                                      count)),
+        ("Built health check", _measureAllocations(lambda i: _BuiltHealthCheck(), count)),
+        ("Health check", _measureAllocations(lambda i: messages.MessageHealthCheck(), count))])
+
+#-----------------------------------------------------------------------------------------------------------------------
+def benchmarkPollingSend(logger, count, idleTime):
+    """ Measure the throughput of the former polling connection loop, which sent one message per idle cycle
+    @param count: Number of messages to send
+    @param idleTime: Time to idle between cycles
+    @return Messages per second
+    """
+
+    controller = simulator.Controller(logger)
+    controller.start()
+    sock = socket.create_connection(("127.0.0.1", controller.port))
+    start = time.perf_counter()
+
+    for i in range(count):
+        sock.send(_createRegistration(i % 256).getAsBytes())
+        time.sleep(idleTime)
+
+    controller.waitForRegistrations(count)
+    duration = time.perf_counter() - start
+    sock.close()
+    controller.stop()
+
+    return count / duration
+
+#-----------------------------------------------------------------------------------------------------------------------
+def benchmarkBatchedSend(logger, count, maxBatchBytes, maxBatchMessages, flushLatency):
+    """ Measure the throughput of the batched connection send path
+    @param logger: Logger
+    @param count: Number of messages to send
+    @param maxBatchBytes: Maximal size in bytes of messages sent in a single socket write
+    @param maxBatchMessages: Maximal number of messages sent in a single socket write
+    @param flushLatency: Maximal time in seconds to hold enqueued messages back while waiting for a full batch
+    @return Messages per second
+    """
+
+    controller = simulator.Controller(logger)
+    controller.start()
+    connection = conectivity.Connection(logger, "127.0.0.1", controller.port, 4096, 60, 0.1, 5,
+                                        maxBatchBytes, maxBatchMessages, flushLatency)
+    registrations = [_createRegistration(i % 256) for i in range(count)]
+    connection.start()
+    start = time.perf_counter()
+
+    for registration in registrations:
+        connection.sendBlocking(registration)
+
+    controller.waitForRegistrations(count)
+    duration = time.perf_counter() - start
+    connection.stop()
+    controller.stop()
+
+    return count / duration
+
+#-----------------------------------------------------------------------------------------------------------------------
+def benchmarkEndToEnd(logger, readersCount, duration, controllerArgs):
+    """ Measure swipe to response latency and sustained registrations per second of concurrent card readers, each 
+        swiping again as soon as its previous swipe was responded
+    @param logger: Logger
+    @param readersCount: Number of concurrent card readers
+    @param duration: Time in seconds to swipe for
+    @param controllerArgs: A dict of keyword arguments of the simulated controller
+    @return A tuple of responded registrations per second, a dict of latency percentile to seconds and number of 
+            swipes which were never responded
+    """
+
+    controller = simulator.Controller(logger, **controllerArgs)
+    controller.start()
+    connection = conectivity.Connection(logger, "127.0.0.1", controller.port, 4096, 60, 0.1, 0.1)
+    connection.start()
+    latencies = []
+    failures = []
+    end = time.perf_counter() + duration
+
+    def swipe(cardReaderNumber):
+        registration = _createRegistration(cardReaderNumber)
+
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+
+            try:
+                connection.sendRequest(registration, 0.5, 3).result()
+                latencies.append(time.perf_counter() - start)
+
+            except Exception:
+                failures.append(cardReaderNumber)
+
+    readers = [threading.Thread(target = swipe, args = (i % 256, )) for i in range(readersCount)]
+    start = time.perf_counter()
+
+    for reader in readers:
+        reader.start()
+
+    for reader in readers:
+        reader.join()
+
+    elapsed = time.perf_counter() - start
+    connection.stop()
+    controller.stop()
+
+    quantiles = statistics.quantiles(latencies, n = 100, method = "inclusive") if len(latencies) > 1 else [0] * 99
+    percentiles = collections.OrderedDict((percentile, quantiles[percentile - 1]) for percentile in (50, 90, 99))
+
+    return len(latencies) / elapsed, percentiles, len(failures)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def benchmarkRecovery(logger, failure, healthCheckPeriod, healthCheckTimeout):
+    """ Measure the time it takes a connection to serve swipes again after its controller failed
+    @param logger: Logger
+    @param failure: "restart" for a controller which closes its connections and comes right back, "blackhole" for a 
+                    controller which stops answering without closing its connections
+    @param healthCheckPeriod: Period in seconds in which a health check message will be sent
+    @param healthCheckTimeout: Time in seconds to wait for a health check to be echoed
+    @return Time in seconds from the failure until a swipe was responded again
+    """
+
+    controller = simulator.Controller(logger)
+    controller.start()
+    connection = conectivity.Connection(logger, "127.0.0.1", controller.port, 4096, healthCheckPeriod, 0.1, 1,
+                                        healthCheckTimeout = healthCheckTimeout)
+    connection.start()
+    registration = _createRegistration(1)
+
+    def swipeUntilResponded():
+        while True:
+            try:
+                return connection.sendRequest(registration, 0.05, 0).result()
+
+            except Exception:
+                pass
+
+    swipeUntilResponded()
+    start = time.perf_counter()
+
+    if failure == "restart":
+        port = controller.port
+        controller.stop()
+        controller = simulator.Controller(logger, port = port)
+        controller.start()
+
+    else:
+        controller.blackHoleConnections()
+
+    swipeUntilResponded()
+    elapsed = time.perf_counter() - start
+    connection.stop()
+    controller.stop()
+
+    return elapsed
+
+#-----------------------------------------------------------------------------------------------------------------------
+def benchmarkHealthChecks(logger, connectionsCount, duration, healthCheckPeriod):
+    """ Measure the health checks sent by a pool of connections to a single controller, while swiping and while idle
+    @param logger: Logger
+    @param connectionsCount: Number of connections in the pool
+    @param duration: Time in seconds to swipe for, and then to idle for
+    @param healthCheckPeriod: Time in seconds without any message received after which a health check is sent
+    @return A tuple of health checks sent per connection per second while swiping and while idle
+    """
+
+    controller = simulator.Controller(logger)
+    controller.start()
+    pool = conectivity.ConnectionPool(logger, dict(("controller%s" % (i, ), ("127.0.0.1", controller.port))
+                                                   for i in range(connectionsCount)),
+                                      4096, healthCheckPeriod, 1, healthCheckTimeout = healthCheckPeriod * 3)
+    pool.start()
+
+    def countHealthChecks():
+        return sum(metrics_.messagesSent[messages.MessageInterface._COMMAND_HEALTH_CHECK]
+                   for metrics_ in pool.metrics.values())
+
+    # Let all connections establish and send their first health check
+    time.sleep(healthCheckPeriod * 2)
+    healthChecksCount = countHealthChecks()
+    end = time.monotonic() + duration
+    registration = _createRegistration(1)
+
+    while time.monotonic() < end:
+        pool.sendRequest(registration, 1, 0).result()
+
+    busyHealthChecksCount = countHealthChecks() - healthChecksCount
+    healthChecksCount = countHealthChecks()
+    time.sleep(duration)
+    idleHealthChecksCount = countHealthChecks() - healthChecksCount
+    pool.stop()
+    controller.stop()
+
+    return (busyHealthChecksCount / connectionsCount / duration, idleHealthChecksCount / connectionsCount / duration)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def benchmarkSync(logger, count, cardsCount, deltaMode):
+    """ Measure a bulk sync of access rights, where most updates repeat the current rights of their card
+    @param logger: Logger
+    @param count: Number of updates
+    @param cardsCount: Number of distinct cards
+    @param deltaMode: Whether the connection skips and coalesces updates of unchanged rights
+    @return A tuple of updates per second and registrations received by the controller
+    """
+
+    Floor = messages.MessageManualRegistration.Floor
+    attribution = messages.MessageManualRegistration.Attribution.Types.GENERAL
+    cardsCount = min(cardsCount, 256)
+
+    # Every tenth update of a card changes its rights
+    updates = [messages.MessageManualRegistration(i % cardsCount, set([Floor(1 + (i // (cardsCount * 10)) % 255, 1)]),
+                                                  attribution, 0) for i in range(count)]
+    controller = simulator.Controller(logger)
+    controller.start()
+    connection = conectivity.Connection(logger, "127.0.0.1", controller.port, 4096, 60, 0.1, 1, 
+                                        deltaMode = deltaMode)
+    connection.start()
+    start = time.perf_counter()
+
+    for future in [connection.sendRequest(update) for update in updates]:
+        future.result()
+
+    elapsed = time.perf_counter() - start
+    connection.stop()
+    controller.stop()
+
+    return count / elapsed, controller.registrationsCount
+
+#-----------------------------------------------------------------------------------------------------------------------
+def benchmarkLogging(count, handlerLatency):
+    """ Measure the time the sending thread spends logging sent messages through a slow handler, writing records
+        right away against handing them to a background thread with rate limiting
+    @param count: Number of messages to log
+    @param handlerLatency: Time in seconds the handler takes to write a record
+    @return A tuple of messages logged per second directly and through the queue
+    """
+
+    class SlowHandler(logging.Handler):
+        def emit(self, record):
+            self.format(record)
+            time.sleep(handlerLatency)
+
+    registrations = [_createRegistration(i % 256) for i in range(256)]
+    rates = []
+
+    for isQueued in (False, True):
+
+        logger = logging.getLogger("benchmarkLogging%s" % (isQueued, ))
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(SlowHandler())
+        listener = logs.startQueueLogging(logger) if isQueued else None
+        start = time.perf_counter()
+
+        for i in range(count):
+            logger.info("Sending message: %s", registrations[i % 256], extra = logs.RATE_LIMIT)
+
+        rates.append(count / (time.perf_counter() - start))
+
+        if listener is not None:
+            listener.stop()
+
+    return tuple(rates)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def benchmarkSpool(logger, count, commitLatency):
+    """ Measure the throughput of spooling registrations, each appended and then acknowledged
+    @param logger: Logger
+    @param count: Number of registrations to spool
+    @param commitLatency: Maximal time in seconds an append waits before it is flushed, None to flush every append
+    @return Registrations per second
+    """
+
+    frames = [_createRegistration(i % 256).getAsBytes() for i in range(count)]
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        spool_ = spool.Spool(logger, os.path.join(directory, "benchmark.spool"), commitLatency = commitLatency)
+        start = time.perf_counter()
+
+        for frame in frames:
+            spool_.acknowledge(spool_.append(frame, None))
+
+        spool_.close()
+
+        return count / (time.perf_counter() - start)
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "E-LIP ACS bridge benchmarks")
+    parser.add_argument("--count", type = int, default = 10000, help = "Number of messages to send")
+    parser.add_argument("--polling-count", type = int, default = 20,
+                        help = "Number of messages to send through the polling loop")
+    parser.add_argument("--idle-time", type = float, default = 0.1, help = "Polling loop idle time")
+    parser.add_argument("--max-batch-bytes", type = int, default = 65536)
+    parser.add_argument("--max-batch-messages", type = int, default = 256)
+    parser.add_argument("--flush-latency", type = float, default = 0)
+    parser.add_argument("--profiles", type = int, default = 300, help = "Number of distinct access profiles")
+    parser.add_argument("--floors", type = int, default = 40, help = "Number of floors in an access profile")
+    parser.add_argument("--readers", type = int, default = 32, help = "Number of concurrent card readers")
+    parser.add_argument("--duration", type = float, default = 5, help = "Time in seconds to swipe for")
+    parser.add_argument("--latency", type = float, default = 0.002, help = "Simulated controller latency")
+    parser.add_argument("--jitter", type = float, default = 0.001, help = "Simulated controller jitter")
+    parser.add_argument("--fragment-size", type = int, default = None, help = "Simulated response fragment size")
+    parser.add_argument("--drop-rate", type = float, default = 0, help = "Simulated response drop probability")
+    parser.add_argument("--disconnect-rate", type = float, default = 0,
+                        help = "Simulated disconnect probability per frame")
+    parser.add_argument("--health-check-period", type = float, default = 0.1,
+                        help = "Health check period of the recovery benchmark")
+    parser.add_argument("--health-check-timeout", type = float, default = 0.3,
+                        help = "Health check timeout of the recovery benchmark")
+    parser.add_argument("--connections", type = int, default = 100, help = "Number of connections in a pool")
+    parser.add_argument("--logging-count", type = int, default = 200, help = "Number of messages to log")
+    parser.add_argument("--handler-latency", type = float, default = 0.001, 
+                        help = "Time in seconds a log handler takes to write a record")
+    parser.add_argument("--spool-count", type = int, default = 2000, 
+                        help = "Number of registrations to spool with a flush each")
+    parser.add_argument("--commit-latency", type = float, default = 0.005, help = "Spool group commit latency")
+    args = parser.parse_args()
+
+    logger = logging.getLogger('logger')
+    logger.setLevel(logging.WARNING)
+    logger.addHandler(logging.StreamHandler())
+
+    for kind, (size, allocationsCount) in benchmarkMessageAllocations(args.count).items():
+        print("%s: %.1f bytes/message, %.2f allocations/message" % (kind, size, allocationsCount))
+
+    perFloorRate, profileRate = benchmarkRegistrationEncoding(args.count, args.profiles, args.floors)
+    print("Per floor encoding: %.1f encodes/s" % (perFloorRate, ))
+    print("Access profile encoding: %.1f encodes/s" % (profileRate, ))
+
+    perSwipeRate, cachedRate, hitRate = benchmarkProfileCache(logger, args.count, args.profiles, args.floors)
+    print("Per swipe floors set: %.1f swipes/s" % (perSwipeRate, ))
+    print("Cached access profile: %.1f swipes/s, %.1f%% hits" % (cachedRate, hitRate * 100))
+    print("Polling send: %.1f messages/s" % (benchmarkPollingSend(logger, args.polling_count, args.idle_time), ))
+    print("Batched send: %.1f messages/s" % (benchmarkBatchedSend(logger, args.count, args.max_batch_bytes,
+                                                                  args.max_batch_messages, args.flush_latency), ))
+
+    rate, percentiles, failuresCount = benchmarkEndToEnd(logger, args.readers, args.duration,
+                                                         {"latency": args.latency, "jitter": args.jitter,
+                                                          "fragmentSize": args.fragment_size,
+                                                          "dropRate": args.drop_rate,
+                                                          "disconnectRate": args.disconnect_rate})
+    print("End to end: %.1f registrations/s, %s, %s unanswered" % (
+                    rate, ", ".join("p%s %.2f ms" % (percentile, latency * 1000)
+                                    for percentile, latency in percentiles.items()), failuresCount))
+
+    for failure in ("restart", "blackhole"):
+        print("Recovery after %s: %.1f ms" % (failure, benchmarkRecovery(logger, failure, args.health_check_period,
+                                                                         args.health_check_timeout) * 1000))
+
+    busyRate, idleRate = benchmarkHealthChecks(logger, args.connections, args.duration, args.health_check_period)
+    print("Health checks of %s connections: %.2f/s per connection swiping, %.2f/s per connection idle" % (
+                    args.connections, busyRate, idleRate))
+
+    for deltaMode in (False, True):
+        rate, registrationsCount = benchmarkSync(logger, args.count, args.profiles, deltaMode)
+        print("Sync%s: %.1f updates/s, %s of %s updates sent" % (", delta mode" if deltaMode else "", rate, 
+                                                                 registrationsCount, args.count))
+
+    directRate, queuedRate = benchmarkLogging(args.logging_count, args.handler_latency)
+    print("Logging through a slow handler: %.1f messages/s directly, %.1f messages/s queued" % (directRate, 
+                                                                                                 queuedRate))
+
+    print("Spool, flush per append: %.1f registrations/s" % (benchmarkSpool(logger, args.spool_count, None), ))
+    print("Spool, group commit: %.1f registrations/s" % (benchmarkSpool(logger, args.count, args.commit_latency), ))
@@ -2,6 +2,8 @@
 import conectivity
 import messages
 import logging
+import logs
+import metrics
 import time
 
 
@@ -18,9 +20,14 @@ if __name__ == '__main__':
     ch.setFormatter(formatter)
     # add the handlers to the logger
     logger.addHandler(ch)
+    # write records on a background thread, so a slow console never holds the connection up
+    listener = logs.startQueueLogging(logger)
     
     connection = conectivity.Connection(logger, "192.168.56.1", 60173, 4096, 60, 0.1, 5)
     connection.start()
+    # serve the connection metrics on a local port, as Prometheus text on /metrics and as JSON on /metrics.json
+    exporter = metrics.Exporter(logger, lambda: {"elip": connection.metrics}, 9464)
+    exporter.start()
     msg = messages.MessageManualRegistration(3,
                                              set([messages.MessageManualRegistration.Floor(1, messages.MessageManualRegistration.Floor.DoorOpening.Types.FRONT),
                                                   messages.MessageManualRegistration.Floor(210, messages.MessageManualRegistration.Floor.DoorOpening.Types.BOTH)]), 
@@ -40,4 +47,6 @@ if __name__ == '__main__':
     connection.send(msg)
     
     connection.stop()
+    exporter.stop()
+    listener.stop()
     
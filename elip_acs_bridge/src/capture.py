@@ -0,0 +1,173 @@
+import collections
+import messages
+import struct
+import threading
+import time
+
+#=======================================================================================================================
+class CaptureWriter(object):
+    """ Records the frames sent and received by a connection into a capture file, to be analyzed or replayed offline.
+        Recording costs a memory copy per socket operation, records are handed over to a background thread which
+        writes them through a large buffer, so the connection never waits on the disk.
+
+        File layout is a magic and the time.time() time of the time.monotonic() zero, followed by back to back records,
+        each of a direction byte, time.monotonic() timestamp, size of the data and the data itself, being whole E-LIP
+        frames as sent or received by a single socket operation.
+    """
+
+    MAGIC = b"ELIPCAP1"
+
+    DIRECTION_SENT     = 0
+    DIRECTION_RECEIVED = 1
+
+    FILE_HEADER = struct.Struct(">8sd")
+    RECORD_HEADER = struct.Struct(">BdI")
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, path, bufferSize = 1024 * 1024):
+        """ C'tor, creates the capture file or truncates an existing one
+        @param path: Path of the capture file
+        @param bufferSize: Size in bytes of data recorded before it is written to the file
+        """
+
+        self.__file = open(path, "wb", buffering = bufferSize)
+        self.__file.write(self.FILE_HEADER.pack(self.MAGIC, time.time() - time.monotonic()))
+
+        # Headers and data of records which were not written yet
+        self.__lock = threading.Lock()
+        self.__pendingChunks = []
+
+        self.__isClosed = False
+        self.__pendingEvent = threading.Event()
+        self.__writerThread = threading.Thread(target = self.__writer)
+        self.__writerThread.daemon = True
+        self.__writerThread.start()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def record(self, direction, buffers):
+        """ Record data of a single socket operation
+        @param direction: DIRECTION_SENT or DIRECTION_RECEIVED
+        @param buffers: A list of bytes-like objects of whole frames, which are copied so they may be reused once
+                        recorded
+        """
+
+        data = b"".join(buffers)
+        header = self.RECORD_HEADER.pack(direction, time.monotonic(), len(data))
+
+        with self.__lock:
+            wasEmpty = not self.__pendingChunks
+            self.__pendingChunks.append(header)
+            self.__pendingChunks.append(data)
+
+        # The writer is woken up once for everything recorded until it runs
+        if wasEmpty:
+            self.__pendingEvent.set()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """ Write whatever is recorded and close the capture file
+        """
+
+        if self.__isClosed:
+            return
+
+        self.__isClosed = True
+        self.__pendingEvent.set()
+        self.__writerThread.join()
+        self.__file.close()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __writer(self):
+        """ Writer thread target, writes records in order of recording until closed
+        """
+
+        while True:
+
+            self.__pendingEvent.wait()
+            self.__pendingEvent.clear()
+            isClosed = self.__isClosed
+
+            with self.__lock:
+                chunks, self.__pendingChunks = self.__pendingChunks, []
+
+            self.__file.writelines(chunks)
+
+            # Records made before closing were taken along
+            if isClosed:
+                break
+
+#=======================================================================================================================
+class CaptureReader(object):
+    """ Reads a capture file written by a CaptureWriter, a truncated last record is ignored
+    """
+
+    Record = collections.namedtuple("Record", "direction timestamp frames")
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, path):
+        """ C'tor
+        @param path: Path of the capture file
+        """
+
+        with open(path, "rb") as file_:
+            self.__bytes = file_.read()
+
+        if len(self.__bytes) < CaptureWriter.FILE_HEADER.size:
+            raise CaptureError("Not a capture file: %s" % (path, ))
+
+        magic, self.__wallTimeOffset = CaptureWriter.FILE_HEADER.unpack_from(self.__bytes)
+
+        if magic != CaptureWriter.MAGIC:
+            raise CaptureError("Not a capture file: %s" % (path, ))
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @property
+    def wallTimeOffset(self):
+        """ Time to add to a record's timestamp to get its time.time() time
+        """
+
+        return self.__wallTimeOffset
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __iter__(self):
+        """ Iterate over the records in order of recording
+        @return An iterator of Record tuples, where frames is a list of memoryview frames
+        """
+
+        view = memoryview(self.__bytes)
+        offset = CaptureWriter.FILE_HEADER.size
+
+        while offset + CaptureWriter.RECORD_HEADER.size <= len(view):
+
+            direction, timestamp, size = CaptureWriter.RECORD_HEADER.unpack_from(view, offset)
+            offset += CaptureWriter.RECORD_HEADER.size
+
+            if offset + size > len(view):
+                break
+
+            yield self.Record(direction, timestamp, self.__splitFrames(view[offset:offset + size]))
+            offset += size
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def __splitFrames(data):
+        """ Split recorded data into its frames by their length byte
+        @param data: A memoryview of whole frames
+        @return A list of memoryview frames
+        """
+
+        frames = []
+        offset = 0
+
+        while offset + messages.MessageInterface._SIZE_HEADER <= len(data):
+
+            frameEnd = offset + messages.MessageInterface._SIZE_HEADER + \
+                       data[offset + messages.MessageInterface.OFFSET_HEADER_DATA_LENGTH_FIELD]
+            frames.append(data[offset:frameEnd])
+            offset = frameEnd
+
+        return frames
+
+#=======================================================================================================================
+class CaptureError(Exception):
+    pass
@@ -1,110 +1,1632 @@
+import asyncio
+import capture
 import collections
-import errno
+import concurrent.futures
 import messages
+import logs
+import metrics
+import os
+import random
 import socket
+import spool
 import threading
 import time
+import timers
+
+#=======================================================================================================================
+class AsyncConnection(object):
+    
+    __SPOOL_REPLAY_TIMEOUT = 1.0
+    __SPOOL_REPLAY_RETRIES = 2
+    
+    # Everything which precedes the sequence number of a manual registration, i.e. card, floors and attribution
+    __SIZE_REGISTRATION_RIGHTS = messages.MessageManualRegistration.LAYOUT.size - 1
+    
+    def __init__(self, logger, hostname, port, receiveBuffSize, healthCheckPeriod, connectionRetryTimeout, 
+                 maxBatchBytes = 65536, maxBatchMessages = 256, flushLatency = 0, maxQueueSize = 1024, 
+                 timeToLive = None, minRetryTimeout = 0.05, connectTimeout = 1.0, healthCheckTimeout = None, 
+                 spoolPath = None, timerWheel = None, deltaMode = False, capturePath = None):
+        """ C'tor
+        @param logger: Logger 
+        @param hostname: Hostname of the E-LIP controller
+        @param port: TCP Port of the E-LIP controller
+        @param receiveBuffSize: Size in bytes of receiving buffer 
+        @param healthCheckPeriod: Time in seconds without any message received from the controller after which a 
+                                  health check message will be sent
+        @param connectionRetryTimeout: Maximal timeout in seconds between connection retries
+        @param maxBatchBytes: Maximal size in bytes of messages sent in a single socket write
+        @param maxBatchMessages: Maximal number of messages sent in a single socket write
+        @param flushLatency: Maximal time in seconds to hold enqueued messages back while waiting for a full batch
+        @param maxQueueSize: Maximal number of messages waiting to be sent
+        @param timeToLive: Default time in seconds an enqueued message stays relevant, None to never expire
+        @param minRetryTimeout: Timeout in seconds before the first connection retry, doubled on each further retry up
+                                to connectionRetryTimeout
+        @param connectTimeout: Time in seconds to wait for a connection to be established
+        @param healthCheckTimeout: Time in seconds to wait for a health check to be echoed before the connection is 
+                                   considered dead, None to rely on the socket alone
+        @param spoolPath: Path of a spool file which keeps requests until they are responded, so requests pending when
+                          the connection stops are sent again once it runs next, and requests which gave up before 
+                          their deadline are sent again once reconnected, None to keep requests in memory only
+        @param timerWheel: A timers.TimerWheel to schedule health checks on, shared by connections running on the same
+                           event loop, None for a wheel of its own
+        @param deltaMode: Whether requests only carry changes of access rights, e.g. while syncing the ACS database.
+                          A request whose card, floors and attribution were already acknowledged is not sent, and a 
+                          request which was not sent yet is replaced by a newer request of the same card. Not to be 
+                          used for swipes, which must be sent even if repeated.
+        @param capturePath: Path of a capture file to record all sent and received frames in, to be analyzed or 
+                            replayed offline, None not to record
+        """
+
+        self.__metrics = metrics.ConnectionMetrics()
+        self.__captureWriter = capture.CaptureWriter(capturePath) if capturePath is not None else None
+        self.__connector = _Connector(logger, hostname, port, receiveBuffSize, self.__metrics, connectTimeout, 
+                                      self.__captureWriter)
+        self.__logger = logger
+        self.__shouldRun = True
+        self.__healthCheckPeriod = healthCheckPeriod
+        self.__connectionRetryTimeout = connectionRetryTimeout
+        self.__minRetryTimeout = min(minRetryTimeout, connectionRetryTimeout)
+        self.__healthCheckTimeout = healthCheckTimeout
+        self.__queue = _OutboundQueue(logger, maxQueueSize, self.__onMessagesDropped)
+        self.__timeToLive = timeToLive
+        self.__maxBatchBytes = maxBatchBytes
+        self.__maxBatchMessages = maxBatchMessages
+        self.__flushLatency = flushLatency
+        self.__isAlive = False
+        self.__inFlightTable = _InFlightTable(logger, self.send, self.__queue.replace, self.__queue.remove, 
+                                              maxQueueSize, self.__metrics)
+        self.__deltaMode = deltaMode
+        self.__acknowledgedRights = {}
+        self.__healthCheckSentTime = None
+        self.__healthCheckQueuedTime = None
+        self.__lastReceivedTime = None
+        self.__smoothedRtt = None
+        self.__timerWheel = timerWheel if timerWheel is not None else timers.TimerWheel()
+        self.__healthCheckTimer = None
+        self.__deadPeerFuture = None
+        self.__spool = spool.Spool(logger, spoolPath) if spoolPath is not None else None
+        self.__failedSpooledRequests = collections.OrderedDict()
+        self.__metrics.queueDepthGetter = self.__queue.__len__
+        self.__metrics.queueAgeGetter = self.__queue.getOldestAge
+        self.__metrics.smoothedRttGetter = lambda: self.__smoothedRtt or 0
+        
+        # Loop and events are set by run() so they belong to the loop the connection is running on
+        self.__loop = None
+        self.__loopThreadId = None
+        self.__wakeupEvent = None
+        self.__spaceEvent = None
+        self.__stopEvent = None
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    @property
+    def isAlive(self): 
+        """ Whether the connection is up and the controller answered a health check or a registration since it was 
+            last established
+        """
+        
+        return self.__isAlive
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    @property
+    def healthCheckRtt(self): 
+        """ Smoothed round trip time in seconds of echoed health checks, a signal of the quality of the link to the
+            controller, None before the first echo
+        """
+        
+        return self.__smoothedRtt
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    @property
+    def queueSize(self): return len(self.__queue)
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    @property
+    def maxQueueSize(self): return self.__queue.maxSize
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    @property
+    def metrics(self): 
+        """ Metrics of the connection, a metrics.ConnectionMetrics which is safe to snapshot from any thread
+        """
+        
+        return self.__metrics
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def send(self, message, deadline = None):
+        """ Enqueue a message to be sent to E-LIP controller without blocking, safe to call from any thread
+        @param message: Message to send
+        @param deadline: time.monotonic() time after which the message is dropped instead of sent, None for the 
+                         default time to live
+        @return True if the message was enqueued or False if the queue is full 
+        """
+        
+        if not self.__queue.put(message, self.__getDeadline(deadline)):
+            return False
+        
+        self.__wakeup()
+        
+        return True
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def sendBlocking(self, message, deadline = None, timeout = None):
+        """ Enqueue a message to be sent to E-LIP controller, blocking while the queue is full
+        @attention: Must not be called from the thread running the event loop
+        @param message: Message to send
+        @param deadline: time.monotonic() time after which the message is dropped instead of sent, None for the 
+                         default time to live
+        @param timeout: Time in seconds to block for, None to block until there is room for the message 
+        @return True if the message was enqueued or False if the queue remained full 
+        """
+        
+        if not self.__queue.put(message, self.__getDeadline(deadline), True, timeout):
+            return False
+        
+        self.__wakeup()
+        
+        return True
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    async def sendAsync(self, message, deadline = None):
+        """ Enqueue a message to be sent to E-LIP controller, waiting while the queue is full
+        @attention: Must be called from the thread running the event loop
+        @param message: Message to send
+        @param deadline: time.monotonic() time after which the message is dropped instead of sent, None for the 
+                         default time to live
+        """
+        
+        deadline = self.__getDeadline(deadline)
+        
+        while not self.__queue.put(message, deadline):
+            self.__spaceEvent.clear()
+            await self.__spaceEvent.wait()
+        
+        self.__wakeup()
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def sendRequest(self, message, timeout = 1.0, retries = 2):
+        """ Enqueue a manual registration to be sent to E-LIP controller under an automatically assigned sequence 
+            number, and track it until the matching response is received
+        @attention: Must be called from the thread running the event loop
+        @param message: Manual registration message to send, its sequence number is replaced
+        @param timeout: Time in seconds to wait for the response before retransmitting
+        @param retries: Number of retransmissions before giving up
+        @return A future resolved with the matching MessageRegistrationResponse, or with asyncio.TimeoutError, right 
+                away if as many requests wait for a sequence number as the outbound queue holds. In delta mode, resolved
+                with None if the request was not sent since nothing changed, and shared with the requests it replaced
+        """
+        
+        deadline = self.__getDeadline(None)
+        
+        if self.__deltaMode:
+            
+            cardReaderNumber = message.cardReaderNumber
+            rights = bytes(message.getAsBytes()[:self.__SIZE_REGISTRATION_RIGHTS])
+            
+            # A request of the card which is still pending may change its rights, so it is sent anyway
+            if self.__acknowledgedRights.get(cardReaderNumber) == rights and \
+               not self.__inFlightTable.isPending(cardReaderNumber):
+                self.__metrics.registrationsSkipped += 1
+                future = asyncio.get_event_loop().create_future()
+                future.set_result(None)
+                
+                return future
+            
+            future = self.__inFlightTable.add(message, timeout, retries, deadline, cardReaderNumber)
+            future.add_done_callback(lambda future: self.__onDeltaRequestDone(cardReaderNumber, rights, future))
+        
+        else:
+            future = self.__inFlightTable.add(message, timeout, retries, deadline)
+        
+        # A rejected request is not kept, it is up to the caller to retry it
+        if self.__spool is not None and not future.done():
+            recordId = self.__spool.append(message.getAsBytes(), deadline)
+            future.add_done_callback(lambda future: self.__onSpooledRequestDone(recordId, message, deadline, future))
+        
+        return future
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def stop(self):
+        """ Request the connection to stop, run() returns once the connection is closed
+        @attention: Must be called from the thread running the event loop
+        """
+        
+        self.__shouldRun = False
+        
+        if self.__stopEvent is not None:
+            self.__stopEvent.set()
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    async def run(self):
+        """ Connection coroutine, keeps the connection to E-LIP alive until stopped
+        """
+        
+        self.__loop = asyncio.get_event_loop()
+        self.__loopThreadId = threading.get_ident()
+        self.__wakeupEvent = asyncio.Event()
+        self.__spaceEvent = asyncio.Event()
+        self.__stopEvent = asyncio.Event()
+        
+        self.__logger.info("Starting connection to E-LIP")
+        
+        if self.__spool is not None:
+            self.__replaySpool()
+        
+        wasConnected = False
+        disconnectedTime = None
+        retryTimeout = self.__minRetryTimeout
+        
+        try:
+            while self.__shouldRun:
+                
+                try:
+                    await self.__connector.connect()
+                    
+                    if disconnectedTime is not None:
+                        self.__metrics.reconnects += 1
+                        self.__metrics.reconnectDuration.observe(time.monotonic() - disconnectedTime)
+                        disconnectedTime = None
+                    
+                    wasConnected = True
+                    retryTimeout = self.__minRetryTimeout
+                    
+                    if self.__failedSpooledRequests:
+                        self.__redriveSpool()
+                    
+                    await self.__session()
+                    
+                except Exception as e:
+                    
+                    # Stream may be left in the middle of a frame, so it is started over
+                    if not isinstance(e, _ConnectionError):
+                        self.__logger.exception("Unexpected exception, reconnecting")
+                        self.__connector.abort()
+                    
+                    if wasConnected and disconnectedTime is None:
+                        disconnectedTime = time.monotonic()
+                    
+                    # Jittered so that bridges do not reconnect to a recovering controller all at once
+                    await self.__idle(random.uniform(retryTimeout / 2, retryTimeout))
+                    retryTimeout = min(retryTimeout * 2, self.__connectionRetryTimeout)
+        
+        finally:
+            self.__inFlightTable.close()
+            self.__connector.close()
+            
+            if self.__spool is not None:
+                self.__spool.close()
+            
+            if self.__captureWriter is not None:
+                self.__captureWriter.close()
+                
+            self.__logger.info("Stopping connection to E-LIP") 
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    async def __session(self):
+        """ Serve a connected session until the connection breaks or a stop is requested
+        """
+        
+        self.__healthCheckSentTime = None
+        self.__healthCheckQueuedTime = None
+        self.__lastReceivedTime = None
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in (self.__stopEvent.wait(), 
+                                                                    self.__receiver(), 
+                                                                    self.__sender(), 
+                                                                    self.__healthChecker())]
+        
+        try:
+            done, _ = await asyncio.wait(tasks, return_when = asyncio.FIRST_COMPLETED)
+        
+        finally:
+            self.__isAlive = False
+            
+            for task in tasks:
+                task.cancel()
+            
+            await asyncio.gather(*tasks, return_exceptions = True)
+        
+        # Propagate a broken connection to run() 
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    async def __receiver(self):
+        """ Receive messages as soon as the socket becomes readable
+        """
+        
+        while True:
+            
+            try:
+                receivedMessages = await self.__connector.receive()
+                
+                if receivedMessages:
+                    self.__onExchange(receivedMessages)
+                
+                for receivedMessage in receivedMessages:
+                    self.__logger.info("Received message: %s", receivedMessage, extra = logs.RATE_LIMIT)
+                    
+                    if isinstance(receivedMessage, messages.MessageRegistrationResponse):
+                        self.__inFlightTable.resolve(receivedMessage)
+            
+            except _ConnectionError:
+                raise
+            
+            except Exception:
+                self.__logger.exception("Unexpected exception")
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __onExchange(self, receivedMessages):
+        """ Take received messages as proof that the controller is alive, so no health check is needed until the 
+            connection idles again, and time the round trip of an echoed health check
+        @param receivedMessages: A non empty list of received messages
+        """
+        
+        now = time.monotonic()
+        self.__lastReceivedTime = now
+        
+        # Only an answer proves the controller serves, a socket which merely accepts writes may belong to a hung one
+        if not self.__isAlive and any(isinstance(message, (messages.MessageHealthCheck, 
+                                                           messages.MessageRegistrationResponse)) 
+                                      for message in receivedMessages):
+            self.__isAlive = True
+        
+        if self.__healthCheckSentTime is None:
+            return
+        
+        if any(isinstance(message, messages.MessageHealthCheck) for message in receivedMessages):
+            rtt = now - self.__healthCheckSentTime
+            self.__metrics.healthCheckRtt.observe(rtt)
+            
+            # Smoothed as TCP does, a single slow echo hardly moves it
+            if self.__smoothedRtt is None:
+                self.__smoothedRtt = rtt
+                
+            else:
+                self.__smoothedRtt += (rtt - self.__smoothedRtt) / 8
+        
+        # Any message answers an outstanding health check, its echo is no longer awaited
+        self.__healthCheckSentTime = None
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    async def __sender(self):
+        """ Send enqueued messages as soon as they are enqueued, draining the queue in batches
+        """
+        
+        while True:
+            
+            if self.__queue and self.__flushLatency > 0:
+                await self.__waitForBatch()
+            
+            batch = self.__queue.take(self.__maxBatchMessages, self.__maxBatchBytes)
+            
+            while batch:
+                
+                self.__spaceEvent.set()
+                messagesToSend = [entry.message for entry in batch]
+                
+                for messageToSend in messagesToSend:
+                    self.__logger.info("Sending message: %s", messageToSend, extra = logs.RATE_LIMIT)
+                
+                try:
+                    await self.__connector.sendBatch(messagesToSend)
+                
+                except (_ConnectionError, asyncio.CancelledError):
+                    
+                    # Messages are only discarded once they were sent
+                    self.__queue.putBack(batch)
+                    raise
+                
+                except Exception:
+                    self.__logger.exception("Unexpected exception, sending %s messages one by one", len(batch))
+                    messagesToSend = await self.__sendEach(batch)
+                
+                self.__inFlightTable.onSent(messagesToSend)
+                
+                if any(isinstance(message, messages.MessageHealthCheck) for message in messagesToSend):
+                    
+                    # Controller echoes health checks in order, so the round trip is timed from the oldest unanswered
+                    if self.__healthCheckSentTime is None:
+                        self.__healthCheckSentTime = time.monotonic()
+                
+                batch = self.__queue.take(self.__maxBatchMessages, self.__maxBatchBytes)
+            
+            self.__wakeupEvent.clear()
+            await self.__wakeupEvent.wait()
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    async def __sendEach(self, batch):
+        """ Send the messages of a batch which could not be sent as a whole one at a time, so only the messages which 
+            cannot be sent are dropped, as they would fail again on every retry
+        @param batch: A list of queue entries
+        @return A list of the sent messages
+        """
+        
+        sentMessages = []
+        
+        for index, entry in enumerate(batch):
+            
+            try:
+                await self.__connector.send(entry.message)
+            
+            except (_ConnectionError, asyncio.CancelledError):
+                self.__queue.putBack(batch[index:])
+                raise
+            
+            except Exception:
+                self.__logger.exception("Dropping message which could not be sent: %s", entry.message)
+                self.__onMessagesDropped([entry.message])
+            
+            else:
+                sentMessages.append(entry.message)
+        
+        return sentMessages
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    async def __waitForBatch(self):
+        """ Wait until a full batch is enqueued, but no longer than the flush latency
+        """
+        
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.__flushLatency
+        
+        while len(self.__queue) < self.__maxBatchMessages:
+            
+            timeout = deadline - loop.time()
+            
+            if timeout <= 0:
+                break
+            
+            self.__wakeupEvent.clear()
+            
+            try:
+                await asyncio.wait_for(self.__wakeupEvent.wait(), timeout)
+            
+            except asyncio.TimeoutError:
+                break
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __replaySpool(self):
+        """ Send again the requests which were left pending in the spool when the connection last stopped
+        """
+        
+        for recordId, frame, deadline in self.__spool.recover():
+            
+            try:
+                message = messages.MessageManualRegistration.fromBytes(frame)
+            
+            except messages.StructureError as e:
+                self.__logger.error("Dropping malformed spooled frame - %s", e)
+                self.__spool.acknowledge(recordId)
+                continue
+            
+            self.__logger.info("Replaying spooled message: %s", message, extra = logs.RATE_LIMIT)
+            self.__addSpooledRequest(recordId, message, deadline)
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __redriveSpool(self):
+        """ Send again the spooled requests which gave up before their deadline, e.g. during an outage
+        """
+        
+        failedRequests = self.__failedSpooledRequests
+        self.__failedSpooledRequests = collections.OrderedDict()
+        now = time.monotonic()
+        
+        for recordId, (message, deadline) in failedRequests.items():
+            
+            if deadline is not None and deadline < now:
+                self.__spool.acknowledge(recordId)
+                continue
+            
+            self.__logger.info("Resending spooled message: %s", message, extra = logs.RATE_LIMIT)
+            self.__addSpooledRequest(recordId, message, deadline)
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __addSpooledRequest(self, recordId, message, deadline):
+        """ Track a request which is already spooled
+        @param recordId: Spool record ID of the request
+        @param message: Manual registration message
+        @param deadline: time.monotonic() time after which the request is no longer relevant, None to never expire
+        """
+        
+        future = self.__inFlightTable.add(message, self.__SPOOL_REPLAY_TIMEOUT, self.__SPOOL_REPLAY_RETRIES, deadline)
+        future.add_done_callback(lambda future: self.__onSpooledRequestDone(recordId, message, deadline, future))
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __onSpooledRequestDone(self, recordId, message, deadline, future):
+        """ Acknowledge a spooled request once it was responded or is no longer relevant. Requests which were cancelled
+            stay pending, to be replayed on the next run, and requests which gave up before their deadline are sent 
+            again once reconnected
+        @param recordId: Spool record ID of the request
+        @param message: Manual registration message of the request
+        @param deadline: time.monotonic() time after which the request is no longer relevant, None to never expire
+        @param future: Done future of the request
+        """
+        
+        if future.cancelled():
+            return
+        
+        if future.exception() is None or (deadline is not None and deadline < time.monotonic()):
+            self.__spool.acknowledge(recordId)
+            
+        else:
+            self.__failedSpooledRequests[recordId] = (message, deadline)
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __onDeltaRequestDone(self, cardReaderNumber, rights, future):
+        """ Remember the rights of a card once acknowledged. A future shared by replaced requests runs their callbacks 
+            in order of sending, so the rights of the latest request are the ones remembered
+        @param cardReaderNumber: Card number of the request
+        @param rights: A bytes object of the request's frame up to its sequence number
+        @param future: Done future of the request
+        """
+        
+        if future.cancelled() or future.exception() is not None:
+            self.__acknowledgedRights.pop(cardReaderNumber, None)
+            
+        else:
+            self.__acknowledgedRights[cardReaderNumber] = rights
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __onMessagesDropped(self, droppedMessages):
+        """ Have the in flight table fail the requests whose messages the queue dropped before they were sent, from any
+            thread
+        @param droppedMessages: A list of dropped messages
+        """
+        
+        if self.__loop is None or threading.get_ident() == self.__loopThreadId:
+            self.__inFlightTable.onDropped(droppedMessages)
+            
+        else:
+            
+            try:
+                self.__loop.call_soon_threadsafe(self.__inFlightTable.onDropped, droppedMessages)
+            
+            except RuntimeError:
+                
+                # Loop is closed, so are the requests
+                pass
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __getDeadline(self, deadline):
+        """ Get the deadline of an enqueued message
+        @param deadline: Requested deadline or None for the default time to live
+        @return time.monotonic() time, or None to never expire
+        """
+        
+        if deadline is None and self.__timeToLive is not None:
+            return time.monotonic() + self.__timeToLive
+        
+        return deadline
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __wakeup(self):
+        """ Wake the sender up after a message was enqueued, from any thread
+        """
+        
+        if self.__loop is None:
+            
+            # Not running yet, the sender drains the queue once started
+            return
+        
+        if threading.get_ident() == self.__loopThreadId:
+            self.__wakeupEvent.set()
+            
+        else:
+            
+            try:
+                self.__loop.call_soon_threadsafe(self.__wakeupEvent.set)
+            
+            except RuntimeError:
+                
+                # Loop is closed, the message stays enqueued
+                pass
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    async def __healthChecker(self):
+        """ Schedule health checks on the timer wheel for the session, and break the connection once the peer is 
+            found dead
+        """
+        
+        self.__deadPeerFuture = self.__loop.create_future()
+        self.__onHealthCheckTimer()
+        
+        try:
+            await self.__deadPeerFuture
+        
+        finally:
+            self.__timerWheel.cancel(self.__healthCheckTimer)
+        
+        self.__logger.error("Health check was not echoed within %s seconds", self.__healthCheckTimeout)
+        self.__connector.abort()
+        
+        raise _ConnectionError()
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __onHealthCheckTimer(self):
+        """ Enqueue a health check message, ahead of any other message, once nothing was received for a health check 
+            period, and find the peer dead once a health check is not answered within the health check timeout. 
+            Traffic postpones health checks, so a busy connection hardly sends any.
+        """
+        
+        now = time.monotonic()
+        
+        if self.__healthCheckTimeout is not None and self.__healthCheckSentTime is not None and \
+           now - self.__healthCheckSentTime > self.__healthCheckTimeout:
+            self.__deadPeerFuture.set_result(None)
+            return
+        
+        lastActivityTimes = [activityTime for activityTime in (self.__lastReceivedTime, self.__healthCheckQueuedTime)
+                             if activityTime is not None]
+        
+        isHealthCheckDue = not lastActivityTimes or now - max(lastActivityTimes) >= self.__healthCheckPeriod
+        
+        if isHealthCheckDue:
+            self.__queue.put(messages.MessageHealthCheck(), None)
+            self.__wakeupEvent.set()
+            self.__healthCheckQueuedTime = now
+            nextCheckTime = now + self.__healthCheckPeriod
+        
+        else:
+            nextCheckTime = max(lastActivityTimes) + self.__healthCheckPeriod
+        
+        if self.__healthCheckTimeout is not None:
+            
+            # A health check which is about to be sent is timed from now on
+            if self.__healthCheckSentTime is not None:
+                nextCheckTime = min(nextCheckTime, self.__healthCheckSentTime + self.__healthCheckTimeout)
+            
+            elif isHealthCheckDue:
+                nextCheckTime = min(nextCheckTime, now + self.__healthCheckTimeout)
+        
+        self.__healthCheckTimer = self.__timerWheel.schedule(nextCheckTime - now, self.__onHealthCheckTimer)
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    async def __idle(self, timeout):
+        """ Idle for a timeout unless a stop is requested
+        @param timeout: Timeout in seconds
+        """
+        
+        try:
+            await asyncio.wait_for(self.__stopEvent.wait(), timeout)
+        
+        except asyncio.TimeoutError:
+            pass
 
 #=======================================================================================================================
 class Connection(object):
     
-    def __init__(self, logger, hostname, port, receiveBuffSize, healthCheckPeriod, idleTime, connectionRetryTimeout):
+    def __init__(self, logger, hostname, port, receiveBuffSize, healthCheckPeriod, idleTime, connectionRetryTimeout,
+                 maxBatchBytes = 65536, maxBatchMessages = 256, flushLatency = 0, maxQueueSize = 1024, 
+                 timeToLive = None, minRetryTimeout = 0.05, connectTimeout = 1.0, healthCheckTimeout = None, 
+                 spoolPath = None, deltaMode = False, capturePath = None):
+        """ C'tor
+        @param logger: Logger 
+        @param hostname: Hostname of the E-LIP controller
+        @param port: TCP Port of the E-LIP controller
+        @param receiveBuffSize: Size in bytes of receiving buffer 
+        @param healthCheckPeriod: Time in seconds without any message received from the controller after which a 
+                                  health check message will be sent
+        @param idleTime: Unused, the connection is event driven and never idles between cycles
+        @param connectionRetryTimeout: Maximal timeout in seconds between connection retries
+        @see: AsyncConnection documentation for the rest
+        """
+
+        self.__connection = AsyncConnection(logger, hostname, port, receiveBuffSize, healthCheckPeriod, 
+                                            connectionRetryTimeout, maxBatchBytes, maxBatchMessages, flushLatency,
+                                            maxQueueSize, timeToLive, minRetryTimeout, connectTimeout, 
+                                            healthCheckTimeout, spoolPath, None, deltaMode, capturePath)
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target = self.__target)
+
+    @property
+    def isAlive(self): return self.__connection.isAlive
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    @property
+    def healthCheckRtt(self): return self.__connection.healthCheckRtt
+
+    @property
+    def queueSize(self): return self.__connection.queueSize
+
+    @property
+    def metrics(self): return self.__connection.metrics
+
+    def send(self, message, deadline = None):
+        """ Enqueue a message to be sent to E-LIP controller without blocking
+        @see: AsyncConnection documentation
+        @return True if the message was enqueued or False if the queue is full 
+        """
+        
+        return self.__connection.send(message, deadline)
+
+    def sendBlocking(self, message, deadline = None, timeout = None):
+        """ Enqueue a message to be sent to E-LIP controller, blocking while the queue is full
+        @see: AsyncConnection documentation
+        @return True if the message was enqueued or False if the queue remained full 
+        """
+        
+        return self.__connection.sendBlocking(message, deadline, timeout)
+
+    def sendRequest(self, message, timeout = 1.0, retries = 2):
+        """ Enqueue a manual registration to be sent to E-LIP controller and track it until its response is received
+        @see: AsyncConnection documentation
+        @return A concurrent.futures.Future resolved with the matching MessageRegistrationResponse
+        """
+        
+        return asyncio.run_coroutine_threadsafe(self.__request(message, timeout, retries), self.__loop)
+        
+    def start(self):
+        """ Start the connection thread
+        """
+        
+        self.__thread.start()
+        
+    def stop(self):
+        """ Stop the connection thread
+        """
+        
+        self.__loop.call_soon_threadsafe(self.__connection.stop)
+        self.__thread.join()
+    
+    def __target(self):
+        """ Thread target
+        """
+        
+        try:
+            self.__loop.run_until_complete(self.__connection.run())
+        
+        finally:
+            self.__loop.close()
+
+    async def __request(self, message, timeout, retries):
+        """ Request coroutine, bridges the connection's future to the calling thread
+        """
+        
+        return await self.__connection.sendRequest(message, timeout, retries)
+
+#=======================================================================================================================
+class AsyncConnectionPool(object):
+    
+    def __init__(self, logger, controllers, receiveBuffSize, healthCheckPeriod, connectionRetryTimeout, bankMap = None,
+                 maxBatchBytes = 65536, maxBatchMessages = 256, flushLatency = 0, maxQueueSize = 1024, 
+                 timeToLive = None, minRetryTimeout = 0.05, connectTimeout = 1.0, healthCheckTimeout = None, 
+                 spoolDirectory = None, deltaMode = False, captureDirectory = None):
+        """ C'tor
+        @param logger: Logger 
+        @param controllers: A dict of E-LIP controller name to a (hostname, port) tuple
+        @param receiveBuffSize: Size in bytes of receiving buffer of each connection
+        @param healthCheckPeriod: Time in seconds without any message received from a controller after which a health 
+                                  check message will be sent
+        @param connectionRetryTimeout: Maximal timeout in seconds between connection retries
+        @param bankMap: A dict of card reader number to the name of the controller of its elevator bank, card readers
+                        which are not mapped or whose controller is dead are spread over all live controllers
+        @param maxBatchBytes: Maximal size in bytes of messages sent in a single socket write
+        @param maxBatchMessages: Maximal number of messages sent in a single socket write
+        @param flushLatency: Maximal time in seconds to hold enqueued messages back while waiting for a full batch
+        @param maxQueueSize: Maximal number of messages waiting to be sent on each connection
+        @param timeToLive: Default time in seconds an enqueued message stays relevant, None to never expire
+        @param minRetryTimeout: Timeout in seconds before the first connection retry, doubled on each further retry up
+                                to connectionRetryTimeout
+        @param connectTimeout: Time in seconds to wait for a connection to be established
+        @param healthCheckTimeout: Time in seconds to wait for a health check to be echoed before the connection is 
+                                   considered dead, None to rely on the socket alone
+        @param spoolDirectory: Directory of a spool file per controller, named after the controller, None to keep 
+                               requests in memory only
+        @param deltaMode: Whether requests only carry changes of access rights, see AsyncConnection
+        @param captureDirectory: Directory of a capture file per controller, named after the controller, None not to 
+                                 record
+        """
+        
+        self.__logger = logger
+        self.__bankMap = dict(bankMap or {})
+        self.__timerWheel = timers.TimerWheel()
+        self.__connections = collections.OrderedDict(
+                        (name, AsyncConnection(logger.getChild(name), hostname, port, receiveBuffSize, 
+                                               healthCheckPeriod, connectionRetryTimeout, maxBatchBytes, 
+                                               maxBatchMessages, flushLatency, maxQueueSize, timeToLive,
+                                               minRetryTimeout, connectTimeout, healthCheckTimeout,
+                                               None if spoolDirectory is None else 
+                                               os.path.join(spoolDirectory, "%s.spool" % (name, )),
+                                               self.__timerWheel, deltaMode,
+                                               None if captureDirectory is None else 
+                                               os.path.join(captureDirectory, "%s.capture" % (name, ))))
+                        for name, (hostname, port) in controllers.items())
+        self.__rotation = collections.deque(self.__connections)
+        
+        for name in set(self.__bankMap.values()) - set(self.__connections):
+            raise KeyError("Bank map refers to an unknown controller: %s" % (name, ))
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    @property
+    def connections(self): return self.__connections
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    @property
+    def metrics(self): 
+        """ A dict of controller name to the metrics.ConnectionMetrics of its connection
+        """
+        
+        return collections.OrderedDict((name, connection.metrics) for name, connection in self.__connections.items())
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def send(self, message, deadline = None):
+        """ Route a message to the controller of its card reader, or to the next live controller if the card reader is
+            not mapped to a specific controller
+        @attention: Must be called from the thread running the event loop
+        @param message: Message to send
+        @param deadline: time.monotonic() time after which the message is dropped instead of sent, None for the 
+                         default time to live
+        @return The name of the controller the message was enqueued to, or None if no controller is alive or its 
+                queue is full
+        """
+        
+        name = self.__route(message)
+        
+        if name is None:
+            return None
+        
+        if not self.__connections[name].send(message, deadline):
+            self.__logger.error("Queue of %s is full, dropping message: %s", name, message, extra = logs.RATE_LIMIT)
+            return None
+        
+        return name
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    async def sendAsync(self, message, deadline = None):
+        """ Route a message like send(), waiting while the chosen controller's queue is full
+        @attention: Must be called from the thread running the event loop
+        @param message: Message to send
+        @param deadline: time.monotonic() time after which the message is dropped instead of sent, None for the 
+                         default time to live
+        @return The name of the controller the message was enqueued to, or None if no controller is alive
+        """
+        
+        name = self.__route(message)
+        
+        if name is not None:
+            await self.__connections[name].sendAsync(message, deadline)
+        
+        return name
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def sendRequest(self, message, timeout = 1.0, retries = 2):
+        """ Route a manual registration like send() and track it until its response is received
+        @attention: Must be called from the thread running the event loop
+        @see: AsyncConnection documentation
+        @return A future resolved with the matching MessageRegistrationResponse
+        """
+        
+        name = self.__route(message)
+        
+        if name is None:
+            future = asyncio.get_event_loop().create_future()
+            future.set_exception(ConnectionError("No live E-LIP controller"))
+            
+            return future
+            
+        return self.__connections[name].sendRequest(message, timeout, retries)
+    
+#-----------------------------------------------------------------------------------------------------------------------   
+    def stop(self):
+        """ Request all connections to stop, run() returns once all connections are closed
+        @attention: Must be called from the thread running the event loop
+        """
+        
+        for connection in self.__connections.values():
+            connection.stop()
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    async def run(self):
+        """ Pool coroutine, runs all connections until stopped
+        """
+        
+        await asyncio.gather(*[connection.run() for connection in self.__connections.values()])
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __route(self, message):
+        """ Choose the controller to send a message to
+        @param message: Message to send
+        @return The name of the controller, or None if no controller is alive
+        """
+        
+        name = self.__bankMap.get(getattr(message, "cardReaderNumber", None))
+        
+        if name is not None and self.__connections[name].isAlive:
+            return name
+        
+        # Round robin over the live connections only, dead ones stay in the rotation but are skipped
+        for _ in range(len(self.__rotation)):
+            
+            name = self.__rotation[0]
+            self.__rotation.rotate(-1)
+            
+            if self.__connections[name].isAlive:
+                return name
+        
+        self.__logger.error("No live E-LIP controller to send message: %s", message, extra = logs.RATE_LIMIT)
+        
+        return None
+
+#=======================================================================================================================
+class ConnectionPool(object):
+    
+    def __init__(self, logger, controllers, receiveBuffSize, healthCheckPeriod, connectionRetryTimeout, bankMap = None,
+                 maxBatchBytes = 65536, maxBatchMessages = 256, flushLatency = 0, maxQueueSize = 1024, 
+                 timeToLive = None, minRetryTimeout = 0.05, connectTimeout = 1.0, healthCheckTimeout = None, 
+                 spoolDirectory = None, deltaMode = False, captureDirectory = None):
+        """ C'tor
+        @see: AsyncConnectionPool documentation
+        """
+        
+        self.__pool = AsyncConnectionPool(logger, controllers, receiveBuffSize, healthCheckPeriod, 
+                                          connectionRetryTimeout, bankMap, maxBatchBytes, maxBatchMessages, 
+                                          flushLatency, maxQueueSize, timeToLive, minRetryTimeout, connectTimeout,
+                                          healthCheckTimeout, spoolDirectory, deltaMode, captureDirectory)
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target = self.__target)
+
+    @property
+    def metrics(self): return self.__pool.metrics
+
+    def send(self, message, deadline = None):
+        """ Route a message to one of the E-LIP controllers without blocking, messages which can not be enqueued are
+            logged and dropped
+        @param message: Message to send
+        @param deadline: time.monotonic() time after which the message is dropped instead of sent
+        """
+        
+        self.__loop.call_soon_threadsafe(self.__pool.send, message, deadline)
+
+    def sendBlocking(self, message, deadline = None, timeout = None):
+        """ Route a message to one of the E-LIP controllers, blocking while the chosen controller's queue is full
+        @param message: Message to send
+        @param deadline: time.monotonic() time after which the message is dropped instead of sent
+        @param timeout: Time in seconds to block for, None to block until there is room for the message
+        @return The name of the controller the message was enqueued to, or None if it was not enqueued
+        """
+        
+        future = asyncio.run_coroutine_threadsafe(self.__pool.sendAsync(message, deadline), self.__loop)
+        
+        try:
+            return future.result(timeout)
+        
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            
+            return None
+
+    def sendRequest(self, message, timeout = 1.0, retries = 2):
+        """ Route a manual registration to one of the E-LIP controllers and track it until its response is received
+        @see: AsyncConnection documentation
+        @return A concurrent.futures.Future resolved with the matching MessageRegistrationResponse
+        """
+        
+        return asyncio.run_coroutine_threadsafe(self.__request(message, timeout, retries), self.__loop)
+        
+    def start(self):
+        """ Start the connections thread
+        """
+        
+        self.__thread.start()
+        
+    def stop(self):
+        """ Stop the connections thread
+        """
+        
+        self.__loop.call_soon_threadsafe(self.__pool.stop)
+        self.__thread.join()
+    
+    def __target(self):
+        """ Thread target
+        """
+        
+        try:
+            self.__loop.run_until_complete(self.__pool.run())
+        
+        finally:
+            self.__loop.close()
+
+    async def __request(self, message, timeout, retries):
+        """ Request coroutine, bridges the pool's future to the calling thread
+        """
+        
+        return await self.__pool.sendRequest(message, timeout, retries)
+
+#=======================================================================================================================
+class _OutboundQueue(object):
+    """ A bounded queue of messages waiting to be sent, safe to use from any thread. 
+        Health checks go first, then VIP and handicapped registrations and then everything else, each in order of 
+        arrival. Messages past their deadline are dropped instead of sent, and once the queue is full a registration
+        of a higher priority evicts the oldest general one.
+    """
+    
+    __PRIORITY_HEALTH_CHECK = 0
+    __PRIORITY_HIGH         = 1
+    __PRIORITY_GENERAL      = 2
+    
+    __HIGH_PRIORITY_ATTRIBUTIONS = frozenset([messages.MessageManualRegistration.Attribution.Types.VIP,
+                                              messages.MessageManualRegistration.Attribution.Types.HANDICAPPED])
+    
+    Entry = collections.namedtuple("Entry", "message deadline enqueuedTime")
+    
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __init__(self, logger, maxSize, onDropped = None):
+        """ C'tor
+        @param logger: Logger
+        @param maxSize: Maximal number of messages in the queue, health checks excluded
+        @param onDropped: A callable of a list of messages which were expired or evicted instead of sent, called from 
+                          the thread which dropped them without the lock held, None not to be notified
+        """
+        
+        self.__logger = logger
+        self.__maxSize = maxSize
+        self.__onDropped = onDropped
+        self.__size = 0
+        self.__queues = (collections.deque(), collections.deque(), collections.deque())
+        self.__lock = threading.Lock()
+        self.__notFullCondition = threading.Condition(self.__lock)
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __len__(self): return self.__size + len(self.__queues[self.__PRIORITY_HEALTH_CHECK])
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    @property
+    def maxSize(self): return self.__maxSize
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def put(self, message, deadline, block = False, timeout = None):
+        """ Enqueue a message
+        @param message: Message to enqueue
+        @param deadline: time.monotonic() time after which the message is dropped, None to never expire
+        @param block: Whether to block while the queue is full
+        @param timeout: Time in seconds to block for, None to block until there is room for the message
+        @return True if the message was enqueued or False if the queue is full 
+        """
+        
+        priority = self.__getPriority(message)
+        entry = self.Entry(message, deadline, time.monotonic())
+        droppedEntries = []
+        
+        try:
+            with self.__lock:
+                
+                if priority == self.__PRIORITY_HEALTH_CHECK:
+                    self.__queues[priority].append(entry)
+                    return True
+                
+                if self.__size == self.__maxSize:
+                    droppedEntries = self.__makeRoom(priority)
+                    
+                if self.__size == self.__maxSize and block:
+                    self.__notFullCondition.wait_for(lambda: self.__size < self.__maxSize, timeout)
+                    
+                if self.__size == self.__maxSize:
+                    return False
+                
+                self.__queues[priority].append(entry)
+                self.__size += 1
+                
+                return True
+        
+        finally:
+            self.__notifyDropped(droppedEntries)
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def take(self, maxMessages, maxBytes):
+        """ Dequeue the messages which come first and fit in a single batch, expired messages are dropped
+        @param maxMessages: Maximal number of messages to dequeue
+        @param maxBytes: Maximal size in bytes of messages to dequeue, at least one message is dequeued anyway
+        @return A list of entries
+        """
+        
+        now = time.monotonic()
+        batch = []
+        batchSize = 0
+        expiredEntries = []
+        
+        with self.__lock:
+            
+            for priority, queue in enumerate(self.__queues):
+                
+                while queue and len(batch) < maxMessages:
+                    
+                    entry = queue[0]
+                    
+                    if entry.deadline is not None and entry.deadline < now:
+                        expiredEntries.append(queue.popleft())
+                        continue
+                    
+                    messageSize = len(entry.message.getAsBytes())
+                    
+                    if batch and batchSize + messageSize > maxBytes:
+                        maxMessages = len(batch)
+                        break
+                    
+                    queue.popleft()
+                    batch.append(entry)
+                    batchSize += messageSize
+                    
+                    if priority != self.__PRIORITY_HEALTH_CHECK:
+                        self.__size -= 1
+            
+            self.__size -= len(expiredEntries)
+            
+            if batch or expiredEntries:
+                self.__notFullCondition.notify_all()
+            
+        if expiredEntries:
+            self.__logger.warning("Dropped %s expired messages", len(expiredEntries))
+            self.__notifyDropped(expiredEntries)
+            
+        return batch
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def replace(self, message, newMessage, deadline):
+        """ Replace a message which is still waiting in the queue, keeping its place
+        @param message: Enqueued message, compared by identity
+        @param newMessage: Message to send instead, of the same priority
+        @param deadline: time.monotonic() time after which the new message is dropped, None to never expire
+        @return True if replaced, or False if the message is no longer in the queue
+        """
+        
+        priority = self.__getPriority(message)
+        
+        if self.__getPriority(newMessage) != priority:
+            return False
+        
+        with self.__lock:
+            
+            queue = self.__queues[priority]
+            
+            # Replaced messages are usually the most recently enqueued ones
+            for index in range(len(queue) - 1, -1, -1):
+                
+                entry = queue[index]
+                
+                if entry.message is message:
+                    queue[index] = self.Entry(newMessage, deadline, entry.enqueuedTime)
+                    return True
+        
+        return False
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def remove(self, message):
+        """ Remove a message which is still waiting in the queue, e.g. a retransmission of a request which is done
+        @param message: Enqueued message, compared by identity
+        @return True if removed, or False if the message is no longer in the queue
+        """
+        
+        priority = self.__getPriority(message)
+        
+        with self.__lock:
+            
+            queue = self.__queues[priority]
+            
+            for index in range(len(queue) - 1, -1, -1):
+                
+                if queue[index].message is message:
+                    del queue[index]
+                    
+                    if priority != self.__PRIORITY_HEALTH_CHECK:
+                        self.__size -= 1
+                        self.__notFullCondition.notify_all()
+                    
+                    return True
+        
+        return False
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def getOldestAge(self):
+        """ Get the time the oldest message has been waiting in the queue
+        @return Time in seconds, 0 if the queue is empty
+        """
+        
+        with self.__lock:
+            enqueuedTimes = [queue[0].enqueuedTime for queue in self.__queues if queue]
+        
+        return time.monotonic() - min(enqueuedTimes) if enqueuedTimes else 0
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def putBack(self, batch):
+        """ Return entries which could not be sent to the head of the queue, even if the queue is full
+        @param batch: A list of entries as returned by take()
+        """
+        
+        with self.__lock:
+            
+            for entry in reversed(batch):
+                
+                priority = self.__getPriority(entry.message)
+                self.__queues[priority].appendleft(entry)
+                
+                if priority != self.__PRIORITY_HEALTH_CHECK:
+                    self.__size += 1
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __makeRoom(self, priority):
+        """ Drop expired messages, and the oldest general message if still full and enqueuing a higher priority
+        @attention: Lock must be held
+        @param priority: Priority of the message to enqueue
+        @return A list of dropped entries
+        """
+        
+        now = time.monotonic()
+        droppedEntries = []
+        
+        for queue in self.__queues[self.__PRIORITY_HIGH:]:
+            
+            alive = collections.deque(entry for entry in queue if entry.deadline is None or entry.deadline >= now)
+            droppedEntries.extend(entry for entry in queue if entry.deadline is not None and entry.deadline < now)
+            queue.clear()
+            queue.extend(alive)
+        
+        if not droppedEntries and priority < self.__PRIORITY_GENERAL and self.__queues[self.__PRIORITY_GENERAL]:
+            entry = self.__queues[self.__PRIORITY_GENERAL].popleft()
+            droppedEntries.append(entry)
+            self.__logger.warning("Queue is full, dropping message: %s", entry.message, extra = logs.RATE_LIMIT)
+            
+        self.__size -= len(droppedEntries)
+        
+        return droppedEntries
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __notifyDropped(self, droppedEntries):
+        """ Notify of dropped entries
+        @attention: Lock must not be held
+        @param droppedEntries: A list of dropped entries
+        """
+        
+        if droppedEntries and self.__onDropped is not None:
+            self.__onDropped([entry.message for entry in droppedEntries])
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __getPriority(self, message):
+        """ Get the priority of a message
+        @param message: Message 
+        @return Priority, lower goes first
+        """
+        
+        if isinstance(message, messages.MessageHealthCheck):
+            return self.__PRIORITY_HEALTH_CHECK
+        
+        if getattr(message, "attribution", None) in self.__HIGH_PRIORITY_ATTRIBUTIONS:
+            return self.__PRIORITY_HIGH
+        
+        return self.__PRIORITY_GENERAL
+
+#=======================================================================================================================
+class _InFlightTable(object):
+    """ Manual registrations awaiting a response from E-LIP, keyed by an automatically assigned sequence number.
+        Once all sequence numbers are in flight further registrations wait for one to be released, and once as many
+        wait as the outbound queue holds further ones are rejected, so memory stays bounded during an outage.
+        A registration added under the key of a pending one which was not sent yet takes its place instead.
+        A request has at most a single copy waiting in the outbound queue, and its response is awaited from the time 
+        that copy is written to the socket, so an outage postpones its retransmissions rather than using them up.
+    """
+    
+    __SEQUENCE_NUMBERS_COUNT = 256
+    
+    class _Request(object):
+        
+        def __init__(self, message, future, timeout, retries, deadline, key):
+            """ C'tor
+            @param message: Manual registration message
+            @param future: Future to resolve with the response
+            @param timeout: Time in seconds to wait for the response before retransmitting
+            @param retries: Number of retransmissions left
+            @param deadline: time.monotonic() time after which the message is dropped instead of sent
+            @param key: Key of requests which replace one another, None if never replaced
+            """
+            
+            self.startTime = time.monotonic()
+            self.deadline = deadline
+            self.message = message
+            self.future = future
+            self.timeout = timeout
+            self.retries = retries
+            self.key = key
+            self.sequenceNumber = None
+            self.transmissionsCount = 0
+            self.isQueued = False
+            self.timer = None
+    
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __init__(self, logger, send, replace, remove, maxWaitingCount, metrics_):
         """ C'tor
-        @param logger: Logger 
-        @param hostname: Hostname of the E-LIP controller
-        @param port: TCP Port of the E-LIP controller
-        @param receiveBuffSize: Size in bytes of receiving buffer 
-        @param healthCheckPeriod: Period in seconds in which a health check message will be sent
-        @param idleTime: Time to idle between cycles
-        @param connectionRetryTimeout: Timeout in seconds between connection retries
+        @param logger: Logger
+        @param send: A callable of a message and a deadline, which enqueues the message to be sent and returns whether 
+                     it did
+        @param replace: A callable of an enqueued message, a message and a deadline, which replaces the enqueued message
+                        if it was not sent yet and returns whether it did
+        @param remove: A callable of an enqueued message, which removes it if it was not sent yet
+        @param maxWaitingCount: Maximal number of requests waiting for a sequence number
+        @param metrics_: Connection metrics to observe response latency in
         """
-
-        self.__connector = _Connector(logger, hostname, port, receiveBuffSize, )
+        
         self.__logger = logger
-        self.__shouldRun = False
-        self.__idleTime = idleTime
-        self.__healthCheckCycle = healthCheckPeriod / idleTime
-        self.__queue = collections.deque()
-        self.__thread = threading.Thread(target = self.__target)
-        self.__connectionRetryTimeout = connectionRetryTimeout
+        self.__send = send
+        self.__replace = replace
+        self.__remove = remove
+        self.__maxWaitingCount = maxWaitingCount
+        self.__metrics = metrics_
+        self.__requests = {}
+        self.__waitingRequests = collections.deque()
+        self.__pendingRequestsByKey = {}
+        
+        # Released sequence numbers are reused last, so a late response is unlikely to match a newer request
+        self.__freeSequenceNumbers = collections.deque(range(self.__SEQUENCE_NUMBERS_COUNT))
 
-    def send(self, message):
-        """ Enqueue a message to be sent to E-LIP controller
-        @param: Message to send
+#-----------------------------------------------------------------------------------------------------------------------   
+    def add(self, message, timeout, retries, deadline = None, key = None):
+        """ Send a manual registration and track it
+        @param message: Manual registration message, its sequence number is replaced
+        @param timeout: Time in seconds to wait for the response before retransmitting
+        @param retries: Number of retransmissions before giving up
+        @param deadline: time.monotonic() time after which the message is dropped instead of sent, None for the 
+                         default time to live of each transmission
+        @param key: Key of registrations which replace one another, e.g. a card reader number, None to always send
+        @return A future resolved with the matching response, the future of the replaced registration if any. Failed 
+                right away with asyncio.TimeoutError if too many registrations wait for a sequence number.
         """
         
-        self.__queue.appendleft(message)
+        if key is not None:
+            
+            request = self.__pendingRequestsByKey.get(key)
+            
+            if request is not None and self.__replaceRequest(request, message, deadline):
+                self.__metrics.registrationsCoalesced += 1
+                return request.future
         
-    def start(self):
-        """ Start the connection thread
+        request = self._Request(message, asyncio.get_event_loop().create_future(), timeout, retries, deadline, key)
+        
+        if key is not None:
+            self.__pendingRequestsByKey[key] = request
+            request.future.add_done_callback(lambda _: self.__forget(request))
+        
+        if self.__freeSequenceNumbers:
+            self.__dispatch(request)
+        
+        elif len(self.__waitingRequests) >= self.__maxWaitingCount:
+            self.__logger.warning("Too many requests are waiting, dropping message: %s", message, 
+                                  extra = logs.RATE_LIMIT)
+            request.future.set_exception(asyncio.TimeoutError("Too many requests are waiting to send message: %s" % (
+                                                                                                            message, )))
+        
+        else:
+            self.__waitingRequests.append(request)
+            
+        return request.future
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def isPending(self, key):
+        """ Whether a registration added under a key was not responded yet
+        @param key: Key the registration was added under
+        @return True if pending
         """
         
-        self.__shouldRun = True
-        self.__thread.start()
+        return key in self.__pendingRequestsByKey
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def resolve(self, response):
+        """ Resolve the request matching a registration response
+        @param response: Registration response
+        """
         
-    def stop(self):
-        """ Stop the connection thread
+        request = self.__requests.get(response.sequenceNumber)
+        
+        if request is None or request.future.done():
+            self.__logger.debug("Received response for a request which is not in flight: %s", response, 
+                                extra = logs.RATE_LIMIT)
+            return
+        
+        request.future.set_result(response)
+        self.__metrics.responseLatency.observe(time.monotonic() - request.startTime)
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def onSent(self, sentMessages):
+        """ Await the responses of the requests whose messages were written to the socket
+        @param sentMessages: A list of messages which were sent
         """
         
-        self.__shouldRun = False
-        self.__thread.join()
-    
-    def __target(self):
-        """ Thread target
+        for message in sentMessages:
+            
+            request = self.__requests.get(getattr(message, "sequenceNumber", None))
+            
+            # Messages sent other than by a request may carry the sequence number of one
+            if request is None or request.message is not message or not request.isQueued:
+                continue
+            
+            request.isQueued = False
+            request.transmissionsCount += 1
+            
+            if request.timer is not None:
+                request.timer.cancel()
+            
+            request.timer = asyncio.get_event_loop().call_later(request.timeout, self.__onTimeout, request)
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def onDropped(self, droppedMessages):
+        """ Fail the requests whose messages expired or were evicted from the outbound queue before they were sent
+        @param droppedMessages: A list of dropped messages
         """
         
-        cycleNum = 0
+        for message in droppedMessages:
+            
+            request = self.__requests.get(getattr(message, "sequenceNumber", None))
+            
+            if request is None or request.message is not message or not request.isQueued:
+                continue
+            
+            request.isQueued = False
+            
+            if not request.future.done():
+                request.future.set_exception(asyncio.TimeoutError("Message was dropped before it was sent: %s" % (
+                                                                                                            message, )))
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def close(self):
+        """ Cancel all requests
+        """
         
-        self.__logger.info("Starting connection to E-LIP")
+        for request in list(self.__requests.values()) + list(self.__waitingRequests):
+            request.future.cancel()
+            
+        self.__waitingRequests.clear()
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __dispatch(self, request):
+        """ Assign a sequence number to a request and send it
+        @param request: Request to dispatch
+        """
+        
+        sequenceNumber = self.__freeSequenceNumbers.popleft()
+        request.sequenceNumber = sequenceNumber
+        request.message = request.message.withSequenceNumber(sequenceNumber)
+        request.future.add_done_callback(lambda _: self.__release(sequenceNumber))
+        self.__requests[sequenceNumber] = request
+        self.__transmit(request)
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __replaceRequest(self, request, message, deadline):
+        """ Have a pending request send another message instead, unless it was already sent
+        @param request: Pending request
+        @param message: Manual registration message to send instead
+        @param deadline: time.monotonic() time after which the message is dropped instead of sent
+        @return True if replaced, or False if the request was already sent
+        """
+        
+        if request.sequenceNumber is None:
+            request.message = message
+            request.deadline = deadline
+            return True
+        
+        # A request which was written may have been received already, so only a first transmission which is still 
+        # waiting in the outbound queue is replaced
+        if request.transmissionsCount > 0 or not request.isQueued:
+            return False
+        
+        message = message.withSequenceNumber(request.sequenceNumber)
+        
+        if not self.__replace(request.message, message, deadline):
+            return False
+        
+        request.message = message
+        request.deadline = deadline
+        
+        if request.timer is not None:
+            request.timer.cancel()
+            request.timer = None
+        
+        if deadline is not None:
+            request.timer = asyncio.get_event_loop().call_later(max(deadline - time.monotonic(), 0), self.__onExpired, 
+                                                                request)
+        
+        return True
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __forget(self, request):
+        """ Stop replacing a done request
+        @param request: Done request
+        """
+        
+        if self.__pendingRequestsByKey.get(request.key) is request:
+            del self.__pendingRequestsByKey[request.key]
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __transmit(self, request):
+        """ Enqueue a request, its timeout is armed once it is written. A request which is still waiting in the queue 
+            is not enqueued again, and one the full queue rejects is retried after its timeout as if it was lost.
+        @param request: Request to transmit
+        """
+        
+        if request.isQueued:
+            return
         
-        while self.__shouldRun:
+        if self.__send(request.message, request.deadline):
+            request.isQueued = True
             
-            try:
+            # The queue drops an expired message only once it is taken, which an outage may postpone indefinitely
+            if request.deadline is not None:
+                request.timer = asyncio.get_event_loop().call_later(max(request.deadline - time.monotonic(), 0),
+                                                                    self.__onExpired, request)
             
-                if self.__connector.isConnected:
-    
-                    # Sending health check
-                    if cycleNum % self.__healthCheckCycle == 0:
-                        messageToSend = messages.MessageHealthCheck()
-                        self.__logger.debug("Sending message: %s" % (messageToSend, ))
-                        self.__connector.send(messageToSend)
+            return
+        
+        self.__logger.warning("Queue is full, message will be retried: %s", request.message, extra = logs.RATE_LIMIT)
+        request.timer = asyncio.get_event_loop().call_later(request.timeout, self.__onTimeout, request)
 
-                    # Receiving message and logging                        
-                    receivedMessage = self.__connector.receive()
-                    
-                    if receivedMessage is not None:
-                        self.__logger.info("Received message: %s" % (receivedMessage, ))
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __onTimeout(self, request):
+        """ Retransmit a request which was not responded in time, or fail it once out of retries
+        @param request: Timed out request
+        """
+        
+        if request.future.done():
+            return
+        
+        if request.retries > 0:
+            request.retries -= 1
+            self.__logger.warning("No response received, retransmitting message: %s", request.message, 
+                                  extra = logs.RATE_LIMIT)
+            self.__transmit(request)
+            
+        else:
+            request.future.set_exception(asyncio.TimeoutError("No response received for message: %s" % (
+                                                                                                request.message, )))
 
-                    # Sending message if has one                        
-                    if self.__queue:
-                        messageToSend = self.__queue.pop()
-                        self.__logger.info("Sending message: %s" % (messageToSend, ))
-                        self.__connector.send(messageToSend)
-                    
-                else: 
-                    self.__connector.connect()
-                
-            except _ConnectionError:
-                time.sleep(self.__connectionRetryTimeout)
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __onExpired(self, request):
+        """ Fail a request whose message is still waiting in the queue past its deadline
+        @param request: Expired request
+        """
+        
+        if request.isQueued and not request.future.done():
+            self.__remove(request.message)
+            request.isQueued = False
+            request.future.set_exception(asyncio.TimeoutError("Message expired before it was sent: %s" % (
+                                                                                                request.message, )))
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __release(self, sequenceNumber):
+        """ Release the sequence number of a done request and dispatch a waiting request with it
+        @param sequenceNumber: Sequence number to release
+        """
+        
+        request = self.__requests.pop(sequenceNumber)
+        
+        if request.timer is not None:
+            request.timer.cancel()
+        
+        # A copy left in the queue would be sent under a sequence number which may be reused by then
+        if request.isQueued:
+            self.__remove(request.message)
+            request.isQueued = False
+        
+        self.__freeSequenceNumbers.append(sequenceNumber)
+        
+        while self.__waitingRequests and self.__freeSequenceNumbers:
             
-            except:
-                self.__logger.exception("Unexpected exception")
-                
-            cycleNum += 1
-            time.sleep(self.__idleTime)
-                
-        self.__connector.close()                
-        self.__logger.info("Stopping connection to E-LIP") 
+            request = self.__waitingRequests.popleft()
+            
+            if not request.future.done():
+                self.__dispatch(request)
 
 #=======================================================================================================================
 class _Connector(object):
+    
+    __KEEPALIVE_IDLE     = 1 # Seconds of idleness before the first probe
+    __KEEPALIVE_INTERVAL = 1 # Seconds between probes
+    __KEEPALIVE_COUNT    = 3 # Unanswered probes before the connection is dropped
    
 #-----------------------------------------------------------------------------------------------------------------------   
-    def __init__(self, logger, hostname, port, receiveBuffSize):
+    def __init__(self, logger, hostname, port, receiveBuffSize, metrics_, connectTimeout, captureWriter = None):
         """ C'tor
         @param hostname: Hostname of the E-LIP controller
         @param port: TCP Port of the E-LIP controller
         @param receiveBuffSize: Size in bytes of receiving buffer 
+        @param metrics_: Connection metrics to count socket activity in
+        @param connectTimeout: Time in seconds to wait for a connection to be established
+        @param captureWriter: A capture.CaptureWriter to record sent and received frames in, None not to record
         """
         
         self.__hostname = hostname
@@ -114,76 +1636,140 @@ class _Connector(object):
         self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
         self.__isConnected = False
         self.__messageFactory = messages.Factory(logger)
+        self.__frameDecoder = _FrameDecoder(receiveBuffSize)
+        self.__connectTimeout = connectTimeout
+        self.__metrics = metrics_
+        self.__captureWriter = captureWriter
+        self.__metrics.unknownFramesGetter = lambda: sum(self.__messageFactory.unknownFramesCounter.values())
         
 #-----------------------------------------------------------------------------------------------------------------------   
     @property
     def isConnected(self): return self.__isConnected        
         
 #-----------------------------------------------------------------------------------------------------------------------       
-    def connect(self):
+    async def connect(self):
         """ Connect to the E-LIP controller
         """
         
+        loop = asyncio.get_event_loop()
+        
         while not self.__isConnected:
             
             try:
-                self.__logger.info("Connecting to %s:%s" % (self.__hostname, self.__port))
-                self.__socket.connect((self.__hostname, self.__port))
+                self.__logger.info("Connecting to %s:%s", self.__hostname, self.__port, extra = logs.RATE_LIMIT)
                 self.__socket.setblocking(0)
+                self.__setSocketOptions()
+                await asyncio.wait_for(loop.sock_connect(self.__socket, (self.__hostname, self.__port)), 
+                                       self.__connectTimeout)
                 self.__isConnected = True
             
-            except socket.error as e:
-                self.__logger.error("Failed connecting to %s:%s - %s" % (self.__hostname, self.__port, e))
+            except (socket.error, asyncio.TimeoutError) as e:
+                self.__logger.error("Failed connecting to %s:%s - %s", self.__hostname, self.__port, 
+                                    str(e) or "Timed out", extra = logs.RATE_LIMIT)
                 self.__reset()
                 
                 raise _ConnectionError() 
                 
 #-----------------------------------------------------------------------------------------------------------------------       
-    def send(self, message):                
+    async def send(self, message):                
         """ Send a message to E-LIP controller
         @param message: Message to send
         """
         
+        await self.sendBatch([message])
+
+#-----------------------------------------------------------------------------------------------------------------------       
+    async def sendBatch(self, messages_):                
+        """ Send several messages to E-LIP controller with a single gathering socket write 
+        @param messages_: A list of messages to send, no longer than the system's IOV_MAX 
+        """
+        
+        # An empty buffer carries no frame, and no length field to count its frames by
+        buffers = [buffer_ for buffer_ in (message.getAsBytes() for message in messages_) if len(buffer_)]
+        
+        if not buffers:
+            return
+        
+        totalSize = 0
+        messagesSent = self.__metrics.messagesSent
+        
+        for buffer_ in buffers:
+            
+            # A batch message is a buffer of several equally sized frames
+            totalSize += len(buffer_)
+            frameSize = messages.MessageInterface._SIZE_HEADER + \
+                        buffer_[messages.MessageInterface.OFFSET_HEADER_DATA_LENGTH_FIELD]
+            messagesSent[buffer_[messages.MessageInterface._OFFSET_COMMAND_FIELD]] += len(buffer_) // frameSize
+        
         try:
-            self.__socket.send(message.getAsBytes())
+            
+            self.__metrics.sendCalls += 1
+            
+            try:
+                sentSize = self.__socket.sendmsg(buffers)
+            
+            except BlockingIOError:
+                sentSize = 0
+            
+            # Socket buffer is full, wait for it to drain and send whatever is left
+            if sentSize < totalSize:
+                self.__metrics.sendWouldBlock += 1
+                await asyncio.get_event_loop().sock_sendall(self.__socket, b"".join(buffers)[sentSize:])
+            
+            self.__metrics.bytesSent += totalSize
+            
+            if self.__captureWriter is not None:
+                self.__captureWriter.record(capture.CaptureWriter.DIRECTION_SENT, buffers)
             
         except socket.error as e:
-            self.__logger.error("Failed sending message: %s - %s" % (message, e))
+            self.__logger.error("Failed sending %s messages - %s", len(buffers), e)
             self.__reset()
             
             raise _ConnectionError(e) 
         
 #-----------------------------------------------------------------------------------------------------------------------       
-    def receive(self):                
-        """ Receive a message to E-LIP controller
-        @return message from E-LIP controller or None if no data
+    async def receive(self):                
+        """ Receive messages from E-LIP controller, waits until the socket becomes readable
+        @return A list of all messages completed by the received data, unidentified data is dropped
         """
         
         try:
-            payload = bytearray(self.__socket.recv(messages.MessageInterface._SIZE_HEADER))
-            payload.extend(self.__socket.recv(payload[messages.MessageInterface.OFFSET_HEADER_DATA_LENGTH_FIELD]))
-            return self.__messageFactory.create(payload)
+            receivedSize = await asyncio.get_event_loop().sock_recv_into(self.__socket, 
+                                                                         self.__frameDecoder.getFreeBuffer())
         
         except socket.error as e:
+            self.__logger.error("Failed receiving data from socket - %s", e)
+            self.__reset()
             
-            if e.errno == errno.EAGAIN or e.errno == errno.EWOULDBLOCK:
-                self.__logger.debug("No data received on socket")
-                return None
-
-            else:
-                self.__logger.error("Failed receiving data from socket - %s" % (e,))
-                self.__reset()
+            raise _ConnectionError()     
                 
-                raise _ConnectionError()     
+        # E-LIP closed its socket thus we received an EOF
+        if receivedSize == 0:
+            self.__logger.error("Connection was closed by remote peer")
+            self.__reset()
+          
+            raise _ConnectionError()
+        
+        self.__metrics.receiveCalls += 1
+        self.__metrics.bytesReceived += receivedSize
+        messagesReceived = self.__metrics.messagesReceived
+        receivedMessages = []
+        frames = self.__frameDecoder.decode(receivedSize)
+        
+        if frames and self.__captureWriter is not None:
+            self.__captureWriter.record(capture.CaptureWriter.DIRECTION_RECEIVED, frames)
+        
+        for frame in frames:
+            
+            if len(frame) > messages.MessageInterface._OFFSET_COMMAND_FIELD:
+                messagesReceived[frame[messages.MessageInterface._OFFSET_COMMAND_FIELD]] += 1
                 
-        except IndexError:
+            receivedMessage = self.__messageFactory.create(frame)
             
-                # An index error occurs when E-LIP closes its socket thus we receive an EOF and an empty bytes object
-                # which leads to an index error
-                self.__logger.error("Connection was closed by remote peer")
-                self.__reset()
-              
-                raise _ConnectionError()      
+            if receivedMessage is not None:
+                receivedMessages.append(receivedMessage)
+        
+        return receivedMessages
         
 #-----------------------------------------------------------------------------------------------------------------------       
     def close(self):
@@ -191,11 +1777,36 @@ class _Connector(object):
         """
         
         if self.__isConnected:
-            self.__logger.info("Disconnecting from %s:%s" % (self.__hostname, self.__port))
+            self.__logger.info("Disconnecting from %s:%s", self.__hostname, self.__port)
             self.__socket.shutdown(socket.SHUT_RDWR)
             self.__socket.close()
             self.__isConnected = False
 
+#-----------------------------------------------------------------------------------------------------------------------       
+    def abort(self):
+        """ Drop the connection to the E-LIP controller without shutting it down, once it is considered dead
+        """
+        
+        self.__logger.info("Aborting connection to %s:%s", self.__hostname, self.__port)
+        self.__reset()
+
+#-----------------------------------------------------------------------------------------------------------------------                
+    def __setSocketOptions(self):
+        """ Disable Nagle's algorithm so messages are sent as soon as written, and have the kernel probe an idle 
+            connection so a dead peer is noticed even while nothing is sent
+        """
+        
+        self.__socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.__socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        
+        # Not available on all platforms
+        for option, value in (("TCP_KEEPIDLE",  self.__KEEPALIVE_IDLE), 
+                              ("TCP_KEEPINTVL", self.__KEEPALIVE_INTERVAL), 
+                              ("TCP_KEEPCNT",   self.__KEEPALIVE_COUNT)):
+            
+            if hasattr(socket, option):
+                self.__socket.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
 #-----------------------------------------------------------------------------------------------------------------------                
     def __reset(self):
         """ Reset the connector to non connected state
@@ -204,6 +1815,67 @@ class _Connector(object):
         self.__socket.close()
         self.__isConnected = False
         self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+        self.__frameDecoder = _FrameDecoder(self.__receiveBuffSize)
+            
+#=======================================================================================================================
+class _FrameDecoder(object):
+    """ Incremental decoder of E-LIP frames out of a stream of received data. 
+        Frames are handed out as memoryview slices of the receive buffer, and since messages may keep them, received 
+        data is never overwritten. Once the buffer runs out of space a fresh one is allocated and only the partially
+        received frame is carried over to it. 
+    """
+    
+    __SIZE_MAX_FRAME = messages.MessageInterface._SIZE_HEADER + 0xff
+    
+#-----------------------------------------------------------------------------------------------------------------------   
+    def __init__(self, bufferSize):
+        """ C'tor
+        @param bufferSize: Size in bytes of the receive buffer, at least a single maximal frame
+        """
+        
+        self.__bufferSize = max(bufferSize, self.__SIZE_MAX_FRAME)
+        self.__view = memoryview(bytearray(self.__bufferSize))
+        self.__start = 0
+        self.__end = 0
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def getFreeBuffer(self):
+        """ Get the free part of the receive buffer to receive data into
+        @return A writable memoryview of at least a single maximal frame
+        """
+        
+        if self.__bufferSize - self.__end < self.__SIZE_MAX_FRAME:
+            pendingSize = self.__end - self.__start
+            view = memoryview(bytearray(self.__bufferSize))
+            view[:pendingSize] = self.__view[self.__start:self.__end]
+            self.__view = view
+            self.__start = 0
+            self.__end = pendingSize
+            
+        return self.__view[self.__end:]
+
+#-----------------------------------------------------------------------------------------------------------------------   
+    def decode(self, receivedSize):
+        """ Decode all frames completed by data received into the free buffer
+        @param receivedSize: Size in bytes of data received into the free buffer
+        @return A list of memoryview frames
+        """
+        
+        self.__end += receivedSize
+        frames = []
+        
+        while self.__end - self.__start >= messages.MessageInterface._SIZE_HEADER:
+            
+            frameEnd = self.__start + messages.MessageInterface._SIZE_HEADER + \
+                       self.__view[self.__start + messages.MessageInterface.OFFSET_HEADER_DATA_LENGTH_FIELD]
+            
+            if frameEnd > self.__end:
+                break
+            
+            frames.append(self.__view[self.__start:frameEnd])
+            self.__start = frameEnd
+            
+        return frames
             
 #=======================================================================================================================
 class _ConnectionError(Exception):
@@ -0,0 +1,845 @@
+import argparse
+import asyncio
+import atexit
+import collections
+import conectivity
+import io
+import json
+import logging
+import logs
+import messages
+import metrics
+import multiprocessing
+import multiprocessing.shared_memory
+import os
+import profiles
+import queue
+import select
+import signal
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+#=======================================================================================================================
+def parseFloors(floors):
+    """ Parse the accessible floors of an ACS event, a list of [number, door opening] pairs where door openings are 
+        given by name or by value
+    @param floors: A list of pairs as decoded from JSON
+    @return A set() of accessible floors
+    @raise ValueError, TypeError or AttributeError if the floors are invalid
+    """
+
+    accesibleFloors = set()
+
+    for number, doorOpening in floors:
+
+        if isinstance(doorOpening, str):
+            doorOpening = getattr(messages.MessageManualRegistration.Floor.DoorOpening.Types, doorOpening.upper())
+
+        accesibleFloors.add(messages.MessageManualRegistration.Floor(int(number), int(doorOpening)))
+
+    return accesibleFloors
+
+#=======================================================================================================================
+def parseEvent(event, cache = None):
+    """ Parse an ACS swipe event, a JSON object of a single line such as:
+        {"cardReaderNumber": 3, "floors": [[1, "FRONT"], [210, "BOTH"]], "attribution": "VIP"}
+        where attributions are given by name or by value and default to GENERAL. Floors may be left out for cards
+        whose access profile is cached.
+    @param event: A dict of the event as decoded from JSON
+    @param cache: Access profile cache to look cards up in, None if events must carry their floors
+    @return A manual registration message
+    @raise ValueError, KeyError, TypeError, AttributeError or messages.StructureError if the event is invalid
+    """
+
+    attribution = event.get("attribution", "GENERAL")
+    cardReaderNumber = int(event["cardReaderNumber"])
+
+    if isinstance(attribution, str):
+        attribution = getattr(messages.MessageManualRegistration.Attribution.Types, attribution.upper())
+
+    if "floors" in event:
+        return messages.MessageManualRegistration(cardReaderNumber, parseFloors(event["floors"]), attribution, 0)
+
+    message = cache.createRegistration(cardReaderNumber, attribution) if cache is not None else None
+
+    if message is None:
+        raise KeyError("Unknown card %s" % (cardReaderNumber, ))
+
+    return message
+
+#=======================================================================================================================
+class _FrameRing(object):
+    """ A bounded ring of manual registration frames in shared memory, written by any number of processes and read by
+        a single one. The header holds the read and write counters and whether the reader's connection is alive.
+        Could be handed to another process as an argument, and is attached to there by name.
+    """
+
+    __HEADER = struct.Struct("=QQQ")
+
+    __OFFSET_HEAD  = 0
+    __OFFSET_TAIL  = 8
+    __OFFSET_ALIVE = 16
+
+    __COUNTER = struct.Struct("=Q")
+
+    __FULL_RETRY_TIMEOUT = 0.001
+
+    SIZE_FRAME = messages.MessagePreencodedRegistration.SIZE
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, slotsCount, context):
+        """ C'tor, allocates the shared memory
+        @param slotsCount: Number of frames the ring holds
+        @param context: Multiprocessing context of the processes the ring is handed to
+        """
+
+        self.__slotsCount = slotsCount
+        self.__memory = multiprocessing.shared_memory.SharedMemory(
+                                                        create = True, size = self.__HEADER.size + slotsCount *
+                                                                              self.SIZE_FRAME)
+        self.__memory.buf[:self.__HEADER.size] = bytes(self.__HEADER.size)
+        self.__isOwner = True
+        self.__writeLock = context.Lock()
+        self.__readySemaphore = context.Semaphore(0)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __getstate__(self):
+        return (self.__memory.name, self.__slotsCount, self.__writeLock, self.__readySemaphore)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __setstate__(self, state):
+
+        name, self.__slotsCount, self.__writeLock, self.__readySemaphore = state
+        self.__memory = multiprocessing.shared_memory.SharedMemory(name)
+        self.__isOwner = False
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @property
+    def isAlive(self): return self.__getCounter(self.__OFFSET_ALIVE) != 0
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @isAlive.setter
+    def isAlive(self, isAlive): self.__setCounter(self.__OFFSET_ALIVE, 1 if isAlive else 0)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def put(self, frames):
+        """ Write frames, waiting while the ring is full
+        @param frames: A list of bytes objects of manual registration frames
+        """
+
+        index = 0
+
+        while index < len(frames):
+
+            with self.__writeLock:
+
+                head = self.__getCounter(self.__OFFSET_HEAD)
+                tail = self.__getCounter(self.__OFFSET_TAIL)
+                count = min(len(frames) - index, self.__slotsCount - (tail - head))
+
+                for frame in frames[index:index + count]:
+                    offset = self.__HEADER.size + (tail % self.__slotsCount) * self.SIZE_FRAME
+                    self.__memory.buf[offset:offset + self.SIZE_FRAME] = frame
+                    tail += 1
+
+                # Frames are published once written
+                self.__setCounter(self.__OFFSET_TAIL, tail)
+
+            if count:
+                index += count
+                self.__readySemaphore.release()
+
+            else:
+                time.sleep(self.__FULL_RETRY_TIMEOUT)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def take(self, timeout, maxCount = None):
+        """ Read written frames, waiting for some to be written
+        @param timeout: Time in seconds to wait for
+        @param maxCount: Maximal number of frames to read, None to read all of them. Frames left are kept in the ring,
+                         taking up slots writers wait for.
+        @return A list of bytes objects of manual registration frames, empty on timeout
+        """
+
+        self.__readySemaphore.acquire(timeout = timeout)
+
+        head = self.__getCounter(self.__OFFSET_HEAD)
+        tail = self.__getCounter(self.__OFFSET_TAIL)
+        end = tail if maxCount is None else min(tail, head + maxCount)
+        frames = []
+
+        for index in range(head, end):
+            offset = self.__HEADER.size + (index % self.__slotsCount) * self.SIZE_FRAME
+            frames.append(bytes(self.__memory.buf[offset:offset + self.SIZE_FRAME]))
+
+        self.__setCounter(self.__OFFSET_HEAD, end)
+
+        # Frames left are announced again, so the next take does not wait for them
+        if end < tail:
+            self.__readySemaphore.release()
+
+        return frames
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """ Detach from the shared memory, and free it if allocated by this process
+        """
+
+        self.__memory.close()
+
+        if self.__isOwner:
+            self.__memory.unlink()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __getCounter(self, offset): return self.__COUNTER.unpack_from(self.__memory.buf, offset)[0]
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __setCounter(self, offset, value): self.__COUNTER.pack_into(self.__memory.buf, offset, value)
+
+#=======================================================================================================================
+def _configureLogging(logLevel):
+    """ Configure the logger of the current process, records are written by a background thread and repetitive ones
+        are rate limited
+    @param logLevel: Logging level
+    @return Logger
+    """
+
+    logger = logging.getLogger('logger')
+    logger.setLevel(logLevel)
+
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+        
+        # Processes of the spawn context exit through sys.exit(), so queued records are flushed on exit of any process
+        atexit.register(logs.startQueueLogging(logger).stop)
+
+    return logger
+
+#=======================================================================================================================
+def _loadProfiles(logger, cache, path):
+    """ Warm load an access profile cache out of a file of profile events
+    @param logger: Logger
+    @param cache: Access profile cache
+    @param path: Path of a file of profile events, one JSON object per line
+    """
+
+    def cards():
+
+        with open(path, "rb") as file_:
+
+            for line in file_:
+
+                if not line.strip():
+                    continue
+
+                try:
+                    event = json.loads(line)
+                    yield int(event["cardReaderNumber"]), parseFloors(event["floors"])
+
+                except (ValueError, KeyError, TypeError, AttributeError, messages.StructureError) as e:
+                    logger.error("Dropping invalid profile %r - %s", line, e)
+
+    cache.warmLoad(cards())
+
+#=======================================================================================================================
+def _encoderMain(logLevel, index, chunks, updates, rings, bankMap, profilesPath, cacheSize):
+    """ Encoder process target, parses and encodes chunks of events and writes their frames to the ring of the
+        controller of their card reader, or to the next live controller if the card reader is not mapped.
+        Profile events, {"type": "profile", "cardReaderNumber": 3, "floors": [[1, "FRONT"]]}, update the access
+        profile of a card in the cache of every encoder.
+    @param logLevel: Logging level
+    @param index: Index of the encoder
+    @param chunks: A multiprocessing queue of bytes objects of whole lines, None to stop
+    @param updates: A list of multiprocessing queues of (card reader number, set() of floors) profile updates, one per
+                    encoder
+    @param rings: A list of frame rings, one per controller
+    @param bankMap: A dict of card reader number to the index of the ring of the controller of its elevator bank
+    @param profilesPath: Path of a file of profile events to warm load the cache with, None to start empty
+    @param cacheSize: Maximal number of cards in the access profile cache
+    """
+
+    logger = _configureLogging(logLevel)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    cache = profiles.AccessProfileCache(logger, cacheSize)
+    rotation = 0
+    invalidCount = 0
+
+    if profilesPath is not None:
+        _loadProfiles(logger, cache, profilesPath)
+
+    for chunk in iter(chunks.get, None):
+
+        # Updates parsed by other encoders apply from the next chunk on
+        try:
+            while True:
+                cache.update(*updates[index].get_nowait())
+
+        except queue.Empty:
+            pass
+
+        framesPerRing = [[] for _ in rings]
+
+        for line in chunk.splitlines():
+
+            if not line.strip():
+                continue
+
+            try:
+                event = json.loads(line)
+
+                if event.get("type") == "profile":
+                    update = (int(event["cardReaderNumber"]), parseFloors(event["floors"]))
+                    cache.update(*update)
+
+                    for otherIndex, otherUpdates in enumerate(updates):
+                        if otherIndex != index:
+                            otherUpdates.put(update)
+
+                    continue
+
+                message = parseEvent(event, cache)
+
+            except (ValueError, KeyError, TypeError, AttributeError, messages.StructureError) as e:
+                invalidCount += 1
+                logger.error("Dropping invalid event %r - %s", line, e, extra = logs.RATE_LIMIT)
+                continue
+
+            ringIndex = bankMap.get(message.cardReaderNumber)
+
+            # A card reader whose controller is dead is spread over the live controllers like an unmapped one
+            if ringIndex is None or not rings[ringIndex].isAlive:
+
+                # Round robin over the live controllers, or over all of them while none is alive
+                rotation = (rotation + 1) % len(rings)
+                candidates = ((rotation + offset) % len(rings) for offset in range(len(rings)))
+                ringIndex = next((candidate for candidate in candidates if rings[candidate].isAlive), rotation)
+                rotation = ringIndex
+
+            framesPerRing[ringIndex].append(message.getAsBytes())
+
+        for ring, frames in zip(rings, framesPerRing):
+            if frames:
+                ring.put(frames)
+
+    if invalidCount:
+        logger.warning("Dropped %s invalid events", invalidCount)
+
+    logger.info("Access profile cache: %s", cache.snapshot())
+
+    for ring in rings:
+        ring.close()
+
+#=======================================================================================================================
+class _ConnectionWorker(object):
+    """ Connection process, sends the frames of its ring to its E-LIP controller and tracks them until responded.
+        No more requests are pending than the outbound queue of the connection holds, further frames are left in the
+        ring until some are done, so a slow or unreachable controller makes the encoders wait on a full ring instead
+        of overflowing the queue.
+        Once draining, it sends whatever is left in its ring and waits for the requests in flight before stopping.
+        Snapshots of the connection metrics are sent over a pipe whenever the parent process asks for them.
+    """
+
+    __TAKE_TIMEOUT = 0.1
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, logger, ring, drainStartEvent, drainEvent, drainTimeout, connectionArgs, metricsPipe):
+        """ C'tor
+        @param logger: Logger
+        @param ring: Frame ring to read frames from
+        @param drainStartEvent: A multiprocessing event which is set once draining starts, while the encoders may still 
+                                be writing to the ring
+        @param drainEvent: A multiprocessing event which is set once no more frames are written to the ring
+        @param drainTimeout: Maximal time in seconds to wait for the requests in flight once draining
+        @param connectionArgs: A dict of keyword arguments of the connection
+        @param metricsPipe: The worker's end of a multiprocessing pipe to answer requests for metrics on
+        """
+
+        self.__logger = logger
+        self.__ring = ring
+        self.__metricsPipe = metricsPipe
+        self.__drainStartEvent = drainStartEvent
+        self.__drainEvent = drainEvent
+        self.__drainTimeout = drainTimeout
+        self.__connection = conectivity.AsyncConnection(logger, **connectionArgs)
+        self.__loop = asyncio.new_event_loop()
+        self.__pendingFutures = set()
+        self.__failuresCount = 0
+
+        # Pending requests are counted by the loop and waited on by the reader thread
+        self.__pendingCondition = threading.Condition()
+        self.__pendingCount = 0
+        self.__maxPendingCount = self.__connection.maxQueueSize
+        self.__drainDeadline = None
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def main(logLevel, name, ring, drainStartEvent, drainEvent, drainTimeout, connectionArgs, metricsPipe):
+        """ Process target
+        @see: C'tor documentation
+        """
+
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        _ConnectionWorker(_configureLogging(logLevel).getChild(name), ring, drainStartEvent, drainEvent, drainTimeout,
+                          connectionArgs, metricsPipe).run()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def run(self):
+        """ Run until drained
+        """
+
+        reader = threading.Thread(target = self.__reader)
+        reader.daemon = True
+        reader.start()
+
+        # Snapshots are taken on the loop, so the connection is never read half updated
+        self.__loop.add_reader(self.__metricsPipe.fileno(), self.__onMetricsRequest)
+
+        try:
+            self.__loop.run_until_complete(self.__connection.run())
+
+        finally:
+            self.__loop.remove_reader(self.__metricsPipe.fileno())
+            self.__metricsPipe.close()
+            self.__ring.isAlive = False
+            self.__ring.close()
+            self.__loop.close()
+
+        if self.__failuresCount:
+            self.__logger.warning("%s registrations were not responded", self.__failuresCount)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __reader(self):
+        """ Reader thread target, hands frames of the ring over to the event loop
+        """
+
+        while True:
+
+            frames = self.__ring.take(self.__TAKE_TIMEOUT, self.__waitForRoom())
+
+            if frames:
+
+                with self.__pendingCondition:
+                    self.__pendingCount += len(frames)
+
+                self.__loop.call_soon_threadsafe(self.__sendFrames, frames)
+
+            elif self.__drainEvent.is_set():
+                break
+
+            self.__ring.isAlive = self.__connection.isAlive
+
+        asyncio.run_coroutine_threadsafe(self.__drain(), self.__loop)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __waitForRoom(self):
+        """ Wait while as many requests are pending as the outbound queue of the connection holds
+        @return Number of frames which could be taken out of the ring, None to take all of them once the drain timeout
+                passed
+        """
+
+        with self.__pendingCondition:
+
+            while self.__pendingCount >= self.__maxPendingCount:
+
+                # A controller which is down never makes room, so encoders waiting on the ring would never finish, 
+                # whatever they write is sent anyway once draining took long
+                if self.__drainStartEvent.is_set():
+
+                    if self.__drainDeadline is None:
+                        self.__drainDeadline = time.monotonic() + self.__drainTimeout
+
+                    elif time.monotonic() >= self.__drainDeadline:
+                        return None
+
+                self.__pendingCondition.wait(self.__TAKE_TIMEOUT)
+                self.__ring.isAlive = self.__connection.isAlive
+
+            return self.__maxPendingCount - self.__pendingCount
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __sendFrames(self, frames):
+        """ Send frames and track them until responded
+        @param frames: A list of bytes objects of manual registration frames
+        """
+
+        for frame in frames:
+            future = self.__connection.sendRequest(messages.MessagePreencodedRegistration(frame))
+            self.__pendingFutures.add(future)
+            future.add_done_callback(self.__onRequestDone)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __onMetricsRequest(self):
+        """ Answer a request of the parent process for a snapshot of the connection metrics
+        """
+
+        try:
+            self.__metricsPipe.recv()
+            self.__metricsPipe.send(self.__connection.metrics.snapshot())
+
+        except (EOFError, OSError):
+
+            # Parent is gone, nobody is left to ask
+            self.__loop.remove_reader(self.__metricsPipe.fileno())
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __onRequestDone(self, future):
+        """ Forget a done request, counting it if it failed, and make room for a further frame of the ring
+        @param future: Done future of the request
+        """
+
+        self.__pendingFutures.discard(future)
+
+        with self.__pendingCondition:
+            self.__pendingCount -= 1
+            self.__pendingCondition.notify()
+
+        if future.cancelled() or future.exception() is not None:
+            self.__failuresCount += 1
+
+#-----------------------------------------------------------------------------------------------------------------------
+    async def __drain(self):
+        """ Wait for the requests in flight and stop the connection
+        """
+
+        self.__logger.info("Draining %s requests in flight", len(self.__pendingFutures))
+
+        if self.__pendingFutures:
+            await asyncio.wait(list(self.__pendingFutures), timeout = self.__drainTimeout)
+
+        self.__connection.stop()
+
+#=======================================================================================================================
+class Frontend(object):
+    """ Production entry point of the bridge. ACS swipe events are ingested from a local socket or a pipe, parsed and
+        encoded by a pool of encoder processes, and handed as preencoded frames through shared memory to a connection
+        process per E-LIP controller.
+    """
+
+    __CHUNK_SIZE = 65536
+    __READ_TIMEOUT = 0.1
+    __METRICS_TIMEOUT = 1.0
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, logger, logLevel, controllers, bankMap = None, encodersCount = None, ringSize = 4096,
+                 chunksQueueSize = 64, drainTimeout = 5, connectionArgs = None, spoolDirectory = None, 
+                 profilesPath = None, cacheSize = 65536, captureDirectory = None, metricsPort = None):
+        """ C'tor
+        @param logger: Logger
+        @param logLevel: Logging level of the worker processes
+        @param controllers: A dict of E-LIP controller name to a (hostname, port) tuple
+        @param bankMap: A dict of card reader number to the name of the controller of its elevator bank, card readers
+                        which are not mapped or whose controller is dead are spread over all live controllers
+        @param encodersCount: Number of encoder processes, None for the number of CPUs
+        @param ringSize: Number of frames waiting to be sent each controller's ring holds
+        @param chunksQueueSize: Number of ingested chunks waiting to be encoded before ingestion blocks
+        @param drainTimeout: Maximal time in seconds to wait for the requests in flight on shutdown
+        @param connectionArgs: A dict of keyword arguments of each conectivity.AsyncConnection, besides its hostname,
+                               port, spool path and capture path
+        @param spoolDirectory: Directory of a spool file per controller, named after the controller, None to keep 
+                               requests in memory only
+        @param profilesPath: Path of a file of profile events to warm load the access profile caches with
+        @param cacheSize: Maximal number of cards in the access profile cache of each encoder
+        @param captureDirectory: Directory of a capture file per controller, named after the controller, None not to 
+                                 record
+        @param metricsPort: Local TCP port to serve the metrics of all connections on, see metrics.Exporter, None not 
+                            to serve them
+        """
+
+        names = list(controllers)
+
+        for name in set((bankMap or {}).values()) - set(names):
+            raise KeyError("Bank map refers to an unknown controller: %s" % (name, ))
+
+        self.__logger = logger
+        self.__context = multiprocessing.get_context("spawn")
+        self.__chunks = self.__context.Queue(chunksQueueSize)
+        self.__rings = [_FrameRing(ringSize, self.__context) for _ in names]
+        self.__drainStartEvent = self.__context.Event()
+        self.__drainEvent = self.__context.Event()
+        self.__stopEvent = threading.Event()
+        self.__server = None
+        self.__metricsPipes = collections.OrderedDict()
+        self.__metricsLock = threading.Lock()
+        self.__exporter = metrics.Exporter(logger, self.getMetrics, metricsPort) if metricsPort is not None else None
+
+        encodersCount = encodersCount or os.cpu_count() or 1
+        self.__updates = [self.__context.Queue() for _ in range(encodersCount)]
+        bankIndexes = dict((cardReaderNumber, names.index(name)) for cardReaderNumber, name in (bankMap or {}).items())
+        self.__encoders = [self.__context.Process(target = _encoderMain, name = "encoder-%s" % (index, ),
+                                                  args = (logLevel, index, self.__chunks, self.__updates, self.__rings, 
+                                                          bankIndexes, profilesPath, cacheSize))
+                           for index in range(encodersCount)]
+
+        self.__workers = []
+
+        for name, ring in zip(names, self.__rings):
+
+            hostname, port = controllers[name]
+            args = dict(connectionArgs or {}, hostname = hostname, port = port, 
+                        spoolPath = None if spoolDirectory is None else os.path.join(spoolDirectory, 
+                                                                                     "%s.spool" % (name, )),
+                        capturePath = None if captureDirectory is None else os.path.join(captureDirectory,
+                                                                                         "%s.capture" % (name, )))
+            self.__metricsPipes[name], workerPipe = self.__context.Pipe()
+            self.__workers.append(self.__context.Process(target = _ConnectionWorker.main, name = name,
+                                                         args = (logLevel, name, ring, self.__drainStartEvent,
+                                                                 self.__drainEvent, drainTimeout, args, workerPipe)))
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def start(self):
+        """ Start all worker processes
+        """
+
+        for process in self.__workers + self.__encoders:
+            process.start()
+
+        if self.__exporter is not None:
+            self.__exporter.start()
+            self.__logger.info("Serving metrics on port %s", self.__exporter.port)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def getMetrics(self):
+        """ Ask every worker process for a snapshot of its connection metrics, safe to call from any thread
+        @return A dict of controller name to its metrics snapshot, leaving out the workers which did not answer
+        """
+
+        snapshots = collections.OrderedDict()
+
+        with self.__metricsLock:
+
+            for name, pipe in self.__metricsPipes.items():
+
+                try:
+
+                    # An answer which came too late to a previous request is stale
+                    while pipe.poll():
+                        pipe.recv()
+
+                    pipe.send(None)
+
+                    if pipe.poll(self.__METRICS_TIMEOUT):
+                        snapshots[name] = pipe.recv()
+
+                except (EOFError, OSError):
+                    pass
+
+        return snapshots
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def ingestStream(self, stream):
+        """ Ingest events from a binary stream until its end or until stopped, e.g. from a pipe
+        @param stream: A binary file object
+        """
+
+        pending = b""
+
+        try:
+            fileno = stream.fileno()
+
+        except (AttributeError, io.UnsupportedOperation):
+            fileno = None
+
+        while not self.__stopEvent.is_set():
+
+            # A read of an idle pipe is resumed after a signal and never sees the stop, so data is waited for apart.
+            # Reads take whatever is buffered, so no data is left waiting in the stream while the pipe idles.
+            if fileno is not None and not select.select([fileno], [], [], self.__READ_TIMEOUT)[0]:
+                continue
+
+            data = stream.read1(self.__CHUNK_SIZE) if hasattr(stream, "read1") else stream.read(self.__CHUNK_SIZE)
+
+            if not data:
+                break
+
+            pending = self.__putLines(pending + data)
+
+        if pending:
+            self.__chunks.put(pending)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def serve(self, address):
+        """ Ingest events from clients of a local socket until stopped
+        @param address: A path of a unix socket, or a (hostname, port) tuple of a TCP socket
+        """
+
+        chunkSize = self.__CHUNK_SIZE
+        chunks = self.__chunks
+        putLines = self.__putLines
+
+        class Handler(socketserver.BaseRequestHandler):
+
+            def handle(self):
+
+                pending = b""
+
+                while True:
+
+                    data = self.request.recv(chunkSize)
+
+                    if not data:
+                        break
+
+                    pending = putLines(pending + data)
+
+                if pending:
+                    chunks.put(pending)
+
+        if isinstance(address, str):
+
+            if os.path.exists(address):
+                os.unlink(address)
+
+            serverClass = socketserver.ThreadingUnixStreamServer
+
+        else:
+            serverClass = socketserver.ThreadingTCPServer
+
+        serverClass.daemon_threads = True
+        serverClass.allow_reuse_address = True
+        self.__server = serverClass(address, Handler)
+        self.__logger.info("Ingesting events on %s", address)
+
+        try:
+            self.__server.serve_forever()
+
+        finally:
+            self.__server.server_close()
+
+            if isinstance(address, str) and os.path.exists(address):
+                os.unlink(address)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        """ Stop ingesting, safe to call from a signal handler
+        """
+
+        self.__stopEvent.set()
+
+        if self.__server is not None:
+
+            # Blocks until the serving loop exits, so it must not run on the serving thread
+            threading.Thread(target = self.__server.shutdown).start()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def drain(self):
+        """ Encode everything ingested so far, send it and wait for the requests in flight, then stop all workers
+        """
+
+        self.__logger.info("Draining")
+        self.__drainStartEvent.set()
+
+        for _ in self.__encoders:
+            self.__chunks.put(None)
+
+        for encoder in self.__encoders:
+            encoder.join()
+
+        self.__drainEvent.set()
+
+        for worker in self.__workers:
+            worker.join()
+
+        if self.__exporter is not None:
+            self.__exporter.stop()
+
+        for ring in self.__rings:
+            ring.close()
+
+        self.__logger.info("Drained")
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __putLines(self, data):
+        """ Hand the whole lines of ingested data to the encoders
+        @param data: A bytes object of ingested data
+        @return A bytes object of the trailing partial line
+        """
+
+        end = data.rfind(b"\n") + 1
+
+        if end:
+            self.__chunks.put(data[:end])
+
+        return data[end:]
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "E-LIP ACS bridge")
+    parser.add_argument("--controller", action = "append", required = True, metavar = "NAME=HOST:PORT",
+                        help = "E-LIP controller, may be given several times")
+    parser.add_argument("--bank", action = "append", default = [], metavar = "CARD_READER=NAME",
+                        help = "Card reader to send to the controller of its elevator bank, may be given several times")
+    parser.add_argument("--listen", help = "Unix socket path or HOST:PORT to ingest events on, stdin if not given")
+    parser.add_argument("--input", help = "Pipe or file path to ingest events from, - for stdin")
+    parser.add_argument("--encoders", type = int, default = None, help = "Number of encoder processes")
+    parser.add_argument("--ring-size", type = int, default = 4096, help = "Frames buffered per controller")
+    parser.add_argument("--drain-timeout", type = float, default = 5,
+                        help = "Time in seconds to wait for registrations in flight on shutdown")
+    parser.add_argument("--receive-buffer-size", type = int, default = 4096)
+    parser.add_argument("--health-check-period", type = float, default = 60)
+    parser.add_argument("--health-check-timeout", type = float, default = None)
+    parser.add_argument("--connection-retry-timeout", type = float, default = 5)
+    parser.add_argument("--time-to-live", type = float, default = None)
+    parser.add_argument("--spool-directory", default = None)
+    parser.add_argument("--delta-mode", action = "store_true", 
+                        help = "Skip registrations of unchanged access rights and coalesce queued ones of a card, for "
+                               "syncing the ACS database rather than swipes")
+    parser.add_argument("--capture-directory", default = None,
+                        help = "Directory to record the frames exchanged with each controller in, see replay.py")
+    parser.add_argument("--metrics-port", type = int, default = None,
+                        help = "Local port to serve metrics of all controllers on, as Prometheus text and JSON")
+    parser.add_argument("--profiles", default = None, help = "File of profile events to warm load the cache with")
+    parser.add_argument("--cache-size", type = int, default = 65536, help = "Cards cached per encoder")
+    parser.add_argument("--log-level", default = "INFO")
+    args = parser.parse_args()
+
+    logLevel = getattr(logging, args.log_level.upper())
+    logger = _configureLogging(logLevel)
+
+    controllers = {}
+
+    for controller in args.controller:
+        name, _, address = controller.partition("=")
+        hostname, _, port = address.rpartition(":")
+        controllers[name] = (hostname, int(port))
+
+    bankMap = dict((int(cardReaderNumber), name) for cardReaderNumber, _, name in
+                   (bank.partition("=") for bank in args.bank))
+
+    connectionArgs = {"receiveBuffSize": args.receive_buffer_size,
+                      "healthCheckPeriod": args.health_check_period,
+                      "connectionRetryTimeout": args.connection_retry_timeout,
+                      "healthCheckTimeout": args.health_check_timeout,
+                      "timeToLive": args.time_to_live,
+                      "deltaMode": args.delta_mode}
+
+    frontend = Frontend(logger, logLevel, controllers, bankMap, args.encoders, args.ring_size,
+                        drainTimeout = args.drain_timeout, connectionArgs = connectionArgs, 
+                        spoolDirectory = args.spool_directory, profilesPath = args.profiles, 
+                        cacheSize = args.cache_size, captureDirectory = args.capture_directory, 
+                        metricsPort = args.metrics_port)
+    frontend.start()
+
+    for signalNumber in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signalNumber, lambda signalNumber, frame: frontend.stop())
+
+    try:
+        if args.listen is not None:
+            hostname, _, port = args.listen.rpartition(":")
+            frontend.serve((hostname, int(port)) if port.isdigit() and hostname else args.listen)
+
+        elif args.input in (None, "-"):
+            frontend.ingestStream(sys.stdin.buffer)
+
+        else:
+            with open(args.input, "rb") as stream:
+                frontend.ingestStream(stream)
+
+    finally:
+        frontend.drain()
@@ -0,0 +1,363 @@
+import argparse
+import asyncio
+import conectivity
+import logging
+import messages
+import metrics
+import random
+import reference
+import socket
+import sys
+import time
+
+Floor = messages.MessageManualRegistration.Floor
+DoorOpening = messages.MessageManualRegistration.Floor.DoorOpening.Types
+Attribution = messages.MessageManualRegistration.Attribution.Types
+
+# Throughput gates, well below the rates of a single core so only regressions fail them
+MIN_ENCODE_RATE = 100000
+MIN_DECODE_RATE = 50000
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _checkRegistration(cardReaderNumber, accesibleFloors, attribution, sequenceNumber):
+    """ Check a manual registration encodes as the per floor reference does, and decodes back to the same fields
+    @param cardReaderNumber: Swiped card number
+    @param accesibleFloors: A set() of accessible floors
+    @param attribution: Specific attribution
+    @param sequenceNumber: Message sequence number
+    @return The encoded frame
+    """
+
+    message = messages.MessageManualRegistration(cardReaderNumber, accesibleFloors, attribution, sequenceNumber)
+    bytes_ = message.getAsBytes()
+    expected = reference.encodeRegistrationPerFloor(cardReaderNumber, accesibleFloors, attribution, sequenceNumber)
+
+    if bytes_ != expected:
+        raise AssertionError("Encoding of %s differs from the per floor encoding" % (message, ))
+
+    # Floors without a door opening take no bits, so they do not survive a round trip
+    openedFloors = tuple(sorted(floor for floor in accesibleFloors if floor.doorOpening != DoorOpening.NONE))
+    decoded = messages.MessageManualRegistration.fromBytes(bytes_)
+
+    if (decoded.cardReaderNumber, decoded.accesibleFloors, decoded.attribution, decoded.sequenceNumber) != \
+       (cardReaderNumber, openedFloors, attribution, sequenceNumber) or decoded.getAsBytes() != bytes_:
+        raise AssertionError("Round trip of %s decoded %s" % (message, decoded))
+
+    preencoded = messages.MessagePreencodedRegistration(bytes_)
+
+    if (preencoded.cardReaderNumber, preencoded.attribution, preencoded.sequenceNumber) != \
+       (cardReaderNumber, attribution, sequenceNumber):
+        raise AssertionError("Preencoded registration of %s decoded %s" % (message, preencoded))
+
+    if message.withSequenceNumber(255 - sequenceNumber).getAsBytes() != \
+       preencoded.withSequenceNumber(255 - sequenceNumber).getAsBytes():
+        raise AssertionError("Sequence number of %s is not replaced the same when preencoded" % (message, ))
+
+    return bytes_
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _checkRaises(create, description):
+    """ Check that creating a message is rejected
+    @param create: A callable creating the message
+    @param description: What is being created
+    """
+
+    try:
+        create()
+
+    except messages.StructureError:
+        return
+
+    raise AssertionError("%s was not rejected" % (description, ))
+
+#-----------------------------------------------------------------------------------------------------------------------
+def checkRoundTrip(rng, count):
+    """ Check encoding and decoding of manual registrations for every floor and door opening, the range limits and
+        random access profiles
+    @param rng: random.Random to draw from
+    @param count: Number of random access profiles to check
+    @return Number of checked registrations
+    """
+
+    attributions = (Attribution.GENERAL, Attribution.HANDICAPPED, Attribution.VIP)
+    checkedCount = 0
+
+    for number in range(1, 256):
+        for doorOpening in (DoorOpening.NONE, DoorOpening.FRONT, DoorOpening.REAR, DoorOpening.BOTH):
+            _checkRegistration(rng.randint(0, 255), set([Floor(number, doorOpening)]), rng.choice(attributions),
+                               rng.randint(0, 255))
+            checkedCount += 1
+
+    for cardReaderNumber in (0, 255):
+        for sequenceNumber in (0, 255):
+            _checkRegistration(cardReaderNumber, set(), Attribution.GENERAL, sequenceNumber)
+            _checkRegistration(cardReaderNumber, set(Floor(number, DoorOpening.BOTH) for number in range(1, 256)),
+                               Attribution.VIP, sequenceNumber)
+            checkedCount += 2
+
+    for cardReaderNumber, sequenceNumber in ((-1, 0), (256, 0), (0, -1), (0, 256)):
+        _checkRaises(lambda: messages.MessageManualRegistration(cardReaderNumber, set(), Attribution.GENERAL,
+                                                                sequenceNumber),
+                     "Card number %s sequence number %s" % (cardReaderNumber, sequenceNumber))
+
+    for number, doorOpening in ((0, DoorOpening.FRONT), (256, DoorOpening.FRONT), (1, -1), (1, DoorOpening.BOTH + 1)):
+        _checkRaises(lambda: messages.MessageManualRegistration(0, set([Floor(number, doorOpening)]),
+                                                                Attribution.GENERAL, 0),
+                     "Floor %s door opening %s" % (number, doorOpening))
+
+    frames = []
+    doorOpenings = []
+
+    for _ in range(count):
+        cardReaderNumber = rng.randint(0, 255)
+        attribution = rng.choice(attributions)
+        sequenceNumber = rng.randint(0, 255)
+        floors = [rng.randint(DoorOpening.NONE, DoorOpening.BOTH) if rng.random() < 0.3 else DoorOpening.NONE
+                  for _ in range(255)]
+        accesibleFloors = set(Floor(number + 1, doorOpening) for number, doorOpening in enumerate(floors)
+                              if doorOpening != DoorOpening.NONE)
+        frames.append(_checkRegistration(cardReaderNumber, accesibleFloors, attribution, sequenceNumber))
+        doorOpenings.append((cardReaderNumber, floors, attribution, sequenceNumber))
+        checkedCount += 1
+
+    batch = messages.MessageManualRegistrationBatch(*zip(*doorOpenings)) if doorOpenings else None
+
+    for index, frame in enumerate(frames):
+        if bytes(batch[index]) != frame:
+            raise AssertionError("Batch encoding of frame %s differs from a single registration" % (index, ))
+
+    return checkedCount
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _createResponse(rng, sequenceNumber):
+    """ Create a registration response frame as sent by a controller
+    @param rng: random.Random to draw from
+    @param sequenceNumber: Sequence number to respond to
+    @return A bytes object of the frame
+    """
+
+    return bytes([messages.MessageInterface._HEADER_LENGTH_REGISTRATION_RESPONSE,
+                  messages.MessageInterface._HEADER_VERSION,
+                  0x00, 0x00,
+                  messages.MessageInterface._COMMAND_REGISTRATION_RESPONSE,
+                  sequenceNumber]) + ("%03d%d" % (rng.randint(0, 999), rng.randint(0, 9))).encode("ascii")
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _createRandomFrame(rng):
+    """ Create a frame of random data, biased towards known versions, commands and lengths
+    @param rng: random.Random to draw from
+    @return A bytes object of the frame
+    """
+
+    length = rng.choice([rng.randint(0, 0xff), messages.MessageInterface._HEADER_LENGTH_REGISTRATION_RESPONSE,
+                         messages.MessageInterface._HEADER_LENGTH_HEALTH_CHECK])
+    frame = bytearray(rng.getrandbits(8) for _ in range(messages.MessageInterface._SIZE_HEADER + length))
+    frame[0] = length
+
+    if rng.random() < 0.8 and len(frame) > messages.MessageInterface._OFFSET_COMMAND_FIELD:
+        frame[messages.MessageInterface._OFFSET_HEADER_VERSION_FIELD] = messages.MessageInterface._HEADER_VERSION
+        frame[messages.MessageInterface._OFFSET_COMMAND_FIELD] = rng.choice(
+                                                        [messages.MessageInterface._COMMAND_REGISTRATION_RESPONSE,
+                                                         messages.MessageInterface._COMMAND_HEALTH_CHECK,
+                                                         messages.MessageInterface._COMMAND_MANUAL_REGISTRATION])
+
+    return bytes(frame)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def fuzzFactory(logger, rng, count):
+    """ Feed random frames and truncated ones into the message factory, which should either reject them or create
+        messages which could always be logged
+    @param logger: Logger
+    @param rng: random.Random to draw from
+    @param count: Number of frames to feed
+    @return Number of created messages
+    """
+
+    factory = messages.Factory(logger)
+    createdCount = 0
+
+    for _ in range(count):
+
+        frame = _createRandomFrame(rng)
+        frame = frame[:rng.randint(0, len(frame))] if rng.random() < 0.2 else frame
+        message = factory.create(memoryview(frame))
+
+        if message is None:
+            continue
+
+        createdCount += 1
+
+        # Messages are logged lazily, so formatting a malformed one must not raise
+        repr(message)
+
+        if isinstance(message, messages.MessageRegistrationResponse) and \
+           message.sequenceNumber != frame[messages.MessageInterface._SIZE_HEADER + 
+                                           messages.MessageInterface._SIZE_COMMAND_FIELD]:
+            raise AssertionError("Response sequence number differs from its frame %r" % (frame, ))
+
+    return createdCount
+
+#-----------------------------------------------------------------------------------------------------------------------
+def fuzzConnector(logger, rng, count, bufferSize):
+    """ Write a stream of frames in random fragments to a connector over a local TCP connection, and check every
+        message it receives is created as out of the whole frame and in order
+    @param logger: Logger
+    @param rng: random.Random to draw from
+    @param count: Number of frames in the stream
+    @param bufferSize: Size in bytes of the receive buffer, small ones wrap around often
+    @return Number of received messages
+    """
+
+    frames = [_createResponse(rng, i % 256) if rng.random() < 0.5 else _createRandomFrame(rng) for i in range(count)]
+    stream = b"".join(frames)
+    factory = messages.Factory(logger)
+
+    # Messages may refer to the receive buffer, so they are compared as logged once created
+    expectedMessages = [repr(message) for message in (factory.create(memoryview(frame)) for frame in frames)
+                        if message is not None]
+    fragmentSizes = [rng.choice([1, 2, 3, 7, 64, 259, 4096]) for _ in range(len(stream))]
+
+    async def run():
+
+        loop = asyncio.get_event_loop()
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        listener.setblocking(False)
+        connectionMetrics = metrics.ConnectionMetrics()
+        connector = conectivity._Connector(logger, "127.0.0.1", listener.getsockname()[1], bufferSize,
+                                           connectionMetrics, 1.0)
+        receivedMessages = []
+
+        async def write():
+
+            offset = 0
+
+            for fragmentSize in fragmentSizes:
+
+                if offset >= len(stream):
+                    break
+
+                await loop.sock_sendall(peer, stream[offset:offset + fragmentSize])
+                offset += fragmentSize
+
+                # Lets the connector receive each fragment on its own
+                await asyncio.sleep(0)
+
+        try:
+            await connector.connect()
+            peer, _ = await loop.sock_accept(listener)
+            writer = asyncio.ensure_future(write())
+
+            while connectionMetrics.bytesReceived < len(stream):
+                receivedMessages.extend(repr(message) for message in await connector.receive())
+
+            await writer
+            peer.close()
+
+        finally:
+            connector.close()
+            listener.close()
+
+        return receivedMessages, sum(connectionMetrics.messagesReceived)
+
+    receivedMessages, receivedFramesCount = asyncio.run(run())
+
+    for index, (message, expectedMessage) in enumerate(zip(receivedMessages, expectedMessages)):
+        if message != expectedMessage:
+            raise AssertionError("Message %s was received as %s instead of %s" % (index, message, expectedMessage))
+
+    # Frames too short to carry a command are not counted
+    expectedFramesCount = sum(1 for frame in frames if len(frame) > messages.MessageInterface._OFFSET_COMMAND_FIELD)
+
+    if (len(receivedMessages), receivedFramesCount) != (len(expectedMessages), expectedFramesCount):
+        raise AssertionError("Received %s messages out of %s frames instead of %s out of %s" % (
+                                                        len(receivedMessages), receivedFramesCount,
+                                                        len(expectedMessages), expectedFramesCount))
+
+    return len(receivedMessages)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def measureEncoding(count):
+    """ Measure manual registrations encoded per second out of compiled access profiles
+    @param count: Number of registrations to encode
+    @return Encodes per second
+    """
+
+    accessProfile = messages.MessageManualRegistration.AccessProfile.get(
+                                        frozenset(Floor(number, DoorOpening.FRONT) for number in range(1, 41)))
+    start = time.perf_counter()
+
+    for i in range(count):
+        messages.MessageManualRegistration(i % 256, accessProfile, Attribution.GENERAL, i % 256)
+
+    return count / (time.perf_counter() - start)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def measureDecoding(logger, count):
+    """ Measure registration responses decoded per second out of a received stream, fields included
+    @param logger: Logger
+    @param count: Number of responses to decode
+    @return Decodes per second
+    """
+
+    rng = random.Random(0)
+    stream = b"".join(_createResponse(rng, i % 256) for i in range(count))
+    decoder = conectivity._FrameDecoder(65536)
+    factory = messages.Factory(logger)
+    offset = 0
+    start = time.perf_counter()
+
+    while offset < len(stream):
+
+        freeBuffer = decoder.getFreeBuffer()
+        fragmentSize = min(len(freeBuffer), len(stream) - offset)
+        freeBuffer[:fragmentSize] = stream[offset:offset + fragmentSize]
+        offset += fragmentSize
+
+        for frame in decoder.decode(fragmentSize):
+            message = factory.create(frame)
+            message.sequenceNumber, message.assignedCarNumber
+
+    return count / (time.perf_counter() - start)
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "E-LIP codec round trip checks, fuzzing and throughput gates")
+    parser.add_argument("--seed", type = int, default = None, help = "Random seed, a random one if not given")
+    parser.add_argument("--count", type = int, default = 10000, help = "Number of random cases of each check")
+    parser.add_argument("--buffer-size", type = int, default = 300, help = "Connector receive buffer size")
+    parser.add_argument("--min-encode-rate", type = float, default = MIN_ENCODE_RATE,
+                        help = "Fail if registrations are encoded slower than this many per second, 0 not to check")
+    parser.add_argument("--min-decode-rate", type = float, default = MIN_DECODE_RATE,
+                        help = "Fail if responses are decoded slower than this many per second, 0 not to check")
+    args = parser.parse_args()
+
+    logger = logging.getLogger('logger')
+    logger.setLevel(logging.ERROR)
+    logger.addHandler(logging.StreamHandler())
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    rng = random.Random(seed)
+    print("Seed: %s" % (seed, ))
+
+    print("Round trip: %s registrations" % (checkRoundTrip(rng, args.count // 10), ))
+    print("Factory: %s messages out of %s random frames" % (fuzzFactory(logger, rng, args.count), args.count))
+    print("Connector: %s messages out of %s random frames" % (fuzzConnector(logger, rng, args.count, args.buffer_size),
+                                                               args.count))
+
+    encodeRate = measureEncoding(args.count * 10)
+    decodeRate = measureDecoding(logger, args.count * 10)
+    print("Encoding: %.1f registrations/s" % (encodeRate, ))
+    print("Decoding: %.1f responses/s" % (decodeRate, ))
+
+    failures = [(name, rate, minRate) for name, rate, minRate in (("Encoding", encodeRate, args.min_encode_rate),
+                                                                  ("Decoding", decodeRate, args.min_decode_rate))
+                if rate < minRate]
+
+    for name, rate, minRate in failures:
+        print("%s regressed: %.1f/s is below %.1f/s" % (name, rate, minRate))
+
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,210 @@
+import collections
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# Extra fields of a record of a repetitive event to rate limit, e.g. logger.info("Sending message: %s", message, 
+# extra = logs.RATE_LIMIT)
+RATE_LIMIT = {"rateLimit": True}
+
+#=======================================================================================================================
+class RateLimitFilter(logging.Filter):
+    """ Lets through at most a burst of records of the same logger and message per period and drops the rest, so that
+        a repetitive event, e.g. a failing reconnect or a message sent on every swipe, is sampled instead of flooding
+        the log. Only records logged with RATE_LIMIT extra fields are rate limited, all others are let through.
+        Once the period of dropped records is over, a summary of how many were dropped is emitted at the highest level
+        among them, so no warning or error goes missing unnoticed.
+        Records are told apart by their message before formatting, which only works for lazily formatted messages.
+    """
+
+    __MAX_KEYS = 4096
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, emit, period = 1.0, burst = 10):
+        """ C'tor
+        @param emit: A callable of a summary record of dropped records, must not pass through the filter again
+        @param period: Time in seconds over which a burst is counted
+        @param burst: Maximal number of records of the same message let through in a period
+        """
+
+        super(RateLimitFilter, self).__init__()
+        self.__emit = emit
+        self.__period = period
+        self.__burst = burst
+        self.__lock = threading.Lock()
+
+        # Logger name and message to a list of period start time, records count, dropped records count and the highest
+        # level of the dropped records
+        self.__windows = {}
+
+        # Windows with dropped records in order of their first dropped record, so a summary may be held up by one
+        # period at most
+        self.__droppingWindows = collections.OrderedDict()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def filter(self, record):
+        """
+        @see: logging.Filter documentation
+        """
+
+        now = time.monotonic()
+        isLetThrough = True
+
+        with self.__lock:
+
+            summaries = self.__popSummaries(now) if self.__droppingWindows else None
+
+            if getattr(record, "rateLimit", False):
+
+                key = (record.name, record.msg)
+                window = self.__windows.get(key)
+
+                if window is None or now - window[0] >= self.__period:
+
+                    if window is None and len(self.__windows) >= self.__MAX_KEYS:
+                        self.__dropExpiredWindows(now)
+
+                    window = self.__windows[key] = [now, 0, 0, logging.NOTSET]
+
+                window[1] += 1
+
+                if window[1] > self.__burst:
+                    window[2] += 1
+                    window[3] = max(window[3], record.levelno)
+                    self.__droppingWindows[key] = window
+                    isLetThrough = False
+
+        # Summaries go first, as their records were logged before this one
+        for summary in summaries or ():
+            self.__emit(summary)
+
+        return isLetThrough
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def flush(self):
+        """ Emit summaries of all dropped records right away, e.g. before logging stops
+        """
+
+        with self.__lock:
+            summaries = self.__popSummaries(None)
+
+        for summary in summaries:
+            self.__emit(summary)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __popSummaries(self, now):
+        """ Forget the dropped records of the periods which are over
+        @attention: Lock must be held
+        @param now: time.monotonic() time, None to forget all of them
+        @return A list of summary records
+        """
+
+        summaries = []
+
+        while self.__droppingWindows:
+
+            key, window = next(iter(self.__droppingWindows.items()))
+
+            if now is not None and now - window[0] < self.__period:
+                break
+
+            del self.__droppingWindows[key]
+            summaries.append(logging.makeLogRecord({"name": key[0], "levelno": window[3], 
+                                                    "levelname": logging.getLevelName(window[3]),
+                                                    "msg": "%s records like \"%s\" were dropped in %s seconds",
+                                                    "args": (window[2], key[1], self.__period)}))
+
+            # A window which goes on after a flush counts its dropped records anew
+            window[2] = 0
+            window[3] = logging.NOTSET
+
+        return summaries
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __dropExpiredWindows(self, now):
+        """ Forget the messages which were not logged in the last period
+        @attention: Lock must be held
+        @param now: time.monotonic() time
+        """
+
+        for key, window in list(self.__windows.items()):
+            if now - window[0] >= self.__period and key not in self.__droppingWindows:
+                del self.__windows[key]
+
+#=======================================================================================================================
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """ Hands records over to a queue as they are, so their messages are formatted by the queue listener thread rather
+        than by the logging thread. Arguments of a logged message must therefore not change once logged.
+    """
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def prepare(self, record):
+        """
+        @see: logging.handlers.QueueHandler documentation
+        """
+
+        # A traceback keeps the frames of the logging thread alive, so it is rendered before leaving it
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+#=======================================================================================================================
+class _QueueListener(logging.handlers.QueueListener):
+    """ A queue listener which emits the summaries of rate limited records before stopping
+    """
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, records, handlers, rateLimitFilter):
+        """ C'tor
+        @param records: Queue of records
+        @param handlers: A list of handlers to hand the records to
+        @param rateLimitFilter: RateLimitFilter of the records, None if they are not rate limited
+        """
+
+        super(_QueueListener, self).__init__(records, *handlers, respect_handler_level = True)
+        self.__rateLimitFilter = rateLimitFilter
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        """
+        @see: logging.handlers.QueueListener documentation
+        """
+
+        if self.__rateLimitFilter is not None:
+            self.__rateLimitFilter.flush()
+
+        super(_QueueListener, self).stop()
+
+#-----------------------------------------------------------------------------------------------------------------------
+def startQueueLogging(logger, rateLimitPeriod = 1.0, rateLimitBurst = 10):
+    """ Move the handlers of a logger to a background thread, so that a slow handler, e.g. a stalled disk or a remote
+        syslog, never holds up the thread which logs, and optionally rate limit the records of repetitive events, see
+        RateLimitFilter
+    @param logger: Logger whose handlers to move
+    @param rateLimitPeriod: Time in seconds over which repetitive records are rate limited, None to keep all records
+    @param rateLimitBurst: Maximal number of records of the same message kept in a rate limit period
+    @return A started logging.handlers.QueueListener, which must be stopped to flush the remaining records
+    """
+
+    handlers = list(logger.handlers)
+    records = queue.SimpleQueue()
+    queueHandler = LazyQueueHandler(records)
+    rateLimitFilter = None
+
+    # Summaries are queued as they are, they are neither filtered again nor hold anything to be prepared
+    if rateLimitPeriod is not None:
+        rateLimitFilter = RateLimitFilter(records.put, rateLimitPeriod, rateLimitBurst)
+        queueHandler.addFilter(rateLimitFilter)
+
+    for handler in handlers:
+        logger.removeHandler(handler)
+
+    logger.addHandler(queueHandler)
+    listener = _QueueListener(records, handlers, rateLimitFilter)
+    listener.start()
+
+    return listener
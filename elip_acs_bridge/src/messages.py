@@ -1,8 +1,20 @@
 import collections
+import functools
+import numbers
+import struct
+import threading
+
+try:
+    import numpy
+    
+except ImportError:
+    numpy = None
 
 #=======================================================================================================================
 class MessageInterface(object):
     
+    __slots__ = ()
+    
     OFFSET_HEADER_DATA_LENGTH_FIELD = 0x0
     
     _COMMAND_MANUAL_REGISTRATION   = 0x20
@@ -30,45 +42,128 @@ class MessageInterface(object):
         
         pass   
 
+#=======================================================================================================================
+class Layout(object):
+    """ A declarative field layout of a received message, compiled into a single struct.Struct unpacker
+    """
+    
+    class Field(collections.namedtuple("Field", "name offset size type")):
+        """ C'tor
+        @param name: Field name
+        @param offset: Offset in bytes of the field within the frame
+        @param size: Size in bytes of the field
+        @param type: How should the field be decoded
+        """
+        
+        __slots__ = ()
+        
+        class Types(object):
+            UINT  = 0 # Big endian unsigned integer of 1, 2 or 4 bytes
+            ASCII = 1 # Decimal number as ASCII chars
+            BYTES = 2 # Raw bytes
+    
+    __UINT_FORMATS = {1: "B", 2: "H", 4: "I"}
+    
+#-----------------------------------------------------------------------------------------------------------------------  
+    def __init__(self, fields):
+        """ C'tor
+        @param fields: A list of fields, must not overlap
+        """
+        
+        fields = sorted(fields, key = lambda field: field.offset)
+        format_ = ">"
+        offset = 0
+        
+        for field in fields:
+            
+            if field.offset < offset:
+                raise StructureError("Field %s overlaps its preceding field" % (field.name, ))
+            
+            format_ += "%sx" % (field.offset - offset, ) if field.offset > offset else ""
+            
+            if field.type == self.Field.Types.UINT:
+                format_ += self.__UINT_FORMATS[field.size]
+                
+            else:
+                format_ += "%ss" % (field.size, )
+            
+            offset = field.offset + field.size
+        
+        self.__struct = struct.Struct(format_)
+        self.__fieldsType = collections.namedtuple("Fields", [field.name for field in fields])
+        self.__asciiIndexes = tuple(index for index, field in enumerate(fields) 
+                                    if field.type == self.Field.Types.ASCII)
+
+#-----------------------------------------------------------------------------------------------------------------------  
+    @property
+    def size(self): return self.__struct.size
+
+#-----------------------------------------------------------------------------------------------------------------------  
+    def unpack(self, bytes_):
+        """ Decode all fields of a frame
+        @param bytes_: A bytes-like object of at least size bytes
+        @return A named tuple of the fields by their names
+        """
+        
+        values = self.__struct.unpack_from(bytes_)
+        
+        if self.__asciiIndexes:
+            values = list(values)
+            
+            for index in self.__asciiIndexes:
+                
+                try:
+                    values[index] = int(values[index])
+                
+                except ValueError:
+                    raise StructureError("Field %s is not a decimal number: %r" % (self.__fieldsType._fields[index], 
+                                                                                  bytes(values[index])))
+        
+        return self.__fieldsType._make(values)
+
 #=======================================================================================================================
 class MessageRegistrationResponse(MessageInterface):
+    """ A registration response which wraps its received frame and decodes its fields on first access
+    """
+    
+    __slots__ = ("__bytes", "__fields")
 
-    __SIZE_SEQUENCE_NUMBER_FIELD      = 0x01
-    __SIZE_ASSIGNED_CAR_NUMBER_FIELD  = 0x03
-    __SIZE_ASSIGNED_BANK_NUMBER_FIELD = 0x03
+    __OFFSET_SEQUENCE_NUMBER_FIELD = MessageInterface._SIZE_HEADER + MessageInterface._SIZE_COMMAND_FIELD
     
-    __OFFSET_SEQUENCE_NUMBER_FIELD      = MessageInterface._SIZE_HEADER + MessageInterface._SIZE_COMMAND_FIELD
-    __OFFSET_ASSIGNED_CAR_NUMBER_FIELD  = __OFFSET_SEQUENCE_NUMBER_FIELD + __SIZE_SEQUENCE_NUMBER_FIELD
-    __OFFSET_ASSIGNED_BANK_NUMBER_FIELD = __OFFSET_ASSIGNED_CAR_NUMBER_FIELD + __SIZE_ASSIGNED_BANK_NUMBER_FIELD
+    LAYOUT = Layout([Layout.Field("sequenceNumber",     0x05, 0x01, Layout.Field.Types.UINT),   # Sequence number byte
+                     Layout.Field("assignedCarNumber",  0x06, 0x03, Layout.Field.Types.ASCII),  # Car number as 3 chars
+                     Layout.Field("assignedBankNumber", 0x09, 0x01, Layout.Field.Types.ASCII)]) # Bank number as a char
 
 #-----------------------------------------------------------------------------------------------------------------------   
     def __init__(self, bytes_):
         """ C'tor
-        @param bytes_: A bytes object representing the response
+        @param bytes_: A bytes-like object representing the response, may be a memoryview of a receive buffer
         """
 
-        self.__bytes = bytes
-        self.__sequenceNumber = self.__bytes[self.__OFFSET_SEQUENCE_NUMBER_FIELD]
-        self.__assignedCarNumber = int(self.__bytes[self.__OFFSET_ASSIGNED_CAR_NUMBER_FIELD : 
-                                                    self.__OFFSET_ASSIGNED_BANK_NUMBER_FIELD].decode("ascii"))
-        self.__assignedBankNumber = int(self.__bytes[self.__OFFSET_ASSIGNED_BANK_NUMBER_FIELD].decode("ascii"))
+        self.__bytes = bytes_
         
 #-----------------------------------------------------------------------------------------------------------------------  
     def __repr__(self): 
-        return "MessageRegistrationResponse(sequenceNumber=%s, assignedCarNumber=%s, assignedBankNumber=%s)" % (
-                                            self.__sequenceNumber, self.__assignedCarNumber, self.__assignedBankNumber)
+        
+        # Logged lazily, possibly on another thread, where a malformed field must not fail the log record
+        try:
+            return "MessageRegistrationResponse(sequenceNumber=%s, assignedCarNumber=%s, assignedBankNumber=%s)" % (
+                                            self.sequenceNumber, self.assignedCarNumber, self.assignedBankNumber)
+        
+        except StructureError as e:
+            return "MessageRegistrationResponse(sequenceNumber=%s, malformed=%s)" % (self.sequenceNumber, e)
 
 #-----------------------------------------------------------------------------------------------------------------------
     @property    
-    def sequenceNumber(self): return self.__sequenceNumber
+    def sequenceNumber(self): return self.__bytes[self.__OFFSET_SEQUENCE_NUMBER_FIELD]
     
 #-----------------------------------------------------------------------------------------------------------------------    
     @property
-    def assignedCarNumber(self): return self.__assignedCarNumber
+    def assignedCarNumber(self): return self.__getFields().assignedCarNumber
 
 #-----------------------------------------------------------------------------------------------------------------------    
     @property
-    def assignedBankNumber(self): return self.__assignedBankNumber
+    def assignedBankNumber(self): return self.__getFields().assignedBankNumber
     
 #-----------------------------------------------------------------------------------------------------------------------         
     def getAsBytes(self): 
@@ -78,23 +173,45 @@ class MessageRegistrationResponse(MessageInterface):
         
         return self.__bytes         
 
+#-----------------------------------------------------------------------------------------------------------------------         
+    def __getFields(self):
+        """ Decode all fields on first access
+        @return Decoded fields
+        """
+        
+        try:
+            return self.__fields
+        
+        except AttributeError:
+            self.__fields = self.LAYOUT.unpack(self.__bytes)
+            return self.__fields
+
 #=======================================================================================================================    
 class MessageManualRegistration(MessageInterface):
     
+    __slots__ = ("__cardReaderNumber", "__accessProfile", "__accesibleFloors", "__attribution", "__sequenceNumber", 
+                 "__bytes")
+    
     __CARD_NUMBER_MIN     = 0
     __CARD_NUMBER_MAX     = 255
    
-    __SEQUENCE_NUMBER_MAX = 0
+    __SEQUENCE_NUMBER_MIN = 0
     __SEQUENCE_NUMBER_MAX = 255
     
-    __FLOOR_NUMBER_MIN    = 1
-    __FLOOR_NUMBER_MAX    = 255
+    _ATTRIBUTION_NAMES = {0x30: "GENERAL", 0x31: "HANDICAPPED", 0x32: "VIP"}
     
-    __SIZE_CARD_NUMBER_FIELD = 0x04
-    
-    __OFFSET_ACCESIBLE_FLOORS = MessageInterface._SIZE_HEADER + MessageInterface._SIZE_COMMAND_FIELD + \
-                                __SIZE_CARD_NUMBER_FIELD
+    # Everything which precedes the accessible floors bitmap, per card reader number
+    _PREFIXES = [bytes([MessageInterface._HEADER_LENGTH_MANUAL_REGISTRATION,       # Length byte 
+                         MessageInterface._HEADER_VERSION,                          # Version byte
+                         0x00, 0x00,                                                # 2 Reserved bytes
+                         MessageInterface._COMMAND_MANUAL_REGISTRATION]) +          # Command byte 
+                  ("%04d" % cardReaderNumber).encode("ascii")                       # Card reader number as 4 chars
+                  for cardReaderNumber in range(__CARD_NUMBER_MAX + 1)]
     
+    LAYOUT = Layout([Layout.Field("cardReaderNumber", 0x05, 0x04, Layout.Field.Types.ASCII),  # Card number as 4 chars
+                     Layout.Field("bitmap",           0x09, 0x40, Layout.Field.Types.BYTES),  # Accessible floors bitmap
+                     Layout.Field("attribution",      0x49, 0x01, Layout.Field.Types.UINT),   # Attribution byte
+                     Layout.Field("sequenceNumber",   0x4a, 0x01, Layout.Field.Types.UINT)])  # Sequence number byte
     
     class Attribution(object):
         class Types(object):
@@ -108,6 +225,8 @@ class MessageManualRegistration(MessageInterface):
         @param doorOpening: How should the doors be opened
         """
         
+        __slots__ = ()
+        
         class DoorOpening(object):
             class Types(object):
                 NONE  = 0 # 00
@@ -120,83 +239,143 @@ class MessageManualRegistration(MessageInterface):
         
         def __hash__(self): return self.number
         
+    class AccessProfile(object):
+        """ A set of accessible floors compiled once into the floors bitmap of a manual registration
+        """
+        
+        __slots__ = ("__accesibleFloors", "__bitmap")
+        
+        __FLOOR_NUMBER_MIN = 1
+        __FLOOR_NUMBER_MAX = 255
+        
+        __SIZE_BITMAP = 0x40
+        
+        def __init__(self, accesibleFloors):
+            """ C'tor
+            @param accesibleFloors: A set() of accessible floors
+            """
+            
+            self.__accesibleFloors = tuple(sorted(accesibleFloors))
+            bitmap = 0
+            
+            for floor in self.__accesibleFloors:
+                
+                if floor.number < self.__FLOOR_NUMBER_MIN or floor.number > self.__FLOOR_NUMBER_MAX:
+                    raise StructureError("Floor number should be in range of %s - %s" % (self.__FLOOR_NUMBER_MIN, 
+                                                                                         self.__FLOOR_NUMBER_MAX))
+                
+                # A wider value would spill into the bits of the next floor
+                if not isinstance(floor.doorOpening, numbers.Integral) or \
+                   floor.doorOpening < MessageManualRegistration.Floor.DoorOpening.Types.NONE or \
+                   floor.doorOpening > MessageManualRegistration.Floor.DoorOpening.Types.BOTH:
+                    raise StructureError("Door opening should be in range of %s - %s" % (
+                                                            MessageManualRegistration.Floor.DoorOpening.Types.NONE,
+                                                            MessageManualRegistration.Floor.DoorOpening.Types.BOTH))
+                
+                # Each floor takes 2 bits, 4 floors in a byte with lower floors in the lower bits, floor number -1 
+                # since minimal floor number is 1 but 0 in our bitmap
+                # Example: Floor 242 -> (242 - 1) * 2 = 482 Which is the 3rd bit of the 61th byte
+                bitmap |= floor.doorOpening << ((floor.number - 1) * 2)
+            
+            self.__bitmap = bitmap.to_bytes(self.__SIZE_BITMAP, "little")
+        
+        def __repr__(self): return "AccessProfile(accesibleFloors=%s)" % (list(self.__accesibleFloors), )
+        
+        @property
+        def accesibleFloors(self): return self.__accesibleFloors
+        
+        @property
+        def bitmap(self): return self.__bitmap
+        
+        @staticmethod
+        @functools.lru_cache(maxsize = 1024)
+        def get(accesibleFloors):
+            """ Get a compiled access profile, reusing a previously compiled one for recurring sets of floors
+            @param accesibleFloors: A frozenset() of accessible floors
+            @return An access profile
+            """
+            
+            return MessageManualRegistration.AccessProfile(accesibleFloors)
+        
+        @staticmethod
+        def fromBitmap(bitmap):
+            """ Get the access profile of an encoded floors bitmap
+            @param bitmap: A bytes-like object of a floors bitmap
+            @return An access profile
+            """
+            
+            bitmap = int.from_bytes(bitmap, "little")
+            accesibleFloors = []
+            number = 1
+            
+            while bitmap:
+                
+                if bitmap & 0x3:
+                    accesibleFloors.append(MessageManualRegistration.Floor(number, bitmap & 0x3))
+                
+                bitmap >>= 2
+                number += 1
+            
+            return MessageManualRegistration.AccessProfile.get(frozenset(accesibleFloors))
+        
 #-----------------------------------------------------------------------------------------------------------------------     
     def __init__(self, cardReaderNumber, accesibleFloors, attribution, sequenceNumber):
         """ C'tor
         @param cardReaderNumber: Swiped card number as integer
-        @param accessibleFloors: A set() of accessible floors
+        @param accessibleFloors: A set() of accessible floors or a compiled AccessProfile
         @param attribution: Specific attribution
         @param sequenceNumber: Message sequence number
         """ 
         
-        if cardReaderNumber < self.__CARD_NUMBER_MIN or cardReaderNumber > self.__CARD_NUMBER_MAX:
-            raise StructureError("Card number should be in range of 0 - %s" % (self.__CARD_NUMBER_MIN, 
-                                                                               self.__CARD_NUMBER_MAX))
+        # Checking the type of plain ints first spares the costlier abstract type check of the common case
+        if type(cardReaderNumber) is not int and not isinstance(cardReaderNumber, numbers.Integral) or \
+           cardReaderNumber < self.__CARD_NUMBER_MIN or cardReaderNumber > self.__CARD_NUMBER_MAX:
+            raise StructureError("Card number should be in range of %s - %s" % (self.__CARD_NUMBER_MIN, 
+                                                                                self.__CARD_NUMBER_MAX))
         
-        if sequenceNumber < 0 or sequenceNumber > self.__SEQUENCE_NUMBER_MAX:
-            raise StructureError("Sequence number should be in range of 0 - %s" % (self.__SEQUENCE_NUMBER_MIN, 
-                                                                                   self.__SEQUENCE_NUMBER_MAX))
+        if type(sequenceNumber) is not int and not isinstance(sequenceNumber, numbers.Integral) or \
+           sequenceNumber < self.__SEQUENCE_NUMBER_MIN or sequenceNumber > self.__SEQUENCE_NUMBER_MAX:
+            raise StructureError("Sequence number should be in range of %s - %s" % (self.__SEQUENCE_NUMBER_MIN, 
+                                                                                    self.__SEQUENCE_NUMBER_MAX))
+        
+        if type(attribution) is not int and not isinstance(attribution, numbers.Integral) or \
+           attribution not in self._ATTRIBUTION_NAMES:
+            raise StructureError("Attribution should be one of %s" % (sorted(self._ATTRIBUTION_NAMES), ))
+        
+        if not isinstance(accesibleFloors, self.AccessProfile):
+            accesibleFloors = self.AccessProfile.get(frozenset(accesibleFloors))
              
         self.__cardReaderNumber = cardReaderNumber
-        self.__accesibleFloors = sorted(accesibleFloors)
+        self.__accessProfile = accesibleFloors
+        self.__accesibleFloors = accesibleFloors.accesibleFloors
         self.__attribution = attribution
         self.__sequenceNumber = sequenceNumber
         
-        strCardReaderNumber = "%04d" % cardReaderNumber
-        
-        self.__bytes = bytearray([self._HEADER_LENGTH_MANUAL_REGISTRATION,           # Length byte       
-                                  self._HEADER_VERSION,                              # Version byte
-                                  0x00, 0x00,                                        # 2 Reserved bytes
-                                  self._COMMAND_MANUAL_REGISTRATION,                 # Command byte                               
-                                  strCardReaderNumber[0],                            # Card reader number as 4 chars
-                                  strCardReaderNumber[1],
-                                  strCardReaderNumber[2], 
-                                  strCardReaderNumber[3],  
-                                  0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,    # 64 Bytes of non allowed floors
-                                  0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-                                  0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 
-                                  0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-                                  0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 
-                                  0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 
-                                  0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-                                  0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-                                  self.__attribution,                                 # Attribution char
-                                  sequenceNumber,                                     # Sequence number byte
-                                  0x00, 0x00, 0x00, 0x00, 0x00])                      # 5 Reserved bytes
-        
-        # Build the floors byte array
-        for floor in self.__accesibleFloors:
-            
-            if floor.number < self.__FLOOR_NUMBER_MIN or floor.number > self.__FLOOR_NUMBER_MAX:
-                raise StructureError("Floor number should be in range of %s - %s" % (self.MIN_NUMBER, 
-                                                                                     self.MAX_NUMBER))
-            
-            # Floor number -1 since minimal floor number is 1 but 0 in our array
-            # *2 to get the lowest bit location of the floor and /8 for the byte location within the array
-            # Example: Floor 242 -> ((242 - 1) * 2) / 8 = 60 Which is exactly the 61th byte
-            byteIndex = int(((floor.number - 1) * 2) / 8) 
-            
-            # Now add the correct message offset
-            byteIndex +=  self.__OFFSET_ACCESIBLE_FLOORS
-            
-            # Floor number -1 since minimal floor number is 1 but 0 in our array
-            # We have 4 floors in one bytes, so the location of a floor is determined by %4, but each floor takes 2 bits
-            # So we need to *2
-            # Example Floor 242 -> ((242 - 1) % 4) * 2 = 2 Which is exactly the 3rd bit shift left offset
-            doorOpeningOffset = (((floor.number - 1) % 4) * 2)
-            
-            # Now we just place it 
-            byteValue = self.__bytes[byteIndex]
-            self.__bytes[byteIndex] = byteValue | (floor.doorOpening << doorOpeningOffset)
-            
-        # Now immutable it
-        self.__bytes = bytes(self.__bytes)
+        self.__bytes = self._PREFIXES[cardReaderNumber] + accesibleFloors.bitmap + bytes([attribution,  
+                                                                                           sequenceNumber, 
+                                                                                           0x00, 0x00, 0x00, 0x00, 0x00])
+
+#-----------------------------------------------------------------------------------------------------------------------     
+    @classmethod
+    def fromBytes(cls, bytes_):
+        """ Create a manual registration out of its encoded frame
+        @param bytes_: A bytes-like object of a whole manual registration frame
+        @return A manual registration message
+        """
+        
+        if len(bytes_) < cls.LAYOUT.size:
+            raise StructureError("Manual registration should be at least %s bytes" % (cls.LAYOUT.size, ))
+        
+        fields = cls.LAYOUT.unpack(bytes_)
+        
+        return cls(fields.cardReaderNumber, cls.AccessProfile.fromBitmap(fields.bitmap), fields.attribution, 
+                   fields.sequenceNumber)
 
 #-----------------------------------------------------------------------------------------------------------------------  
     def __repr__(self): 
         return "MessageManualRegistration(cardReaderNumber=%s, accesibleFloors=%s, attribution=%s, sequenceNumber=%s)"\
-                 % (self.__cardReaderNumber, self.__accesibleFloors, 
-                   (["GENERAL", "HANDICAPPED", "VIP"][self.__attribution - 0x30]), self.__sequenceNumber)
+                 % (self.__cardReaderNumber, list(self.__accesibleFloors), 
+                    self._ATTRIBUTION_NAMES.get(self.__attribution, self.__attribution), self.__sequenceNumber)
 
 #----------------------------------------------------------------------------------------------------------------------- 
     @property
@@ -204,15 +383,25 @@ class MessageManualRegistration(MessageInterface):
 
 #-----------------------------------------------------------------------------------------------------------------------         
     @property
-    def accesibleFloors(self): self.__accesibleFloors
+    def accesibleFloors(self): return self.__accesibleFloors
 
 #-----------------------------------------------------------------------------------------------------------------------         
     @property
-    def attribution(self): self.__attribution
+    def attribution(self): return self.__attribution
 
 #-----------------------------------------------------------------------------------------------------------------------         
     @property
-    def sequenceNumber(self): self.__sequenceNumber      
+    def sequenceNumber(self): return self.__sequenceNumber      
+        
+#-----------------------------------------------------------------------------------------------------------------------         
+    def withSequenceNumber(self, sequenceNumber):
+        """ Get a copy of the message with another sequence number
+        @param sequenceNumber: Message sequence number
+        @return A manual registration message
+        """
+        
+        return MessageManualRegistration(self.__cardReaderNumber, self.__accessProfile, self.__attribution, 
+                                         sequenceNumber)
         
 #-----------------------------------------------------------------------------------------------------------------------         
     def getAsBytes(self): 
@@ -222,16 +411,277 @@ class MessageManualRegistration(MessageInterface):
         
         return self.__bytes     
     
+#=======================================================================================================================    
+class MessagePreencodedRegistration(MessageInterface):
+    """ A manual registration which was encoded elsewhere, e.g. in another process, and is sent as is. Only the fields
+        needed to route and prioritize it are decoded.
+    """
+    
+    __slots__ = ("__bytes", )
+    
+    __OFFSET_CARD_READER_NUMBER = MessageInterface._SIZE_HEADER + MessageInterface._SIZE_COMMAND_FIELD
+    __OFFSET_ATTRIBUTION        = MessageManualRegistration.LAYOUT.size - 2
+    __OFFSET_SEQUENCE_NUMBER    = MessageManualRegistration.LAYOUT.size - 1
+    
+    SIZE = MessageInterface._SIZE_HEADER + MessageInterface._HEADER_LENGTH_MANUAL_REGISTRATION
+
+#-----------------------------------------------------------------------------------------------------------------------     
+    def __init__(self, bytes_):
+        """ C'tor
+        @param bytes_: A bytes object of a whole manual registration frame
+        """ 
+        
+        if len(bytes_) != self.SIZE or bytes_[MessageInterface._OFFSET_COMMAND_FIELD] != \
+                                                                        MessageInterface._COMMAND_MANUAL_REGISTRATION:
+            raise StructureError("Not a manual registration frame")
+        
+        self.__bytes = bytes_
+
+#-----------------------------------------------------------------------------------------------------------------------  
+    def __repr__(self): 
+        return "MessagePreencodedRegistration(cardReaderNumber=%s, sequenceNumber=%s)" % (self.cardReaderNumber, 
+                                                                                           self.sequenceNumber)
+
+#----------------------------------------------------------------------------------------------------------------------- 
+    @property
+    def cardReaderNumber(self): 
+        return int(self.__bytes[self.__OFFSET_CARD_READER_NUMBER:self.__OFFSET_CARD_READER_NUMBER + 4])
+
+#-----------------------------------------------------------------------------------------------------------------------         
+    @property
+    def attribution(self): return self.__bytes[self.__OFFSET_ATTRIBUTION]
+
+#-----------------------------------------------------------------------------------------------------------------------         
+    @property
+    def sequenceNumber(self): return self.__bytes[self.__OFFSET_SEQUENCE_NUMBER]
+        
+#-----------------------------------------------------------------------------------------------------------------------         
+    def withSequenceNumber(self, sequenceNumber):
+        """ Get a copy of the message with another sequence number
+        @param sequenceNumber: Message sequence number
+        @return A preencoded manual registration message
+        """
+        
+        bytes_ = bytearray(self.__bytes)
+        bytes_[self.__OFFSET_SEQUENCE_NUMBER] = sequenceNumber
+        
+        return MessagePreencodedRegistration(bytes(bytes_))
+        
+#-----------------------------------------------------------------------------------------------------------------------         
+    def getAsBytes(self): 
+        """
+        @see: Interface documentation
+        """
+        
+        return self.__bytes     
+
+#=======================================================================================================================    
+class MessageManualRegistrationBatch(MessageInterface):
+    """ Many manual registrations encoded at once into a single buffer of back to back frames, which could be sent
+        over a connector as is. Encoding is vectorized when NumPy is available.
+    """
+    
+    __slots__ = ("__count", "__bytes", "__view")
+    
+    __CARD_NUMBER_MAX     = 255
+    __SEQUENCE_NUMBER_MAX = 255
+    __DOOR_OPENING_MAX    = MessageManualRegistration.Floor.DoorOpening.Types.BOTH
+    __FLOORS_COUNT        = 255
+    
+    __SIZE_FRAME  = MessageInterface._SIZE_HEADER + MessageInterface._HEADER_LENGTH_MANUAL_REGISTRATION
+    __SIZE_PREFIX = len(MessageManualRegistration._PREFIXES[0])
+    __SIZE_BITMAP = 0x40
+    
+    __OFFSET_BITMAP          = __SIZE_PREFIX
+    __OFFSET_ATTRIBUTION     = __OFFSET_BITMAP + __SIZE_BITMAP
+    __OFFSET_SEQUENCE_NUMBER = __OFFSET_ATTRIBUTION + 1
+    
+#-----------------------------------------------------------------------------------------------------------------------     
+    def __init__(self, cardReaderNumbers, doorOpenings, attributions, sequenceNumbers):
+        """ C'tor
+        @param cardReaderNumbers: A sequence of swiped card numbers
+        @param doorOpenings: A sequence of 255 door openings per card where the door opening of floor N is at index 
+                             N - 1, e.g. a NumPy array of N x 255
+        @param attributions: A sequence of attributions
+        @param sequenceNumbers: A sequence of messages sequence numbers
+        """ 
+        
+        self.__count = len(cardReaderNumbers)
+        
+        # An empty batch has no frame to send, and no length field to tell its frames apart by
+        if self.__count == 0:
+            raise StructureError("A batch should hold at least one registration")
+        
+        if len(doorOpenings) != self.__count or len(attributions) != self.__count or \
+                                                                                len(sequenceNumbers) != self.__count:
+            raise StructureError("Door openings, attributions and sequence numbers should be given for each card")
+        
+        if numpy is not None:
+            self.__bytes = self.__encodeVectorized(cardReaderNumbers, doorOpenings, attributions, sequenceNumbers)
+            
+        else:
+            self.__bytes = self.__encode(cardReaderNumbers, doorOpenings, attributions, sequenceNumbers)
+            
+        self.__view = memoryview(self.__bytes)
+
+#-----------------------------------------------------------------------------------------------------------------------  
+    def __repr__(self): 
+        return "MessageManualRegistrationBatch(count=%s)" % (self.__count, )
+
+#-----------------------------------------------------------------------------------------------------------------------  
+    def __len__(self): return self.__count
+
+#-----------------------------------------------------------------------------------------------------------------------  
+    def __getitem__(self, index):
+        """ Get a single frame of the batch
+        @param index: Frame index
+        @return A memoryview of the frame within the batch buffer
+        """
+        
+        if index < 0 or index >= self.__count:
+            raise IndexError("Frame index out of range")
+        
+        return self.__view[index * self.__SIZE_FRAME : (index + 1) * self.__SIZE_FRAME]
+        
+#-----------------------------------------------------------------------------------------------------------------------         
+    def getAsBytes(self): 
+        """
+        @see: Interface documentation
+        """
+        
+        return self.__bytes     
+    
+#-----------------------------------------------------------------------------------------------------------------------         
+    def __encodeVectorized(self, cardReaderNumbers, doorOpenings, attributions, sequenceNumbers):
+        """ Encode all frames with NumPy
+        @return A bytes object of all frames
+        """
+        
+        # Values are range checked in their given dtype, since casting to bytes would silently wrap them around
+        cardReaderNumbers = self.__asIntegers(cardReaderNumbers, "Card number", self.__CARD_NUMBER_MAX)
+        sequenceNumbers = self.__asIntegers(sequenceNumbers, "Sequence number", self.__SEQUENCE_NUMBER_MAX)
+        attributions = numpy.asarray(attributions)
+        
+        if attributions.dtype.kind not in "iu" or \
+           not numpy.isin(attributions, list(MessageManualRegistration._ATTRIBUTION_NAMES)).all():
+            raise StructureError("Attribution should be one of %s" % (
+                                                                sorted(MessageManualRegistration._ATTRIBUTION_NAMES), ))
+        
+        try:
+            doorOpenings = numpy.asarray(doorOpenings)
+            
+        except ValueError:
+            raise StructureError("Door openings should be given for all %s floors" % (self.__FLOORS_COUNT, ))
+        
+        if doorOpenings.shape != (self.__count, self.__FLOORS_COUNT):
+            raise StructureError("Door openings should be given for all %s floors" % (self.__FLOORS_COUNT, ))
+        
+        doorOpenings = self.__asIntegers(doorOpenings, "Door opening", self.__DOOR_OPENING_MAX)
+        
+        prefixes = numpy.frombuffer(b"".join(MessageManualRegistration._PREFIXES), 
+                                    dtype = numpy.uint8).reshape(-1, self.__SIZE_PREFIX)
+        
+        # Pad to whole bytes of 4 floors each, lower floors in the lower bits
+        floors = numpy.zeros((self.__count, self.__SIZE_BITMAP * 4), dtype = numpy.uint8)
+        floors[:, :self.__FLOORS_COUNT] = doorOpenings
+        floors = floors.reshape(self.__count, self.__SIZE_BITMAP, 4)
+        
+        frames = numpy.zeros((self.__count, self.__SIZE_FRAME), dtype = numpy.uint8)
+        frames[:, :self.__OFFSET_BITMAP] = prefixes[cardReaderNumbers]
+        frames[:, self.__OFFSET_BITMAP:self.__OFFSET_ATTRIBUTION] = floors[:, :, 0] | (floors[:, :, 1] << 2) | \
+                                                                    (floors[:, :, 2] << 4) | (floors[:, :, 3] << 6)
+        frames[:, self.__OFFSET_ATTRIBUTION] = attributions
+        frames[:, self.__OFFSET_SEQUENCE_NUMBER] = sequenceNumbers
+        
+        return frames.tobytes()
+    
+#-----------------------------------------------------------------------------------------------------------------------         
+    @staticmethod
+    def __asIntegers(values, name, maximum):
+        """ Convert values to a NumPy array of bytes, validating them first as the scalar encoding does
+        @param values: A sequence or NumPy array of values
+        @param name: Name of the values for the error message
+        @param maximum: Maximal value
+        @return A NumPy array of uint8
+        """
+        
+        values = numpy.asarray(values)
+        
+        if values.dtype.kind not in "iu" or values.min() < 0 or values.max() > maximum:
+            raise StructureError("%s should be in range of 0 - %s" % (name, maximum))
+        
+        return values.astype(numpy.uint8)
+    
+#-----------------------------------------------------------------------------------------------------------------------         
+    def __encode(self, cardReaderNumbers, doorOpenings, attributions, sequenceNumbers):
+        """ Encode all frames one by one, when NumPy is not available
+        @return A bytes object of all frames
+        """
+        
+        bytes_ = bytearray(self.__count * self.__SIZE_FRAME)
+        offset = 0
+        
+        for cardReaderNumber, floors, attribution, sequenceNumber in zip(cardReaderNumbers, doorOpenings, 
+                                                                         attributions, sequenceNumbers):
+            
+            if not isinstance(cardReaderNumber, numbers.Integral) or \
+               cardReaderNumber < 0 or cardReaderNumber > self.__CARD_NUMBER_MAX:
+                raise StructureError("Card number should be in range of 0 - %s" % (self.__CARD_NUMBER_MAX, ))
+            
+            if not isinstance(sequenceNumber, numbers.Integral) or \
+               sequenceNumber < 0 or sequenceNumber > self.__SEQUENCE_NUMBER_MAX:
+                raise StructureError("Sequence number should be in range of 0 - %s" % (self.__SEQUENCE_NUMBER_MAX, ))
+            
+            if not isinstance(attribution, numbers.Integral) or \
+               attribution not in MessageManualRegistration._ATTRIBUTION_NAMES:
+                raise StructureError("Attribution should be one of %s" % (
+                                                                sorted(MessageManualRegistration._ATTRIBUTION_NAMES), ))
+            
+            if len(floors) != self.__FLOORS_COUNT:
+                raise StructureError("Door openings should be given for all %s floors" % (self.__FLOORS_COUNT, ))
+            
+            if not all(isinstance(floor, numbers.Integral) for floor in floors) or \
+               min(floors) < 0 or max(floors) > self.__DOOR_OPENING_MAX:
+                raise StructureError("Door opening should be in range of 0 - %s" % (self.__DOOR_OPENING_MAX, ))
+            
+            # Pad to whole bytes of 4 floors each, lower floors in the lower bits
+            floors = list(floors) + [0]
+            
+            bytes_[offset : offset + self.__OFFSET_BITMAP] = MessageManualRegistration._PREFIXES[cardReaderNumber]
+            bytes_[offset + self.__OFFSET_BITMAP : offset + self.__OFFSET_ATTRIBUTION] = bytes(
+                        floors[i] | (floors[i + 1] << 2) | (floors[i + 2] << 4) | (floors[i + 3] << 6) 
+                        for i in range(0, len(floors), 4))
+            bytes_[offset + self.__OFFSET_ATTRIBUTION] = attribution
+            bytes_[offset + self.__OFFSET_SEQUENCE_NUMBER] = sequenceNumber
+            offset += self.__SIZE_FRAME
+            
+        return bytes(bytes_)
+
 #=======================================================================================================================    
 class MessageHealthCheck(MessageInterface):
+    """ A health check carries no data, so a single preencoded instance is shared. The controller echoes health checks
+        back, so a received one is the same instance.
+    """
+    
+    __slots__ = ()
+    
+    LAYOUT = Layout([Layout.Field("reserved", 0x05, 0x03, Layout.Field.Types.BYTES)]) # 3 reserved bytes
+    
+    __BYTES = bytes([MessageInterface._HEADER_LENGTH_HEALTH_CHECK,         # Length byte       
+                     MessageInterface._HEADER_VERSION,                     # Version byte
+                     0x00, 0x00,                                           # 2 Reserved bytes
+                     MessageInterface._COMMAND_HEALTH_CHECK,               # Command byte                               
+                     0x00, 0x00, 0x00])                                    # 3 reserved bytes            
+    
+    __instance = None
     
 #-----------------------------------------------------------------------------------------------------------------------   
-    def __init__(self):
-        self.__bytes = bytearray([self._HEADER_LENGTH_HEALTH_CHECK,           # Length byte       
-                                self._HEADER_VERSION,                         # Version byte
-                                0x00, 0x00,                                   # 2 Reserved bytes
-                                self._COMMAND_HEALTH_CHECK,                   # Command byte                               
-                                0x00, 0x00, 0x00])                            # 3 reserved bytes            
+    def __new__(cls, bytes_ = None):
+        
+        if cls.__instance is None:
+            cls.__instance = super(MessageHealthCheck, cls).__new__(cls)
+            
+        return cls.__instance
 
 #-----------------------------------------------------------------------------------------------------------------------  
     def __repr__(self): 
@@ -243,7 +693,7 @@ class MessageHealthCheck(MessageInterface):
         @see: Interface documentation
         """
         
-        return self.__bytes              
+        return self.__BYTES              
         
         
 #=======================================================================================================================
@@ -252,6 +702,22 @@ class StructureError(Exception):
 
 #=======================================================================================================================
 class Factory(object):
+    """ Creates received messages by a dispatch table of message classes keyed by protocol version and command.
+        A message class is constructed with its frame and defines its LAYOUT, frames shorter than it are rejected.
+    """
+    
+    __messageClasses = {}
+    
+#-----------------------------------------------------------------------------------------------------------------------          
+    @classmethod
+    def register(cls, version, command, messageClass):
+        """ Register a message class to create out of frames of a protocol version and command
+        @param version: Protocol version byte
+        @param command: Command byte
+        @param messageClass: Message class
+        """
+        
+        cls.__messageClasses[(version << 8) | command] = messageClass
     
 #-----------------------------------------------------------------------------------------------------------------------          
     def __init__(self, logger):
@@ -260,6 +726,18 @@ class Factory(object):
         """
         
         self.__logger = logger
+        self.__unknownFramesCounter = collections.Counter()
+        self.__unknownFramesLock = threading.Lock()
+
+#-----------------------------------------------------------------------------------------------------------------------              
+    @property
+    def unknownFramesCounter(self): 
+        """ A copy of the number of unidentified frames received by (version, command), where malformed frames are 
+            counted under (None, None), safe to take from any thread
+        """
+        
+        with self.__unknownFramesLock:
+            return collections.Counter(self.__unknownFramesCounter)
 
 #-----------------------------------------------------------------------------------------------------------------------              
     def create(self, bytes_):
@@ -268,18 +746,47 @@ class Factory(object):
         @return Message or None if received unidentified data 
         """ 
         
-        if bytes_[MessageInterface._OFFSET_HEADER_VERSION_FIELD] != MessageInterface._HEADER_VERSION:
-            self.__logger.warning("Received unknown protocol version data: %x" % (
-                                                            bytes_[MessageInterface._OFFSET_HEADER_VERSION_FIELD], ))
-            
+        if len(bytes_) <= MessageInterface._OFFSET_COMMAND_FIELD:
+            self.__countUnknown(None, None)
             return None
         
-        if bytes_[MessageInterface._OFFSET_COMMAND_FIELD] == MessageInterface._COMMAND_REGISTRATION_RESPONSE:
-            return MessageRegistrationResponse(bytes_)
+        version = bytes_[MessageInterface._OFFSET_HEADER_VERSION_FIELD]
+        command = bytes_[MessageInterface._OFFSET_COMMAND_FIELD]
+        messageClass = self.__messageClasses.get((version << 8) | command)
         
-        else:
-            self.__logger.warning("Received unexpected command field: %x" % (
-                                                            bytes_[MessageInterface._OFFSET_COMMAND_FIELD], ))        
+        if messageClass is None:
+            self.__countUnknown(version, command)
+            return None
         
+        if len(bytes_) < messageClass.LAYOUT.size:
+            self.__countUnknown(None, None)
             return None
-        
\ No newline at end of file
+        
+        return messageClass(bytes_)
+    
+#-----------------------------------------------------------------------------------------------------------------------              
+    def __countUnknown(self, version, command):
+        """ Count an unidentified frame, only the first of its kind is logged
+        @param version: Protocol version byte or None if malformed 
+        @param command: Command byte or None if malformed
+        """
+        
+        key = (version, command)
+        
+        with self.__unknownFramesLock:
+            isFirst = key not in self.__unknownFramesCounter
+            self.__unknownFramesCounter[key] += 1
+        
+        if isFirst:
+            
+            if version is None:
+                self.__logger.warning("Received malformed data, further ones are only counted")
+                
+            else:
+                self.__logger.warning("Received unknown protocol version %x command %x, further ones are only counted", 
+                                      version, command)
+
+#=======================================================================================================================
+Factory.register(MessageInterface._HEADER_VERSION, MessageInterface._COMMAND_REGISTRATION_RESPONSE, 
+                 MessageRegistrationResponse)
+Factory.register(MessageInterface._HEADER_VERSION, MessageInterface._COMMAND_HEALTH_CHECK, MessageHealthCheck)
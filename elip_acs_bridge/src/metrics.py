@@ -0,0 +1,285 @@
+import bisect
+import http.server
+import json
+import re
+import threading
+import time
+
+#=======================================================================================================================
+class Histogram(object):
+    """ A histogram of fixed buckets, cheap enough to observe on the hot path
+    """
+
+    __slots__ = ("__bounds", "__counts", "__sum")
+
+    # Seconds, from 100us up to a minute
+    DEFAULT_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                      30, 60)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, bounds = DEFAULT_BOUNDS):
+        """ C'tor
+        @param bounds: Ascending upper bounds of the buckets, values above the last bound are counted in +Inf only
+        """
+
+        self.__bounds = tuple(bounds)
+        self.__counts = [0] * (len(self.__bounds) + 1)
+        self.__sum = 0
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def observe(self, value):
+        """ Count a value
+        @param value: Observed value
+        """
+
+        self.__counts[bisect.bisect_left(self.__bounds, value)] += 1
+        self.__sum += value
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def snapshot(self):
+        """ Get the current state of the histogram
+        @return A dict of cumulative bucket counts by upper bound, total count and sum of values
+        """
+
+        counts = list(self.__counts)
+        buckets = []
+        cumulativeCount = 0
+
+        for bound, count in zip(self.__bounds, counts):
+            cumulativeCount += count
+            buckets.append((bound, cumulativeCount))
+
+        return {"buckets": buckets, "count": cumulativeCount + counts[-1], "sum": self.__sum}
+
+#=======================================================================================================================
+class ConnectionMetrics(object):
+    """ Counters of a single E-LIP connection, plain attributes incremented in place by the connection
+    """
+
+    __slots__ = ("messagesSent", "messagesReceived", "bytesSent", "bytesReceived", "sendCalls", "receiveCalls",
+                 "sendWouldBlock", "reconnects", "registrationsSkipped", "registrationsCoalesced", "reconnectDuration",
+                 "healthCheckRtt", "responseLatency",
+                 "queueDepthGetter", "queueAgeGetter", "unknownFramesGetter", "smoothedRttGetter")
+
+    GAUGES = frozenset(["queueDepth", "queueAge", "smoothedRtt"])
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self):
+        """ C'tor
+        """
+
+        # Per command byte
+        self.messagesSent = [0] * 256
+        self.messagesReceived = [0] * 256
+
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.sendCalls = 0
+        self.receiveCalls = 0
+        self.sendWouldBlock = 0
+        self.reconnects = 0
+        self.registrationsSkipped = 0
+        self.registrationsCoalesced = 0
+        self.reconnectDuration = Histogram()
+        self.healthCheckRtt = Histogram()
+        self.responseLatency = Histogram()
+
+        # Set by the owners of the measured state
+        self.queueDepthGetter = lambda: 0
+        self.queueAgeGetter = lambda: 0
+        self.unknownFramesGetter = lambda: 0
+        self.smoothedRttGetter = lambda: 0
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def snapshot(self):
+        """ Get the current state of all metrics
+        @return A dict of metric name to a number, a dict of command to a number, or a histogram snapshot
+        """
+
+        return {"queueDepth": self.queueDepthGetter(),
+                "queueAge": self.queueAgeGetter(),
+                "smoothedRtt": self.smoothedRttGetter(),
+                "messagesSent": self.__commandCounts(self.messagesSent),
+                "messagesReceived": self.__commandCounts(self.messagesReceived),
+                "bytesSent": self.bytesSent,
+                "bytesReceived": self.bytesReceived,
+                "sendCalls": self.sendCalls,
+                "receiveCalls": self.receiveCalls,
+                "sendWouldBlock": self.sendWouldBlock,
+                "reconnects": self.reconnects,
+                "registrationsSkipped": self.registrationsSkipped,
+                "registrationsCoalesced": self.registrationsCoalesced,
+                "unknownFrames": self.unknownFramesGetter(),
+                "reconnectDuration": self.reconnectDuration.snapshot(),
+                "healthCheckRtt": self.healthCheckRtt.snapshot(),
+                "responseLatency": self.responseLatency.snapshot()}
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def __commandCounts(counts):
+        """ Get non zero per command counts
+        @param counts: A list of counts indexed by command byte
+        @return A dict of command as hex string to count
+        """
+
+        return dict(("0x%02x" % (command, ), count) for command, count in enumerate(counts) if count)
+
+#=======================================================================================================================
+class Exporter(object):
+    """ Serves snapshots of connection metrics over HTTP on a local port, as Prometheus text on /metrics and as JSON on
+        /metrics.json
+    """
+
+    # Backslash first, so the escapes added for the others are not escaped again
+    __LABEL_ESCAPES = (("\\", "\\\\"), ("\"", "\\\""), ("\n", "\\n"))
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, logger, getMetrics, port, hostname = "127.0.0.1"):
+        """ C'tor
+        @param logger: Logger
+        @param getMetrics: A callable returning a dict of controller name to its ConnectionMetrics, or to a snapshot of 
+                           them taken elsewhere, e.g. in the process running the connection
+        @param port: TCP port to listen on, 0 for any free port
+        @param hostname: Address to listen on
+        """
+
+        self.__logger = logger
+        self.__getMetrics = getMetrics
+        self.__server = http.server.ThreadingHTTPServer((hostname, port), self.__createHandlerClass())
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target = self.__server.serve_forever)
+        self.__thread.daemon = True
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @property
+    def port(self): return self.__server.server_address[1]
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def start(self):
+        """ Start serving
+        """
+
+        self.__thread.start()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        """ Stop serving
+        """
+
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def snapshot(self):
+        """ Get snapshots of all connections
+        @return A dict of controller name to its metrics snapshot, with the time of the snapshot under "timestamp"
+        """
+
+        return {"timestamp": time.time(),
+                "controllers": dict((name, metrics if isinstance(metrics, dict) else metrics.snapshot()) 
+                                    for name, metrics in self.__getMetrics().items())}
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def formatPrometheus(self):
+        """ Format snapshots of all connections in Prometheus text exposition format
+        @return A str of the formatted metrics
+        """
+
+        samples = {}
+
+        for controller, snapshot in self.snapshot()["controllers"].items():
+            for name, value in snapshot.items():
+                samples.setdefault(name, []).append((controller, value))
+
+        lines = []
+
+        for name, controllerValues in sorted(samples.items()):
+
+            metricName = "elip_" + re.sub("([A-Z])", r"_\1", name).lower()
+            isHistogram = isinstance(controllerValues[0][1], dict) and "buckets" in controllerValues[0][1]
+
+            if isHistogram:
+                metricType = "histogram"
+
+            elif name in ConnectionMetrics.GAUGES:
+                metricType = "gauge"
+
+            else:
+                metricType = "counter"
+                metricName += "_total"
+
+            lines.append("# TYPE %s %s" % (metricName, metricType))
+
+            for controller, value in controllerValues:
+
+                controller = self.__escapeLabelValue(controller)
+
+                if isHistogram:
+                    for bound, count in value["buckets"]:
+                        lines.append('%s_bucket{controller="%s",le="%s"} %s' % (metricName, controller, bound, count))
+
+                    lines.append('%s_bucket{controller="%s",le="+Inf"} %s' % (metricName, controller, value["count"]))
+                    lines.append('%s_sum{controller="%s"} %s' % (metricName, controller, value["sum"]))
+                    lines.append('%s_count{controller="%s"} %s' % (metricName, controller, value["count"]))
+
+                elif isinstance(value, dict):
+                    for command, count in sorted(value.items()):
+                        lines.append('%s{controller="%s",command="%s"} %s' % (metricName, controller, 
+                                                                              self.__escapeLabelValue(command), count))
+
+                else:
+                    lines.append('%s{controller="%s"} %s' % (metricName, controller, value))
+
+        return "\n".join(lines) + "\n"
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def __escapeLabelValue(cls, value):
+        """ Escape a label value for the Prometheus text exposition format
+        @param value: Label value
+        @return A str of the escaped value
+        """
+
+        value = str(value)
+
+        for char, escape in cls.__LABEL_ESCAPES:
+            value = value.replace(char, escape)
+
+        return value
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __createHandlerClass(self):
+        """ Create the HTTP request handler class bound to this exporter
+        @return A request handler class
+        """
+
+        exporter = self
+        logger = self.__logger
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+
+                if self.path == "/metrics":
+                    body = exporter.formatPrometheus().encode("utf-8")
+                    contentType = "text/plain; version=0.0.4"
+
+                elif self.path == "/metrics.json":
+                    body = json.dumps(exporter.snapshot()).encode("utf-8")
+                    contentType = "application/json"
+
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", contentType)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format_, *args):
+                logger.debug("Metrics request: " + format_, *args)
+
+        return Handler
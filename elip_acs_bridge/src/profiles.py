@@ -0,0 +1,160 @@
+import collections
+import messages
+import threading
+import time
+
+#=======================================================================================================================
+class AccessProfileCache(object):
+    """ An index of card reader number to its compiled access profile, so a swipe becomes a manual registration without
+        building and sorting a set of floors. Bounded by a number of cards, evicting the least recently swiped, and
+        optionally by a time to live after which a card is looked up again. Safe to use from any thread.
+    """
+
+    Entry = collections.namedtuple("Entry", "accessProfile expiryTime")
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, logger, maxSize = 65536, timeToLive = None, loader = None):
+        """ C'tor
+        @param logger: Logger
+        @param maxSize: Maximal number of cards in the cache
+        @param timeToLive: Time in seconds a card stays in the cache since it was loaded, None to keep it until evicted
+        @param loader: A callable of a card reader number returning its set() of accessible floors, or None if the
+                       card is unknown, called on a cache miss, e.g. a lookup in the ACS database
+        """
+
+        self.__logger = logger
+        self.__maxSize = maxSize
+        self.__timeToLive = timeToLive
+        self.__loader = loader
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__expirations = 0
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __len__(self): return len(self.__entries)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @property
+    def hitRate(self):
+        """ Ratio of lookups which were served from the cache, 0 before any lookup
+        """
+
+        lookups = self.__hits + self.__misses
+
+        return self.__hits / lookups if lookups else 0
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def snapshot(self):
+        """ Get cache statistics
+        @return A dict of statistic name to a number
+        """
+
+        return {"size": len(self.__entries),
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "evictions": self.__evictions,
+                "expirations": self.__expirations,
+                "hitRate": self.hitRate}
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def get(self, cardReaderNumber):
+        """ Get the access profile of a card, loading it on a miss
+        @param cardReaderNumber: Swiped card number
+        @return A compiled access profile, or None if the card is unknown
+        """
+
+        with self.__lock:
+
+            entry = self.__entries.get(cardReaderNumber)
+
+            if entry is not None:
+
+                if entry.expiryTime is None or entry.expiryTime > time.monotonic():
+                    self.__entries.move_to_end(cardReaderNumber)
+                    self.__hits += 1
+                    return entry.accessProfile
+
+                del self.__entries[cardReaderNumber]
+                self.__expirations += 1
+
+            self.__misses += 1
+
+        if self.__loader is None:
+            return None
+
+        # Loaded outside of the lock, a slow lookup must not hold up swipes of cached cards
+        accesibleFloors = self.__loader(cardReaderNumber)
+
+        if accesibleFloors is None:
+            return None
+
+        return self.update(cardReaderNumber, accesibleFloors)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def createRegistration(self, cardReaderNumber, attribution):
+        """ Create the manual registration of a swipe
+        @param cardReaderNumber: Swiped card number
+        @param attribution: Specific attribution
+        @return A manual registration message with sequence number 0, or None if the card is unknown
+        """
+
+        accessProfile = self.get(cardReaderNumber)
+
+        if accessProfile is None:
+            return None
+
+        return messages.MessageManualRegistration(cardReaderNumber, accessProfile, attribution, 0)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def update(self, cardReaderNumber, accesibleFloors):
+        """ Set the accessible floors of a card, once its rights change
+        @param cardReaderNumber: Card number
+        @param accesibleFloors: A set() of accessible floors or a compiled AccessProfile
+        @return The compiled access profile
+        """
+
+        if not isinstance(accesibleFloors, messages.MessageManualRegistration.AccessProfile):
+            accesibleFloors = messages.MessageManualRegistration.AccessProfile.get(frozenset(accesibleFloors))
+
+        expiryTime = None if self.__timeToLive is None else time.monotonic() + self.__timeToLive
+
+        with self.__lock:
+
+            self.__entries[cardReaderNumber] = self.Entry(accesibleFloors, expiryTime)
+            self.__entries.move_to_end(cardReaderNumber)
+
+            while len(self.__entries) > self.__maxSize:
+                self.__entries.popitem(last = False)
+                self.__evictions += 1
+
+        return accesibleFloors
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def invalidate(self, cardReaderNumber):
+        """ Drop a card, so it is loaded again on its next swipe
+        @param cardReaderNumber: Card number
+        """
+
+        with self.__lock:
+            self.__entries.pop(cardReaderNumber, None)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def warmLoad(self, cards):
+        """ Load many cards at once, e.g. all cards of the ACS database on startup
+        @param cards: An iterable of (card reader number, set() of accessible floors) tuples
+        @return Number of loaded cards
+        """
+
+        count = 0
+
+        for cardReaderNumber, accesibleFloors in cards:
+            self.update(cardReaderNumber, accesibleFloors)
+            count += 1
+
+        self.__logger.info("Warm loaded %s cards, %s cached", count, len(self.__entries))
+
+        return count
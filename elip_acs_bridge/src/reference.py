@@ -0,0 +1,29 @@
+import messages
+
+#-----------------------------------------------------------------------------------------------------------------------
+def encodeRegistrationPerFloor(cardReaderNumber, accesibleFloors, attribution, sequenceNumber):
+    """ Encode a manual registration the way the former MessageManualRegistration C'tor did, floor by floor, as a
+        reference which the codecs are checked and measured against
+    @param cardReaderNumber: Swiped card number as integer
+    @param accessibleFloors: A set() of accessible floors
+    @param attribution: Specific attribution
+    @param sequenceNumber: Message sequence number
+    @return A bytes object of the encoded message
+    """
+
+    strCardReaderNumber = ("%04d" % cardReaderNumber).encode("ascii")
+    bytes_ = bytearray([messages.MessageInterface._HEADER_LENGTH_MANUAL_REGISTRATION,
+                        messages.MessageInterface._HEADER_VERSION,
+                        0x00, 0x00,
+                        messages.MessageInterface._COMMAND_MANUAL_REGISTRATION,
+                        strCardReaderNumber[0], strCardReaderNumber[1],
+                        strCardReaderNumber[2], strCardReaderNumber[3]] +
+                       [0x00] * 64 +
+                       [attribution, sequenceNumber, 0x00, 0x00, 0x00, 0x00, 0x00])
+
+    for floor in sorted(accesibleFloors):
+        byteIndex = int(((floor.number - 1) * 2) / 8) + 9
+        doorOpeningOffset = (((floor.number - 1) % 4) * 2)
+        bytes_[byteIndex] = bytes_[byteIndex] | (floor.doorOpening << doorOpeningOffset)
+
+    return bytes(bytes_)
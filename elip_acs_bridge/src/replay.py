@@ -0,0 +1,222 @@
+import argparse
+import capture
+import collections
+import conectivity
+import logging
+import messages
+import simulator
+import statistics
+import threading
+import time
+
+_COMMAND_NAMES = {messages.MessageInterface._COMMAND_MANUAL_REGISTRATION: "manual registration",
+                  messages.MessageInterface._COMMAND_HEALTH_CHECK: "health check",
+                  messages.MessageInterface._COMMAND_REGISTRATION_RESPONSE: "registration response"}
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _percentiles(latencies):
+    """ Summarize a latency distribution
+    @param latencies: A list of latencies in seconds
+    @return A dict of percentile to seconds
+    """
+
+    quantiles = statistics.quantiles(latencies, n = 100, method = "inclusive") if len(latencies) > 1 else \
+                latencies * 99 or [0] * 99
+
+    return collections.OrderedDict((percentile, quantiles[percentile - 1]) for percentile in (50, 90, 99))
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _formatPercentiles(percentiles):
+    return ", ".join("p%s %.2f ms" % (percentile, latency * 1000) for percentile, latency in percentiles.items())
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _iterateFrames(path):
+    """ Iterate over the frames of a capture, with the sequence numbers of registrations and their responses
+    @param path: Path of a capture file
+    @return An iterator of (record, frame, command, sequence number) tuples, where the command is None for a malformed
+            frame and the sequence number is None for frames other than registrations and their responses
+    """
+
+    for record in capture.CaptureReader(path):
+
+        for frame in record.frames:
+
+            command = frame[messages.MessageInterface._OFFSET_COMMAND_FIELD] \
+                      if len(frame) > messages.MessageInterface._OFFSET_COMMAND_FIELD else None
+            sequenceNumber = None
+
+            try:
+                if command == messages.MessageInterface._COMMAND_MANUAL_REGISTRATION:
+                    sequenceNumber = messages.MessagePreencodedRegistration(bytes(frame)).sequenceNumber
+
+                elif command == messages.MessageInterface._COMMAND_REGISTRATION_RESPONSE and \
+                     len(frame) >= messages.MessageRegistrationResponse.LAYOUT.size:
+                    sequenceNumber = messages.MessageRegistrationResponse(frame).sequenceNumber
+
+            except messages.StructureError:
+                pass
+
+            yield record, frame, command, sequenceNumber
+
+#-----------------------------------------------------------------------------------------------------------------------
+def analyze(logger, path):
+    """ Measure a capture offline: frames per command, peak frame rate, decoding throughput of the received frames and
+        the recorded registration to response latency
+    @param logger: Logger
+    @param path: Path of a capture file
+    @return A dict of statistics names to values
+    """
+
+    framesCounter = collections.Counter()
+    framesPerSecond = collections.Counter()
+    receivedFrames = []
+    firstSentTimes = {}
+    latencies = []
+    first = last = None
+
+    # Responses are matched to the first transmission of their sequence number, retransmissions add to the latency
+    for record, frame, command, sequenceNumber in _iterateFrames(path):
+
+        first = record.timestamp if first is None else first
+        last = record.timestamp
+        framesPerSecond[int(record.timestamp)] += 1
+        framesCounter[(record.direction, command)] += 1
+
+        if record.direction == capture.CaptureWriter.DIRECTION_RECEIVED:
+            receivedFrames.append(frame)
+
+            if sequenceNumber is not None and sequenceNumber in firstSentTimes:
+                latencies.append(record.timestamp - firstSentTimes.pop(sequenceNumber))
+
+        elif sequenceNumber is not None:
+            firstSentTimes.setdefault(sequenceNumber, record.timestamp)
+
+    factory = messages.Factory(logger)
+    start = time.perf_counter()
+
+    for frame in receivedFrames:
+        repr(factory.create(frame))
+
+    decodeTime = time.perf_counter() - start
+
+    return collections.OrderedDict((("frames", framesCounter),
+                                    ("duration", 0 if first is None else last - first),
+                                    ("peakFramesPerSecond", max(framesPerSecond.values(), default = 0)),
+                                    ("decodeRate", len(receivedFrames) / decodeTime if decodeTime else 0),
+                                    ("latencies", _percentiles(latencies)),
+                                    ("unansweredCount", len(firstSentTimes))))
+
+#-----------------------------------------------------------------------------------------------------------------------
+def replay(logger, path, speed, controllerArgs, timeout = 0.5, retries = 3):
+    """ Replay the registrations sent in a capture against a simulated controller, under sequence numbers assigned
+        anew, and measure registration to response latency
+    @param logger: Logger
+    @param path: Path of a capture file
+    @param speed: Factor of the original pace to send the registrations at, None to send them as fast as possible
+    @param controllerArgs: A dict of keyword arguments of the simulated controller
+    @param timeout: Time in seconds to wait for a response before retransmitting
+    @param retries: Number of retransmissions before giving up
+    @return A tuple of responded registrations per second, a dict of latency percentile to seconds and number of
+            registrations which were never responded
+    """
+
+    # A retransmission is the very frame of its pending first transmission, so it is not replayed on its own. Another 
+    # registration may reuse the sequence number of an unanswered one, and is replayed.
+    registrations = []
+    pendingFrames = {}
+
+    for record, frame, command, sequenceNumber in _iterateFrames(path):
+
+        if sequenceNumber is None:
+            continue
+
+        if record.direction == capture.CaptureWriter.DIRECTION_RECEIVED:
+            pendingFrames.pop(sequenceNumber, None)
+
+        elif pendingFrames.get(sequenceNumber) != frame:
+            pendingFrames[sequenceNumber] = bytes(frame)
+            registrations.append((record.timestamp, messages.MessagePreencodedRegistration(bytes(frame))))
+
+    controller = simulator.Controller(logger, **controllerArgs)
+    controller.start()
+    connection = conectivity.Connection(logger, "127.0.0.1", controller.port, 4096, 60, 0.1, 0.1)
+    connection.start()
+    latencies = []
+    failures = []
+    doneEvent = threading.Event()
+    pendingCount = [len(registrations)]
+    lock = threading.Lock()
+
+    def onDone(sentTime, future):
+        if not future.cancelled() and future.exception() is None:
+            latencies.append(time.perf_counter() - sentTime)
+        else:
+            failures.append(future)
+
+        with lock:
+            pendingCount[0] -= 1
+
+            if not pendingCount[0]:
+                doneEvent.set()
+
+    start = time.perf_counter()
+    firstTimestamp = registrations[0][0] if registrations else 0
+
+    for timestamp, registration in registrations:
+
+        if speed is not None:
+            delay = start + (timestamp - firstTimestamp) / speed - time.perf_counter()
+
+            if delay > 0:
+                time.sleep(delay)
+
+        sentTime = time.perf_counter()
+        future = connection.sendRequest(registration, timeout, retries)
+        future.add_done_callback(lambda future, sentTime = sentTime: onDone(sentTime, future))
+
+    if registrations:
+        doneEvent.wait()
+
+    elapsed = time.perf_counter() - start
+    connection.stop()
+    controller.stop()
+
+    return len(latencies) / elapsed if elapsed else 0, _percentiles(latencies), len(failures)
+
+#-----------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Analyze an E-LIP capture offline and replay its registrations "
+                                                   "against a simulated controller")
+    parser.add_argument("capture", help = "Capture file recorded with --capture-directory")
+    parser.add_argument("--speed", type = float, default = None,
+                        help = "Factor of the original pace to replay at, as fast as possible if not given")
+    parser.add_argument("--no-replay", action = "store_true", help = "Only analyze the capture")
+    parser.add_argument("--latency", type = float, default = 0.002, help = "Simulated controller latency")
+    parser.add_argument("--jitter", type = float, default = 0.001, help = "Simulated controller jitter")
+    parser.add_argument("--drop-rate", type = float, default = 0, help = "Simulated response drop probability")
+    args = parser.parse_args()
+
+    logger = logging.getLogger('logger')
+    logger.setLevel(logging.WARNING)
+    logger.addHandler(logging.StreamHandler())
+
+    analysis = analyze(logger, args.capture)
+
+    # Malformed frames have no command, they are listed last
+    for (direction, command), count in sorted(analysis["frames"].items(),
+                                              key = lambda item: (item[0][0], item[0][1] is None, item[0][1] or 0)):
+        print("%s %s: %s frames" % ("Sent" if direction == capture.CaptureWriter.DIRECTION_SENT else "Received",
+                                    _COMMAND_NAMES.get(command, "unknown command %s" % (command, )), count))
+
+    print("Duration: %.2f s, peak %s frames/s" % (analysis["duration"], analysis["peakFramesPerSecond"]))
+    print("Decoding: %.1f received frames/s" % (analysis["decodeRate"], ))
+    print("Recorded: %s, %s unanswered" % (_formatPercentiles(analysis["latencies"]), analysis["unansweredCount"]))
+
+    if not args.no_replay:
+        rate, percentiles, failuresCount = replay(logger, args.capture, args.speed,
+                                                  {"latency": args.latency, "jitter": args.jitter,
+                                                   "dropRate": args.drop_rate})
+        print("Replayed %s: %.1f registrations/s, %s, %s unanswered" % (
+                        "as fast as possible" if args.speed is None else "at %sx pace" % (args.speed, ), rate,
+                        _formatPercentiles(percentiles), failuresCount))
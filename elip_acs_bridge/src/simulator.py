@@ -0,0 +1,258 @@
+import asyncio
+import messages
+import random
+import socket
+import threading
+
+#=======================================================================================================================
+class Controller(object):
+    """ An in-process simulated E-LIP controller. Health checks are echoed and manual registrations are answered with
+        registration responses, subject to configurable latency, jitter, fragmentation, drops and disconnects.
+    """
+
+    # Sequence number follows the card reader number, 64 bytes of floors and the attribution
+    __OFFSET_REGISTRATION_SEQUENCE_NUMBER = messages.MessageInterface._SIZE_HEADER + \
+                                            messages.MessageInterface._SIZE_COMMAND_FIELD + 0x04 + 0x40 + 0x01
+
+    def __init__(self, logger, latency = 0, jitter = 0, fragmentSize = None, dropRate = 0, disconnectRate = 0,
+                 bankNumber = 1, carsCount = 8, seed = None, port = 0):
+        """ C'tor
+        @param logger: Logger
+        @param latency: Time in seconds before a registration is answered
+        @param jitter: Maximal time in seconds randomly added to or subtracted from the latency
+        @param fragmentSize: Maximal size in bytes of each write of a response, None to write responses whole
+        @param dropRate: Probability of a registration not being answered
+        @param disconnectRate: Probability of the connection being dropped upon a received frame
+        @param bankNumber: Bank number to assign, a single digit
+        @param carsCount: Number of cars in the bank to assign
+        @param seed: Random seed for a reproducible simulation
+        @param port: TCP port to listen on, 0 for any free port
+        """
+
+        self.__logger = logger
+        self.__latency = latency
+        self.__jitter = jitter
+        self.__fragmentSize = fragmentSize
+        self.__dropRate = dropRate
+        self.__disconnectRate = disconnectRate
+        self.__bankNumber = bankNumber
+        self.__carsCount = carsCount
+        self.__random = random.Random(seed)
+
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+        self.__socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__socket.bind(("127.0.0.1", port))
+
+        self.__registrationsCount = 0
+        self.__healthChecksCount = 0
+        self.__connectionsCount = 0
+        self.__condition = threading.Condition()
+
+        self.__loop = asyncio.new_event_loop()
+        self.__writers = set()
+        self.__blackHoledWriters = set()
+        self.__servingTasks = set()
+        self.__respondingTasks = set()
+        self.__thread = threading.Thread(target = self.__target)
+        self.__thread.daemon = True
+        self.__startedEvent = threading.Event()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @property
+    def port(self): return self.__socket.getsockname()[1]
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @property
+    def registrationsCount(self): return self.__registrationsCount
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @property
+    def healthChecksCount(self): return self.__healthChecksCount
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @property
+    def connectionsCount(self): return self.__connectionsCount
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def waitForRegistrations(self, count, timeout = None):
+        """ Wait until a number of manual registrations were received
+        @param count: Number of manual registrations to wait for
+        @param timeout: Time in seconds to wait for, None to wait forever
+        @return True if received or False on timeout
+        """
+
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.__registrationsCount >= count, timeout)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def blackHoleConnections(self):
+        """ Silently stop answering on all current connections while keeping them open, as a controller which went
+            away without closing its connections does. New connections are served as usual.
+        """
+
+        self.__loop.call_soon_threadsafe(lambda: self.__blackHoledWriters.update(self.__writers))
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def start(self):
+        """ Start serving, returns once connections are accepted
+        """
+
+        self.__thread.start()
+        self.__startedEvent.wait()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        """ Stop serving and drop all connections
+        """
+
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __target(self):
+        """ Thread target
+        """
+
+        asyncio.set_event_loop(self.__loop)
+        server = self.__loop.run_until_complete(asyncio.start_server(self.__serve, sock = self.__socket))
+        self.__startedEvent.set()
+
+        try:
+            self.__loop.run_forever()
+
+        finally:
+            server.close()
+
+            for task in self.__respondingTasks:
+                task.cancel()
+
+            # Serving tasks end once their connections are aborted, the streams machinery does not expect them to be 
+            # cancelled
+            for writer in self.__writers:
+                writer.transport.abort()
+
+            self.__loop.run_until_complete(asyncio.gather(*(self.__servingTasks | self.__respondingTasks),
+                                                          return_exceptions = True))
+            self.__loop.close()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    async def __serve(self, reader, writer):
+        """ Serve a single bridge connection
+        @param reader: Stream reader
+        @param writer: Stream writer
+        """
+
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        writeLock = asyncio.Lock()
+        self.__writers.add(writer)
+        self.__servingTasks.add(asyncio.current_task())
+
+        with self.__condition:
+            self.__connectionsCount += 1
+
+        self.__logger.info("Bridge connected")
+
+        try:
+            while True:
+                header = await reader.readexactly(messages.MessageInterface._SIZE_HEADER)
+                frame = header + await reader.readexactly(
+                                                    header[messages.MessageInterface.OFFSET_HEADER_DATA_LENGTH_FIELD])
+
+                if self.__random.random() < self.__disconnectRate:
+                    self.__logger.info("Dropping bridge connection")
+                    break
+
+                if writer not in self.__blackHoledWriters:
+                    self.__handle(frame, writer, writeLock)
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.__logger.info("Bridge disconnected")
+
+        finally:
+            writer.transport.abort()
+            self.__writers.discard(writer)
+            self.__blackHoledWriters.discard(writer)
+            self.__servingTasks.discard(asyncio.current_task())
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __handle(self, frame, writer, writeLock):
+        """ Handle a received frame
+        @param frame: A bytes object of a whole frame
+        @param writer: Stream writer
+        @param writeLock: Lock which keeps fragmented responses from interleaving
+        """
+
+        command = frame[messages.MessageInterface._OFFSET_COMMAND_FIELD]
+
+        if command == messages.MessageInterface._COMMAND_HEALTH_CHECK:
+
+            with self.__condition:
+                self.__healthChecksCount += 1
+
+            # Health checks are echoed back right away
+            self.__scheduleResponse(frame, 0, writer, writeLock)
+
+            return
+
+        if command != messages.MessageInterface._COMMAND_MANUAL_REGISTRATION:
+            self.__logger.warning("Received unexpected command: %x", command)
+            return
+
+        with self.__condition:
+            self.__registrationsCount += 1
+            self.__condition.notify_all()
+
+        if self.__random.random() < self.__dropRate:
+            return
+
+        response = bytes([messages.MessageInterface._HEADER_LENGTH_REGISTRATION_RESPONSE,  # Length byte
+                          messages.MessageInterface._HEADER_VERSION,                       # Version byte
+                          0x00, 0x00,                                                      # 2 Reserved bytes
+                          messages.MessageInterface._COMMAND_REGISTRATION_RESPONSE,        # Command byte
+                          frame[self.__OFFSET_REGISTRATION_SEQUENCE_NUMBER]]) + \
+                   ("%03d%d" % (self.__random.randint(1, self.__carsCount), self.__bankNumber)).encode("ascii")
+
+        delay = max(0, self.__latency + self.__random.uniform(-self.__jitter, self.__jitter))
+        self.__scheduleResponse(response, delay, writer, writeLock)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __scheduleResponse(self, response, delay, writer, writeLock):
+        """ Schedule a response to be written
+        @see: __respond documentation
+        """
+
+        task = asyncio.ensure_future(self.__respond(response, delay, writer, writeLock))
+        self.__respondingTasks.add(task)
+        task.add_done_callback(self.__respondingTasks.discard)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    async def __respond(self, response, delay, writer, writeLock):
+        """ Write a response after a delay, fragmented if configured to
+        @param response: A bytes object of the response
+        @param delay: Time in seconds to wait before responding
+        @param writer: Stream writer
+        @param writeLock: Lock which keeps fragmented responses from interleaving
+        """
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if writer.is_closing():
+            return
+
+        if self.__fragmentSize is None:
+            writer.write(response)
+            return
+
+        async with writeLock:
+
+            offset = 0
+
+            while offset < len(response) and not writer.is_closing():
+                fragmentSize = self.__random.randint(1, self.__fragmentSize)
+                writer.write(response[offset : offset + fragmentSize])
+                offset += fragmentSize
+
+                # Let each fragment hit the wire separately
+                await writer.drain()
+                await asyncio.sleep(0)
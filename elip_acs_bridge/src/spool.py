@@ -0,0 +1,289 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+#=======================================================================================================================
+class Spool(object):
+    """ An append-only, memory mapped file of encoded frames waiting to be acknowledged, so they survive a restart of
+        the bridge. Appends and acknowledgements are plain memory writes, and are flushed to disk by a background
+        thread at most once per commit latency, so a burst of appends costs a single flush.
+        Acknowledged records are reclaimed by compacting the file once it runs out of space, and records left pending
+        are recovered on the next start.
+
+        File layout is a magic followed by back to back records, each of a state byte, CRC32 of the rest of the
+        record, deadline as time.time() time or 0 to never expire, frame size byte and the frame itself. A record
+        whose state byte is zero ends the file, and a record which fails its CRC is a torn write and ends it as well.
+    """
+
+    __MAGIC = b"ELIPSPL1"
+
+    __STATE_END     = 0
+    __STATE_PENDING = 1
+    __STATE_DONE    = 2
+
+    __RECORD_HEADER = struct.Struct(">BIdB")
+    __CHECKSUM_HEADER = struct.Struct(">dB")
+
+    # State byte and CRC precede the checksummed part of the record
+    __OFFSET_CHECKSUMMED = 5
+
+    __NO_DEADLINE = 0.0
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, logger, path, size = 16 * 1024 * 1024, commitLatency = 0.005):
+        """ C'tor, opens the spool file or creates it if it does not exist
+        @param logger: Logger
+        @param path: Path of the spool file
+        @param size: Initial size in bytes of the spool file, it grows if pending records do not fit
+        @param commitLatency: Maximal time in seconds an append waits before it is flushed to disk, None to flush
+                              every append before it returns
+        """
+
+        self.__logger = logger
+        self.__path = path
+        self.__commitLatency = commitLatency
+        self.__lock = threading.Lock()
+        self.__records = {}
+        self.__nextRecordId = 0
+        self.__recovered = []
+
+        if not os.path.exists(path) or os.path.getsize(path) < len(self.__MAGIC):
+            self.__create(path, size)
+
+        self.__file = open(path, "r+b")
+        self.__mmap = mmap.mmap(self.__file.fileno(), 0)
+
+        if self.__mmap[:len(self.__MAGIC)] != self.__MAGIC:
+            raise SpoolError("Not a spool file: %s" % (path, ))
+
+        self.__end = self.__scan()
+
+        self.__isClosed = False
+        self.__dirtyEvent = threading.Event()
+        self.__flusherThread = threading.Thread(target = self.__flusher)
+        self.__flusherThread.daemon = True
+
+        if self.__commitLatency is not None:
+            self.__flusherThread.start()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __len__(self): return len(self.__records)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def recover(self):
+        """ Take the records which were left pending when the spool was last closed, expired ones excluded
+        @return A list of (record ID, frame, deadline) tuples in order of appending, where deadline is a
+                time.monotonic() time or None to never expire
+        """
+
+        recovered, self.__recovered = self.__recovered, []
+
+        return recovered
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def append(self, frame, deadline):
+        """ Append a frame
+        @param frame: A bytes-like object of an encoded frame
+        @param deadline: time.monotonic() time after which the frame is no longer relevant, None to never expire
+        @return Record ID to acknowledge the frame with
+        """
+
+        wallDeadline = self.__NO_DEADLINE if deadline is None else deadline - time.monotonic() + time.time()
+        checksummed = self.__CHECKSUM_HEADER.pack(wallDeadline, len(frame)) + frame
+        record = struct.pack(">BI", self.__STATE_PENDING, zlib.crc32(checksummed)) + checksummed
+
+        with self.__lock:
+
+            if self.__end + len(record) + 1 > len(self.__mmap):
+                self.__compact(len(record) + 1)
+
+            recordId = self.__nextRecordId
+            self.__nextRecordId += 1
+            self.__mmap[self.__end:self.__end + len(record)] = record
+            self.__records[recordId] = self.__end
+            self.__end += len(record)
+
+        self.__commit()
+
+        return recordId
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def acknowledge(self, recordId):
+        """ Mark a frame as done so it is not recovered, unknown record IDs are ignored, as are all of them once closed
+        @param recordId: Record ID as returned by append() or recover()
+        """
+
+        with self.__lock:
+
+            # Requests may settle while their connection shuts down, their frames are then recovered on the next open
+            if self.__mmap.closed:
+                return
+
+            offset = self.__records.pop(recordId, None)
+
+            if offset is not None:
+                self.__mmap[offset] = self.__STATE_DONE
+
+        # Losing an acknowledgement only costs a duplicate after a crash, so it does not wait for a flush
+        self.__dirtyEvent.set()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """ Flush and close the spool file, records which were not acknowledged are recovered on the next open
+        """
+
+        if self.__isClosed:
+            return
+
+        self.__isClosed = True
+        self.__dirtyEvent.set()
+
+        if self.__flusherThread.is_alive():
+            self.__flusherThread.join()
+
+        with self.__lock:
+            self.__mmap.flush()
+            self.__mmap.close()
+            self.__file.close()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __commit(self):
+        """ Have appended records flushed to disk, right away if there is no commit latency
+        """
+
+        if self.__commitLatency is None:
+
+            with self.__lock:
+                self.__mmap.flush()
+
+        else:
+            self.__dirtyEvent.set()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __flusher(self):
+        """ Flusher thread target, a single flush covers everything appended since the previous one
+        """
+
+        while not self.__isClosed:
+
+            self.__dirtyEvent.wait()
+            time.sleep(self.__commitLatency)
+            self.__dirtyEvent.clear()
+
+            with self.__lock:
+
+                if not self.__mmap.closed:
+                    self.__mmap.flush()
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __scan(self):
+        """ Scan the spool file for pending records
+        @return Offset to append at
+        """
+
+        now = time.time()
+        monotonicNow = time.monotonic()
+        offset = len(self.__MAGIC)
+        expiredCount = 0
+
+        while offset + self.__RECORD_HEADER.size <= len(self.__mmap):
+
+            state, checksum, wallDeadline, frameSize = self.__RECORD_HEADER.unpack_from(self.__mmap, offset)
+            recordEnd = offset + self.__RECORD_HEADER.size + frameSize
+
+            if state == self.__STATE_END:
+                break
+
+            if recordEnd > len(self.__mmap) or \
+               zlib.crc32(self.__mmap[offset + self.__OFFSET_CHECKSUMMED:recordEnd]) != checksum:
+                self.__logger.warning("Spool ends with a torn record, discarding it")
+                self.__mmap[offset:recordEnd] = bytes(min(recordEnd, len(self.__mmap)) - offset)
+                break
+
+            if state == self.__STATE_PENDING:
+
+                if wallDeadline != self.__NO_DEADLINE and wallDeadline < now:
+                    self.__mmap[offset] = self.__STATE_DONE
+                    expiredCount += 1
+
+                else:
+                    deadline = None if wallDeadline == self.__NO_DEADLINE else wallDeadline - now + monotonicNow
+                    frame = bytes(self.__mmap[offset + self.__RECORD_HEADER.size:recordEnd])
+                    self.__records[self.__nextRecordId] = offset
+                    self.__recovered.append((self.__nextRecordId, frame, deadline))
+                    self.__nextRecordId += 1
+
+            offset = recordEnd
+
+        if self.__recovered or expiredCount:
+            self.__logger.info("Recovered %s pending records from spool, %s expired", len(self.__recovered), 
+                               expiredCount)
+
+        return offset
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __compact(self, requiredSize):
+        """ Rewrite the spool file with its pending records only, growing it if they do not leave enough room.
+            The new file is written aside and then replaces the old one, so a crash leaves either one intact.
+        @attention: Lock must be held
+        @param requiredSize: Size in bytes which should be free once compacted
+        """
+
+        offsets = sorted(self.__records.items(), key = lambda item: item[1])
+        records = []
+
+        for recordId, offset in offsets:
+            frameSize = self.__mmap[offset + self.__RECORD_HEADER.size - 1]
+            records.append((recordId, self.__mmap[offset:offset + self.__RECORD_HEADER.size + frameSize]))
+
+        pendingSize = len(self.__MAGIC) + sum(len(record) for _, record in records)
+        size = len(self.__mmap)
+
+        # Keep at least half of the file free so that compactions stay rare
+        while pendingSize + requiredSize > size // 2:
+            size *= 2
+
+        compactPath = self.__path + ".compact"
+        self.__create(compactPath, size)
+
+        with open(compactPath, "r+b") as file_:
+
+            compactMmap = mmap.mmap(file_.fileno(), 0)
+            offset = len(self.__MAGIC)
+
+            for recordId, record in records:
+                compactMmap[offset:offset + len(record)] = record
+                self.__records[recordId] = offset
+                offset += len(record)
+
+            compactMmap.flush()
+
+        os.replace(compactPath, self.__path)
+        self.__mmap.close()
+        self.__file.close()
+        self.__file = open(self.__path, "r+b")
+        self.__mmap = compactMmap
+        self.__end = offset
+
+        self.__logger.info("Compacted spool to %s pending records in %s bytes", len(records), size)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def __create(cls, path, size):
+        """ Create an empty spool file
+        @param path: Path of the spool file
+        @param size: Size in bytes of the spool file
+        """
+
+        with open(path, "wb") as file_:
+            file_.write(cls.__MAGIC)
+            file_.truncate(size)
+            file_.flush()
+            os.fsync(file_.fileno())
+
+#=======================================================================================================================
+class SpoolError(Exception):
+    pass
@@ -0,0 +1,101 @@
+import fuzz
+import logging
+import messages
+import pytest
+import random
+
+Floor = messages.MessageManualRegistration.Floor
+Attribution = messages.MessageManualRegistration.Attribution.Types
+
+FLOORS_COUNT = 255
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _encodeEach(cardReaderNumbers, doorOpenings, attributions, sequenceNumbers):
+    """ Encode a batch one manual registration at a time
+    @return A bytes object of all frames
+    """
+
+    return b"".join(messages.MessageManualRegistration(cardReaderNumber,
+                                                       set(Floor(index + 1, doorOpening)
+                                                           for index, doorOpening in enumerate(floors) if doorOpening),
+                                                       attribution, sequenceNumber).getAsBytes()
+                    for cardReaderNumber, floors, attribution, sequenceNumber in zip(cardReaderNumbers, doorOpenings,
+                                                                                     attributions, sequenceNumbers))
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _batchArgs(cardReaderNumber = 7, doorOpening = 1, attribution = Attribution.GENERAL, sequenceNumber = 9):
+    """ Arguments of a batch of a valid registration followed by one of the given fields
+    """
+
+    return ([3, cardReaderNumber], [[2] * FLOORS_COUNT, [doorOpening] + [0] * (FLOORS_COUNT - 1)],
+            [Attribution.VIP, attribution], [4, sequenceNumber])
+
+#-----------------------------------------------------------------------------------------------------------------------
+@pytest.fixture(params = ["vectorized", "scalar"])
+def encoding(request, monkeypatch):
+    """ Run a test with and without NumPy
+    """
+
+    if request.param == "vectorized":
+        pytest.importorskip("numpy")
+
+    else:
+        monkeypatch.setattr(messages, "numpy", None)
+
+    return request.param
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_batchEncodesAsEachMessage(encoding):
+
+    args = ([0, 255, 17], [[3] * FLOORS_COUNT, [0] * FLOORS_COUNT, [1, 2, 0] * (FLOORS_COUNT // 3)],
+            [Attribution.GENERAL, Attribution.HANDICAPPED, Attribution.VIP], [255, 0, 128])
+
+    assert messages.MessageManualRegistrationBatch(*args).getAsBytes() == _encodeEach(*args)
+
+#-----------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize("fields", [{"cardReaderNumber": -1}, {"cardReaderNumber": 256}, {"cardReaderNumber": 1.5},
+                                    {"sequenceNumber": -1}, {"sequenceNumber": 256}, {"sequenceNumber": 2.0},
+                                    {"attribution": 0}, {"attribution": -1}, {"attribution": 0x130},
+                                    {"attribution": 48.0}, {"doorOpening": -1}, {"doorOpening": 4},
+                                    {"doorOpening": 1.5}])
+def test_batchRejectsAsEachMessage(encoding, fields):
+
+    args = _batchArgs(**fields)
+
+    with pytest.raises(messages.StructureError):
+        _encodeEach(*args)
+
+    with pytest.raises(messages.StructureError):
+        messages.MessageManualRegistrationBatch(*args)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_roundTrip():
+
+    assert fuzz.checkRoundTrip(random.Random(0), 200)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_factoryFuzzing():
+
+    fuzz.fuzzFactory(logging.getLogger("test"), random.Random(0), 2000)
+
+#-----------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize("bufferSize", [20, 300, 4096])
+def test_connectorFuzzing(bufferSize):
+
+    assert fuzz.fuzzConnector(logging.getLogger("test"), random.Random(bufferSize), 2000, bufferSize)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_encodingRate():
+
+    assert fuzz.measureEncoding(100000) >= fuzz.MIN_ENCODE_RATE
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_decodingRate():
+
+    assert fuzz.measureDecoding(logging.getLogger("test"), 100000) >= fuzz.MIN_DECODE_RATE
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_emptyBatchIsRejected(encoding):
+
+    with pytest.raises(messages.StructureError):
+        messages.MessageManualRegistrationBatch([], [], [], [])
@@ -0,0 +1,369 @@
+import asyncio
+import conectivity
+import logging
+import messages
+import metrics
+import pytest
+import simulator
+import time
+
+Attribution = messages.MessageManualRegistration.Attribution.Types
+
+_LOGGER = logging.getLogger("test")
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _registration(cardReaderNumber, attribution = Attribution.GENERAL, doorOpening = 1):
+    """ Create a manual registration of a single floor
+    """
+
+    return messages.MessageManualRegistration(cardReaderNumber,
+                                              set([messages.MessageManualRegistration.Floor(1, doorOpening)]),
+                                              attribution, 0)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _response(sequenceNumber):
+    """ Create a registration response as received from a controller
+    """
+
+    return messages.MessageRegistrationResponse(bytes([messages.MessageInterface._HEADER_LENGTH_REGISTRATION_RESPONSE,
+                                                       messages.MessageInterface._HEADER_VERSION, 0x00, 0x00,
+                                                       messages.MessageInterface._COMMAND_REGISTRATION_RESPONSE,
+                                                       sequenceNumber]) + b"0011")
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _takeAll(queue):
+    return [entry.message for entry in queue.take(1024, 1 << 20)]
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_queueSendsByPriority():
+
+    queue = conectivity._OutboundQueue(_LOGGER, 8)
+    general, vip, handicapped = (_registration(1), _registration(2, Attribution.VIP),
+                                 _registration(3, Attribution.HANDICAPPED))
+    healthCheck = messages.MessageHealthCheck()
+
+    for message in (general, vip, healthCheck, handicapped):
+        assert queue.put(message, None)
+
+    assert _takeAll(queue) == [healthCheck, vip, handicapped, general]
+    assert len(queue) == 0
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_fullQueueEvictsOldestGeneralForHigherPriority():
+
+    droppedMessages = []
+    queue = conectivity._OutboundQueue(_LOGGER, 2, droppedMessages.extend)
+    first, second, vip = _registration(1), _registration(2), _registration(3, Attribution.VIP)
+
+    assert queue.put(first, None) and queue.put(second, None)
+    assert not queue.put(_registration(4), None)
+    assert queue.put(vip, None)
+    assert droppedMessages == [first]
+
+    # Health checks are not counted
+    assert queue.put(messages.MessageHealthCheck(), None)
+    assert len(queue) == 3
+
+    assert _takeAll(queue)[1:] == [vip, second]
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_queueDropsExpiredMessages():
+
+    droppedMessages = []
+    queue = conectivity._OutboundQueue(_LOGGER, 2, droppedMessages.extend)
+    expired, alive = _registration(1), _registration(2)
+    queue.put(expired, time.monotonic() - 1)
+    queue.put(alive, time.monotonic() + 60)
+
+    assert _takeAll(queue) == [alive]
+    assert droppedMessages == [expired]
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_queueReplacesRemovesAndPutsBack():
+
+    queue = conectivity._OutboundQueue(_LOGGER, 4)
+    first, second, replacement = _registration(1), _registration(2), _registration(3)
+    queue.put(first, None)
+    queue.put(second, None)
+
+    assert queue.replace(first, replacement, None)
+    assert not queue.replace(first, _registration(4), None)
+    assert not queue.replace(second, _registration(5, Attribution.VIP), None)
+    assert queue.remove(second) and not queue.remove(second)
+
+    batch = queue.take(1, 1 << 20)
+    queue.put(first, None)
+    queue.putBack(batch)
+
+    assert _takeAll(queue) == [replacement, first]
+
+#=======================================================================================================================
+class _Table(object):
+    """ An in flight table sending into an outbound queue
+    """
+
+    def __init__(self, queueSize = 1024, maxWaitingCount = 4):
+
+        self.queue = conectivity._OutboundQueue(_LOGGER, queueSize)
+        self.metrics = metrics.ConnectionMetrics()
+        self.table = conectivity._InFlightTable(_LOGGER, self.queue.put, self.queue.replace, self.queue.remove,
+                                                maxWaitingCount, self.metrics)
+
+    def write(self):
+        """ Take all queued messages as if written to the socket
+        @return A list of the written messages
+        """
+
+        written = _takeAll(self.queue)
+        self.table.onSent(written)
+
+        return written
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_requestsWaitForASequenceNumberUpToABound():
+
+    async def run():
+
+        table = _Table(maxWaitingCount = 2)
+        futures = [table.table.add(_registration(i % 256), 1.0, 0) for i in range(259)]
+        written = table.write()
+
+        assert sorted(message.sequenceNumber for message in written) == list(range(256))
+        assert [future.done() for future in futures[256:]] == [False, False, True]
+        assert isinstance(futures[258].exception(), asyncio.TimeoutError)
+
+        # A released sequence number is handed to the oldest waiting request
+        table.table.resolve(_response(written[0].sequenceNumber))
+        await asyncio.sleep(0)
+
+        assert futures[0].result().sequenceNumber == written[0].sequenceNumber
+        assert [message.cardReaderNumber for message in table.write()] == [256 % 256]
+
+    asyncio.run(run())
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_requestIsRetransmittedAfterItsTimeoutThenFails():
+
+    async def run():
+
+        table = _Table()
+        future = table.table.add(_registration(1), 0.02, 1)
+
+        assert len(table.write()) == 1
+        await asyncio.sleep(0.03)
+
+        assert not future.done()
+        assert len(table.write()) == 1
+        await asyncio.sleep(0.03)
+
+        assert isinstance(future.exception(), asyncio.TimeoutError)
+
+    asyncio.run(run())
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_requestTimeoutStartsOnceWritten():
+
+    async def run():
+
+        table = _Table()
+        future = table.table.add(_registration(1), 0.01, 0)
+        await asyncio.sleep(0.05)
+
+        # Still waiting in the queue, a single copy of it
+        assert not future.done()
+        assert len(table.queue) == 1
+
+        written = table.write()
+        table.table.resolve(_response(written[0].sequenceNumber))
+
+        assert future.result().sequenceNumber == written[0].sequenceNumber
+
+    asyncio.run(run())
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_queuedRequestExpiresAtItsDeadline():
+
+    async def run():
+
+        table = _Table()
+        future = table.table.add(_registration(1), 1.0, 2, time.monotonic() + 0.02)
+        await asyncio.sleep(0.05)
+
+        assert isinstance(future.exception(), asyncio.TimeoutError)
+        assert len(table.queue) == 0
+
+    asyncio.run(run())
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_doneRequestLeavesNoCopyQueued():
+
+    async def run():
+
+        table = _Table()
+        future = table.table.add(_registration(1), 1.0, 0)
+        future.cancel()
+        await asyncio.sleep(0)
+
+        assert len(table.queue) == 0
+
+    asyncio.run(run())
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_unsentRequestIsReplacedUnderItsKey():
+
+    async def run():
+
+        table = _Table()
+        first = table.table.add(_registration(1, doorOpening = 1), 1.0, 0, key = 1)
+        second = table.table.add(_registration(1, doorOpening = 2), 1.0, 0, key = 1)
+
+        assert first is second
+        assert table.metrics.registrationsCoalesced == 1
+
+        written = table.write()
+        expected = _registration(1, doorOpening = 2).withSequenceNumber(written[0].sequenceNumber)
+
+        assert [bytes(message.getAsBytes()) for message in written] == [bytes(expected.getAsBytes())]
+
+        # Once written, another request is sent
+        assert table.table.add(_registration(1, doorOpening = 3), 1.0, 0, key = 1) is not first
+
+    asyncio.run(run())
+
+#=======================================================================================================================
+class _Controllers(object):
+    """ Simulated controllers started on demand, and stopped once the test ends
+    """
+
+    def __init__(self):
+        self.__runningControllers = []
+
+    def start(self):
+        controller = simulator.Controller(_LOGGER)
+        controller.start()
+        self.__runningControllers.append(controller)
+
+        return controller
+
+    def stop(self, controller):
+        self.__runningControllers.remove(controller)
+        controller.stop()
+
+    def stopAll(self):
+        while self.__runningControllers:
+            self.stop(self.__runningControllers[-1])
+
+#-----------------------------------------------------------------------------------------------------------------------
+@pytest.fixture
+def controllers():
+
+    controllers_ = _Controllers()
+    yield controllers_
+    controllers_.stopAll()
+
+#-----------------------------------------------------------------------------------------------------------------------
+async def _waitFor(predicate, timeout = 2.0):
+    """ Wait until a predicate holds
+    """
+
+    deadline = time.monotonic() + timeout
+
+    while not predicate():
+
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.01)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_deltaModeSkipsUnchangedRights(controllers):
+
+    controller = controllers.start()
+
+    async def run():
+
+        connection = conectivity.AsyncConnection(_LOGGER, "127.0.0.1", controller.port, 4096, 60, 0.1,
+                                                 deltaMode = True)
+        task = asyncio.ensure_future(connection.run())
+
+        try:
+            assert await connection.sendRequest(_registration(1)) is not None
+            assert await connection.sendRequest(_registration(1)) is None
+            assert await connection.sendRequest(_registration(1, doorOpening = 2)) is not None
+            assert connection.metrics.registrationsSkipped == 1
+
+        finally:
+            connection.stop()
+            await task
+
+    asyncio.run(run())
+
+    assert controller.registrationsCount == 2
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_poolRoutesByBankToLiveControllers(controllers):
+
+    first, second = controllers.start(), controllers.start()
+
+    async def run():
+
+        pool = conectivity.AsyncConnectionPool(_LOGGER, {"a": ("127.0.0.1", first.port),
+                                                         "b": ("127.0.0.1", second.port)},
+                                               4096, 60, 0.1, bankMap = {5: "b"})
+        task = asyncio.ensure_future(pool.run())
+
+        try:
+            await _waitFor(lambda: all(connection.isAlive for connection in pool.connections.values()))
+
+            assert [pool.send(_registration(5)) for _ in range(3)] == ["b"] * 3
+            assert sorted(pool.send(_registration(1)) for _ in range(4)) == ["a", "a", "b", "b"]
+
+            controllers.stop(second)
+            await _waitFor(lambda: not pool.connections["b"].isAlive)
+
+            # A mapped card reader whose controller is dead is served by a live one
+            assert [pool.send(_registration(5)) for _ in range(3)] == ["a"] * 3
+
+        finally:
+            pool.stop()
+            await task
+
+    asyncio.run(run())
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_spooledRequestsAreSentAfterRestart(controllers, tmp_path):
+
+    spoolPath = str(tmp_path / "connection.spool")
+
+    async def sendUnreachable():
+
+        # Nothing listens on the port of a stopped controller
+        unreachable = controllers.start()
+        port = unreachable.port
+        controllers.stop(unreachable)
+
+        connection = conectivity.AsyncConnection(_LOGGER, "127.0.0.1", port, 4096, 60, 0.1, spoolPath = spoolPath)
+        task = asyncio.ensure_future(connection.run())
+        futures = [connection.sendRequest(_registration(i)) for i in range(5)]
+        await asyncio.sleep(0.1)
+        connection.stop()
+        await task
+
+        assert all(future.cancelled() for future in futures)
+
+    async def sendReachable(controller):
+
+        connection = conectivity.AsyncConnection(_LOGGER, "127.0.0.1", controller.port, 4096, 60, 0.1,
+                                                 spoolPath = spoolPath)
+        task = asyncio.ensure_future(connection.run())
+
+        try:
+            await _waitFor(lambda: controller.registrationsCount == 5)
+
+        finally:
+            connection.stop()
+            await task
+
+    asyncio.run(sendUnreachable())
+    controller = controllers.start()
+    asyncio.run(sendReachable(controller))
+
+    assert controller.registrationsCount == 5
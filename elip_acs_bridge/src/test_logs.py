@@ -0,0 +1,92 @@
+import logging
+import logs
+import time
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _record(msg, levelno = logging.INFO, rateLimit = True, name = "test"):
+    """ Create a record as logged with or without RATE_LIMIT extra fields
+    """
+
+    fields = {"name": name, "msg": msg, "args": (), "levelno": levelno, "levelname": logging.getLevelName(levelno)}
+
+    if rateLimit:
+        fields.update(logs.RATE_LIMIT)
+
+    return logging.makeLogRecord(fields)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_recordsWithoutRateLimitAreKept():
+
+    summaries = []
+    filter_ = logs.RateLimitFilter(summaries.append, 60, 2)
+
+    assert all(filter_.filter(_record("Sending", rateLimit = False)) for _ in range(10))
+
+    filter_.flush()
+
+    assert summaries == []
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_burstIsKeptPerLoggerAndMessage():
+
+    summaries = []
+    filter_ = logs.RateLimitFilter(summaries.append, 60, 2)
+
+    assert [filter_.filter(_record("Sending")) for _ in range(4)] == [True, True, False, False]
+    assert filter_.filter(_record("Receiving"))
+    assert filter_.filter(_record("Sending", name = "other"))
+    assert summaries == []
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_summaryFollowsThePeriodOfDroppedRecords():
+
+    summaries = []
+    filter_ = logs.RateLimitFilter(summaries.append, 0.05, 1)
+
+    for levelno in (logging.INFO, logging.WARNING, logging.ERROR, logging.INFO):
+        filter_.filter(_record("Retrying", levelno))
+
+    assert summaries == []
+
+    # A new period lets records through again, after the summary of the previous one
+    time.sleep(0.06)
+
+    assert filter_.filter(_record("Retrying"))
+    assert len(summaries) == 1
+    assert summaries[0].levelno == logging.ERROR and summaries[0].name == "test"
+    assert summaries[0].getMessage() == "3 records like \"Retrying\" were dropped in 0.05 seconds"
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_stoppingQueueLoggingFlushesSummaries():
+
+    class ListHandler(logging.Handler):
+
+        def __init__(self):
+            super(ListHandler, self).__init__()
+            self.records = []
+
+        def emit(self, record):
+            self.records.append(record)
+
+    logger = logging.getLogger("test.logs")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = ListHandler()
+    logger.addHandler(handler)
+
+    listener = logs.startQueueLogging(logger, 60, 2)
+
+    try:
+        for i in range(5):
+            logger.warning("Retry %s", i, extra = logs.RATE_LIMIT)
+
+        logger.info("Connected")
+
+    finally:
+        listener.stop()
+        logger.handlers.clear()
+
+    assert [record.getMessage() for record in handler.records] == [
+                                                        "Retry 0", "Retry 1", "Connected",
+                                                        "3 records like \"Retry %s\" were dropped in 60 seconds"]
+    assert handler.records[-1].levelno == logging.WARNING
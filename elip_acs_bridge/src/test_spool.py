@@ -0,0 +1,111 @@
+import logging
+import os
+import pytest
+import spool
+import time
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _openSpool(tmp_path):
+    return spool.Spool(logging.getLogger("test"), str(tmp_path / "test.spool"), size = 4096)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_acknowledgeAfterCloseIsIgnored(tmp_path):
+
+    spool_ = _openSpool(tmp_path)
+    recordId = spool_.append(b"frame", None)
+    spool_.close()
+    spool_.acknowledge(recordId)
+
+    spool_ = _openSpool(tmp_path)
+
+    assert [frame for _, frame, _ in spool_.recover()] == [b"frame"]
+    spool_.close()
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_pendingRecordsAreRecoveredInOrder(tmp_path):
+
+    spool_ = _openSpool(tmp_path)
+    first = spool_.append(b"first", None)
+    spool_.append(b"second", time.monotonic() + 60)
+    spool_.append(b"expired", time.monotonic() - 1)
+    spool_.append(b"third", None)
+    spool_.acknowledge(first)
+    spool_.close()
+
+    spool_ = _openSpool(tmp_path)
+    recovered = spool_.recover()
+
+    assert [frame for _, frame, _ in recovered] == [b"second", b"third"]
+    assert recovered[0][2] == pytest.approx(time.monotonic() + 60, abs = 1)
+    assert recovered[1][2] is None
+    assert len(spool_) == 2 and spool_.recover() == []
+
+    # Recovered records are acknowledged like appended ones
+    spool_.acknowledge(recovered[0][0])
+    spool_.close()
+    spool_ = _openSpool(tmp_path)
+
+    assert [frame for _, frame, _ in spool_.recover()] == [b"third"]
+    spool_.close()
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_fullSpoolIsCompacted(tmp_path):
+
+    spool_ = _openSpool(tmp_path)
+    frame = bytes(200)
+
+    # Acknowledged records are reclaimed many times over the initial size
+    for i in range(100):
+
+        recordId = spool_.append(frame[:-1] + bytes([i]), None)
+
+        if i % 10 != 0:
+            spool_.acknowledge(recordId)
+
+    # Pending records outgrow the initial size
+    for i in range(100, 130):
+        spool_.append(frame[:-1] + bytes([i]), None)
+
+    spool_.close()
+
+    assert os.path.getsize(str(tmp_path / "test.spool")) > 4096
+
+    spool_ = _openSpool(tmp_path)
+
+    assert [frame_[-1] for _, frame_, _ in spool_.recover()] == list(range(0, 100, 10)) + list(range(100, 130))
+    spool_.close()
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_tornRecordIsDiscarded(tmp_path):
+
+    spool_ = _openSpool(tmp_path)
+    spool_.append(b"whole", None)
+    spool_.append(b"torn", None)
+    spool_.close()
+
+    path = str(tmp_path / "test.spool")
+
+    with open(path, "r+b") as file_:
+        content = file_.read()
+        file_.seek(content.index(b"torn"))
+        file_.write(b"t0rn")
+
+    spool_ = _openSpool(tmp_path)
+
+    assert [frame for _, frame, _ in spool_.recover()] == [b"whole"]
+
+    # Appends go where the torn record was
+    spool_.append(b"next", None)
+    spool_.close()
+    spool_ = _openSpool(tmp_path)
+
+    assert [frame for _, frame, _ in spool_.recover()] == [b"whole", b"next"]
+    spool_.close()
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_foreignFileIsRejected(tmp_path):
+
+    (tmp_path / "test.spool").write_bytes(b"not a spool file")
+
+    with pytest.raises(spool.SpoolError):
+        _openSpool(tmp_path)
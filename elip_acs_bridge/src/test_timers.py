@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+import timers
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _run(coroutine):
+    """ Run a coroutine on a new event loop
+    """
+
+    return asyncio.run(coroutine)
+
+#-----------------------------------------------------------------------------------------------------------------------
+async def _fireTimes(wheel, delays):
+    """ Schedule a timer per delay, all at once, and wait for all of them to fire
+    @return A list of (delay, time in seconds from scheduling to firing) tuples
+    """
+
+    loop = asyncio.get_event_loop()
+    firedTimes = []
+    start = loop.time()
+
+    for delay in delays:
+        wheel.schedule(delay, lambda delay: firedTimes.append((delay, loop.time() - start)), delay)
+
+    while len(wheel):
+        await asyncio.sleep(wheel.tick)
+
+    return firedTimes
+
+#-----------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize("delays", [[0.05], [0, 0.001, 0.049, 0.05, 0.051, 0.12], [0.03] * 5])
+def test_timerNeverFiresEarly(delays):
+
+    wheel = timers.TimerWheel(tick = 0.05, slotsCount = 4)
+    firedTimes = _run(_fireTimes(wheel, delays))
+
+    assert sorted(delay for delay, _ in firedTimes) == sorted(delays)
+
+    for delay, firedTime in firedTimes:
+        assert delay <= firedTime < delay + wheel.tick + 0.05
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_timerScheduledBetweenTicksNeverFiresEarly():
+
+    async def run():
+
+        wheel = timers.TimerWheel(tick = 0.05)
+        loop = asyncio.get_event_loop()
+        firedTimes = []
+        wheel.schedule(1, lambda: None)
+
+        # Scheduled part way through the tick of the cursor
+        for _ in range(10):
+            await asyncio.sleep(0.013)
+            scheduledTime = loop.time()
+            wheel.schedule(0.05, lambda scheduledTime: firedTimes.append(loop.time() - scheduledTime), scheduledTime)
+
+        await asyncio.sleep(0.2)
+
+        return firedTimes
+
+    firedTimes = _run(run())
+
+    assert len(firedTimes) == 10
+    assert all(0.05 <= firedTime for firedTime in firedTimes)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_timerFurtherThanATurnWaitsForItsRounds():
+
+    wheel = timers.TimerWheel(tick = 0.01, slotsCount = 4)
+    firedTimes = _run(_fireTimes(wheel, [0.015, 0.095]))
+
+    assert [delay for delay, _ in sorted(firedTimes, key = lambda item: item[1])] == [0.015, 0.095]
+    assert all(delay <= firedTime for delay, firedTime in firedTimes)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_cancelledTimerDoesNotFire():
+
+    async def run():
+
+        wheel = timers.TimerWheel(tick = 0.01)
+        fired = []
+        timer = wheel.schedule(0.02, fired.append, "cancelled")
+        wheel.schedule(0.03, fired.append, "kept")
+        wheel.cancel(timer)
+        await asyncio.sleep(0.08)
+
+        return fired, len(wheel)
+
+    assert _run(run()) == (["kept"], 0)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def test_wheelWakesUpOnlyForOccupiedSlots(monkeypatch):
+
+    async def run():
+
+        wheel = timers.TimerWheel(tick = 0.01, slotsCount = 512)
+        loop = asyncio.get_event_loop()
+        wakeUpsCount = [0]
+        callAt = loop.call_at
+
+        def countingCallAt(when, callback, *args, **kwargs):
+
+            if getattr(callback, "__self__", None) is wheel:
+                wakeUpsCount[0] += 1
+
+            return callAt(when, callback, *args, **kwargs)
+
+        monkeypatch.setattr(loop, "call_at", countingCallAt)
+        wheel.schedule(0.3, lambda: None)
+        await asyncio.sleep(0.35)
+
+        return wakeUpsCount[0], len(wheel)
+
+    # A single wake up for a single timer, instead of one per tick
+    assert _run(run()) == (1, 0)
@@ -0,0 +1,178 @@
+import asyncio
+import math
+
+#=======================================================================================================================
+class TimerWheel(object):
+    """ A hashed timing wheel of coarse timers, so that many connections sharing an event loop wake it up once per tick
+        instead of each on its own. The loop is only woken up for slots which hold timers, and a timer fires no
+        earlier than it was scheduled for and no later than a tick after that.
+    """
+
+    #===================================================================================================================
+    class Timer(object):
+
+        __slots__ = ("callback", "args", "rounds", "slot", "isCancelled")
+
+        def __init__(self, callback, args, rounds, slot):
+            """ C'tor
+            @param callback: Callable to call once the timer fires
+            @param args: Arguments of the callback
+            @param rounds: Number of full turns of the wheel left before the timer fires
+            @param slot: Index of the slot holding the timer
+            """
+
+            self.callback = callback
+            self.args = args
+            self.rounds = rounds
+            self.slot = slot
+            self.isCancelled = False
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __init__(self, tick = 0.05, slotsCount = 512):
+        """ C'tor
+        @param tick: Resolution in seconds of the timers
+        @param slotsCount: Number of slots of the wheel, timers further than a full turn wait for several turns
+        """
+
+        self.__tick = tick
+        self.__slots = [[] for _ in range(slotsCount)]
+        self.__cursor = 0
+        self.__count = 0
+
+        # Loop time the slot at the cursor is due at, and the pending wake up of the loop
+        self.__cursorTime = None
+        self.__wakeUpHandle = None
+        self.__wakeUpTime = None
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __len__(self): return self.__count
+
+#-----------------------------------------------------------------------------------------------------------------------
+    @property
+    def tick(self): return self.__tick
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def schedule(self, delay, callback, *args):
+        """ Schedule a callback
+        @attention: Must be called from the thread running the event loop
+        @param delay: Time in seconds to call the callback in
+        @param callback: Callable to call
+        @param args: Arguments of the callback
+        @return A timer to cancel the callback with
+        """
+
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+
+        # An empty wheel is turned to the present, instead of catching up with the slots it passed while idle
+        if not self.__count:
+            self.__cursorTime = now
+
+        # Slot is counted from the time the cursor is due at, so the time passed since is not counted twice
+        ticks = max(0, int(math.ceil((now + delay - self.__cursorTime) / self.__tick)))
+        rounds, offset = divmod(ticks, len(self.__slots))
+        slot = (self.__cursor + offset) % len(self.__slots)
+        timer = self.Timer(callback, args, rounds, slot)
+        self.__slots[slot].append(timer)
+        self.__count += 1
+
+        slotTime = self.__cursorTime + offset * self.__tick
+
+        if self.__wakeUpHandle is None or slotTime < self.__wakeUpTime:
+            self.__wakeUpAt(loop, slotTime)
+
+        return timer
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def cancel(self, timer):
+        """ Cancel a timer, has no effect once it fired
+        @attention: Must be called from the thread running the event loop
+        @param timer: Timer as returned by schedule()
+        """
+
+        if timer.isCancelled:
+            return
+
+        timer.isCancelled = True
+
+        try:
+            self.__slots[timer.slot].remove(timer)
+
+        except ValueError:
+
+            # Already fired
+            return
+
+        self.__count -= 1
+
+        if not self.__count and self.__wakeUpHandle is not None:
+            self.__wakeUpHandle.cancel()
+            self.__wakeUpHandle = None
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __wakeUpAt(self, loop, wakeUpTime):
+        """ Have the loop visit the due slots at a given time, instead of at the pending wake up
+        @param loop: Event loop
+        @param wakeUpTime: Loop time to wake up at
+        """
+
+        if self.__wakeUpHandle is not None:
+            self.__wakeUpHandle.cancel()
+
+        self.__wakeUpTime = wakeUpTime
+        self.__wakeUpHandle = loop.call_at(wakeUpTime, self.__onWakeUp, loop)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __onWakeUp(self, loop):
+        """ Fire the timers of all due slots, and wake up again once the next slot holding timers is due
+        @param loop: Event loop
+        """
+
+        self.__wakeUpHandle = None
+        now = loop.time()
+        due = []
+
+        # Empty slots cost a step each, rounds are counted on every pass of a slot
+        while self.__count and self.__cursorTime <= now:
+            self.__advance(due)
+
+        if self.__count:
+
+            offset = 0
+
+            while not self.__slots[(self.__cursor + offset) % len(self.__slots)]:
+                offset += 1
+
+            self.__wakeUpAt(loop, self.__cursorTime + offset * self.__tick)
+
+        for timer in due:
+
+            # A callback may cancel timers which are due in the same tick
+            if not timer.isCancelled:
+                timer.isCancelled = True
+                timer.callback(*timer.args)
+
+#-----------------------------------------------------------------------------------------------------------------------
+    def __advance(self, due):
+        """ Take the due timers of the current slot and move to the next one
+        @param due: A list to append the due timers to
+        """
+
+        slot = self.__slots[self.__cursor]
+
+        if slot:
+
+            self.__slots[self.__cursor] = []
+
+            for timer in slot:
+
+                if timer.rounds:
+                    timer.rounds -= 1
+                    self.__slots[self.__cursor].append(timer)
+
+                else:
+                    self.__count -= 1
+                    due.append(timer)
+
+        self.__cursor = (self.__cursor + 1) % len(self.__slots)
+        self.__cursorTime += self.__tick